@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class MyauthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myauth'
+
+    def ready(self):
+        from django.db.models.signals import post_delete
+        from shopapp.jobs import register_job_handler
+        from shopapp.media import register_reference_source
+        from shopapp.models import BackgroundJob
+
+        from .avatars import avatar_variant_names, process_avatar, release_avatar_variants
+        from .models import Profile
+
+        register_reference_source(avatar_variant_names)
+        register_job_handler(BackgroundJob.Kind.AVATAR_PROCESS, process_avatar)
+        post_delete.connect(release_avatar_variants, sender=Profile)
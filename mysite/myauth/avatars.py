@@ -0,0 +1,100 @@
+"""
+Обработка аватаров.
+
+Запрос загрузки только сохраняет оригинал и ставит фоновую задачу (shopapp.jobs),
+поэтому ответ приходит сразу. Задача вырезает из оригинала квадрат, уменьшает его
+до размеров settings.AVATAR_SIZES и сохраняет копии в WebP в ContentAddressedStorage.
+Имена копий записываются в Profile.avatar_variants. Страницы показывают
+копию нужного размера, а пока копий нет - оригинал.
+"""
+
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from mysite.db import write_transaction
+from shopapp.media import add_references, remove_references
+from shopapp.storage import blob_storage
+
+from .models import Profile
+
+AVATAR_FORMAT = "WEBP"
+
+
+def avatar_sizes() -> list[int]:
+    return sorted(settings.AVATAR_SIZES)
+
+
+def render_variants(name: str) -> dict[str, str]:
+    """
+    Квадратные копии аватара {размер: имя файла}.
+    """
+    storage = blob_storage()
+    with storage.open(name, "rb") as source, Image.open(source) as original:
+        # Оригинал декодируется сразу в уменьшенном масштабе, но не меньше самой большой копии
+        largest = avatar_sizes()[-1]
+        original.draft(None, (largest, largest))
+        image = ImageOps.exif_transpose(original)
+
+    mode = "RGBA" if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info else "RGB"
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    variants = {}
+    for size in avatar_sizes():
+        square = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        square.save(buffer, format=AVATAR_FORMAT, quality=settings.AVATAR_QUALITY)
+        # Ключи строками: так их вернёт JSONField
+        variants[str(size)] = storage.save(f"avatar-{size}.webp", ContentFile(buffer.getvalue()))
+    return variants
+
+
+def process_avatar(job):
+    """
+    Обработчик задачи AVATAR_PROCESS: params = {"profile": pk, "avatar": имя загруженного файла}.
+    """
+    profile_id, name = job.params["profile"], job.params["avatar"]
+    variants = render_variants(name)
+
+    @write_transaction
+    def store():
+        # Пока шла обработка, пользователь мог загрузить другой аватар: тогда эти копии не нужны
+        profile = Profile.objects.filter(pk=profile_id, avatar=name).first()
+        if profile is None:
+            return False
+        add_references(variants.values())
+        remove_references(profile.avatar_variants.values())
+        Profile.objects.filter(pk=profile_id).update(avatar_variants=variants)
+        return True
+
+    stored = store()
+    job.rows_processed = 1
+    job.result = {"variants": variants if stored else {}, "superseded": not stored}
+
+
+def avatar_variant_names():
+    """
+    Имена всех копий аватаров, для пересчёта ссылок в shopapp.media.
+    """
+    for variants in Profile.objects.exclude(avatar_variants={}).values_list("avatar_variants", flat=True).iterator():
+        yield from variants.values()
+
+
+def release_avatar_variants(sender, instance: Profile, **kwargs):
+    remove_references(instance.avatar_variants.values())
+
+
+def avatar_url(profile: Profile, size: int) -> str | None:
+    """
+    URL самой маленькой копии не меньше size (или самой большой), оригинал, пока копий нет.
+    """
+    variants = {int(key): name for key, name in profile.avatar_variants.items()}
+    if variants:
+        fitting = min((key for key in variants if key >= size), default=max(variants))
+        return blob_storage().url(variants[fitting])
+    if profile.avatar:
+        return profile.avatar.url
+    return None
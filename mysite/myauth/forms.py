@@ -1,16 +1,59 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.template.defaultfilters import filesizeformat
+
+from shopapp.jobs import enqueue_job
+from shopapp.media import remove_references
+from shopapp.models import BackgroundJob
 
 from .models import Profile
 
 
-class ProfileAvatarForm(forms.ModelForm):
+class AvatarFormMixin:
+    """
+    Новый аватар: размер файла ограничен, старые копии сбрасываются, новые создаёт фоновая задача.
+    """
+
+    def clean_avatar(self):
+        avatar = self.cleaned_data.get("avatar")
+        if avatar and "avatar" in self.changed_data and avatar.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+            raise forms.ValidationError(
+                "The avatar must be at most %(limit)s.",
+                code="file_too_large",
+                params={"limit": filesizeformat(settings.AVATAR_MAX_UPLOAD_SIZE)},
+            )
+        return avatar
+
+    def save(self, commit=True):
+        if "avatar" in self.changed_data:
+            self._old_avatar_variants = self.instance.avatar_variants
+            self.instance.avatar_variants = {}
+        return super().save(commit)
+
+    def _save_m2m(self):
+        # Вызывается после сохранения профиля: из save() или, при commit=False, из save_m2m()
+        super()._save_m2m()
+        old_variants = self.__dict__.pop("_old_avatar_variants", None)
+        if old_variants is None:
+            return
+
+        remove_references(old_variants.values())
+        if self.instance.avatar:
+            enqueue_job(
+                BackgroundJob.Kind.AVATAR_PROCESS,
+                user=self.instance.user,
+                params={"profile": self.instance.pk, "avatar": self.instance.avatar.name},
+            )
+
+
+class ProfileAvatarForm(AvatarFormMixin, forms.ModelForm):
     class Meta:
         model = Profile
         fields = ("avatar",)
 
 
-class ProfileUpdateForm(forms.ModelForm):
+class ProfileUpdateForm(AvatarFormMixin, forms.ModelForm):
     class Meta:
         model = Profile
         fields = ("bio", "agreement_accepted", "avatar")
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:39
+
+import myauth.utils
+import shopapp.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myauth', '0002_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(null=True, storage=shopapp.storage.blob_storage, upload_to=myauth.utils.profile_avatar_directory_path),
+        ),
+    ]
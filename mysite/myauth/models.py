@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.db import models
 
+from shopapp.storage import blob_storage
+
 from .utils import profile_avatar_directory_path
 
 
@@ -8,4 +10,6 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
     agreement_accepted = models.BooleanField(default=False)
-    avatar = models.ImageField(null=True, upload_to=profile_avatar_directory_path)
+    avatar = models.ImageField(null=True, upload_to=profile_avatar_directory_path, storage=blob_storage)
+    # Квадратные копии аватара в WebP {размер: имя файла}, их создаёт фоновая задача (см. myauth.avatars)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
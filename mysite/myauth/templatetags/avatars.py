@@ -0,0 +1,25 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from ..avatars import avatar_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar(profile, size=96, **attrs):
+    """
+    <img> аватара size x size: {% avatar user.profile 96 alt=user.username %}.
+
+    Для экранов с высокой плотностью пикселей в srcset добавляется копия вдвое больше.
+    """
+    url = avatar_url(profile, size)
+    if url is None:
+        return ""
+
+    attrs = {"src": url, "width": size, **attrs}
+    if profile.avatar_variants:
+        # Копии квадратные; пока их нет, показывается оригинал с его пропорциями
+        attrs = {"height": size, "srcset": f"{url} 1x, {avatar_url(profile, size * 2)} 2x", **attrs}
+    return format_html("<img{}>", flatatt(attrs))
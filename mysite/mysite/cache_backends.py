@@ -0,0 +1,625 @@
+"""
+Бэкенды кеша проекта.
+
+SQLiteCache хранит записи в локальной базе SQLite (WAL) с индексами по времени
+истечения и последнего обращения. Вытеснение удаляет самые старые по обращению
+записи через индекс, а не обходит каталог, как FileBasedCache, а get_many/set_many
+выполняются одним запросом или одной транзакцией. Файл базы общий для всех воркеров
+gunicorn, каждый процесс и поток открывает своё соединение.
+
+TieredSQLiteCache и TieredFileBasedCache добавляют перед общим хранилищем (L2)
+LRU в памяти процесса (L1), так что горячие ключи (экспорт товаров, RSS) не требуют
+ни обращения к диску, ни распаковки. Чтобы L1 не отдавал данные, которые другой
+процесс уже перезаписал или удалил, рядом с хранилищем лежит файл счётчиков,
+отображённый в память всех процессов (mmap). Каждый ключ попадает в один из слотов,
+и любая запись или удаление увеличивает его счётчик. Запись в L1 помнит значение
+счётчика на момент чтения из L2 и считается действительной, только пока оно
+не изменилось. Проверка — одно чтение из общей памяти, без системных вызовов.
+"""
+
+import mmap
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import md5
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.core.files.move import file_move_safe
+
+# Общие для всех экземпляров бэкенда в процессе: Django создаёт по экземпляру на поток
+_l1_stores = {}
+_counters = {}
+_stats = {}
+_registry_lock = threading.Lock()
+
+# Счётчики текущего запроса или задачи, если они собираются (track_request_stats)
+_request_stats = ContextVar("cache_request_stats", default=None)
+
+# Ограничение SQLite на число параметров запроса
+SQLITE_MAX_VARIABLES = 900
+
+
+@contextmanager
+def track_request_stats():
+    """
+    Счётчики обращений к TieredCacheMixin внутри блока, только в текущем контексте.
+
+    В отличие от get_stats() не включают обращения параллельных запросов в других
+    потоках или задачах; sync_to_async копирует контекст, так что учитываются и они.
+    """
+    stats = Counter()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+class GenerationCounters:
+    """
+    Массив счётчиков uint64 в файле, отображённом в память.
+
+    Слот 0 — эпоха всего кеша (увеличивается при clear()), остальные — по хешу ключа.
+    """
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        size = (slots + 1) * 8
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._values = memoryview(self._mmap).cast("Q")
+
+    def slot(self, key: str) -> int:
+        digest = md5(key.encode(), usedforsecurity=False).digest()
+        return int.from_bytes(digest[:8], "little") % self.slots + 1
+
+    def read(self, slot: int) -> tuple[int, int]:
+        return self._values[0], self._values[slot]
+
+    def bump(self, slot: int) -> tuple[int, int]:
+        # Блокировка файла нужна, чтобы два процесса не записали одно и то же новое значение
+        with open(self.path, "rb") as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                self._values[slot] = (self._values[slot] + 1) & 0xFFFFFFFFFFFFFFFF
+                return self._values[0], self._values[slot]
+            finally:
+                locks.unlock(f)
+
+
+class L1Store:
+    """
+    LRU по числу записей и суммарному размеру; хранит pickle, как LocMemCache,
+    чтобы вызывающий код не мог изменить закешированный объект.
+    """
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            pickled, expiry, entry_generation = entry
+            if entry_generation != generation or (expiry is not None and expiry < time.time()):
+                self._pop(key)
+                return None
+
+            self._data.move_to_end(key)
+            return pickled
+
+    def put(self, key, pickled, expiry, generation, max_bytes, max_entries):
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (pickled, expiry, generation)
+            self.size += len(pickled)
+
+            while self._data and (self.size > max_bytes or len(self._data) > max_entries):
+                self._pop(next(iter(self._data)))
+
+    def pop(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кеш в файле SQLite. LOCATION — путь к файлу базы.
+
+    MAX_ENTRIES и CULL_FREQUENCY работают как у встроенных бэкендов: при превышении
+    удаляются истёкшие записи, а затем 1/CULL_FREQUENCY давно не читавшихся.
+    Время обращения обновляется не чаще раза в ACCESS_RESOLUTION секунд на ключ,
+    чтобы чтение горячих ключей не превращалось в запись.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._path = os.path.abspath(location)
+        self.access_resolution = float(options.get("ACCESS_RESOLUTION", 60))
+        self.busy_timeout = float(options.get("BUSY_TIMEOUT", 5))
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        # После fork соединение родителя использовать нельзя
+        if getattr(local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema(connection)
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    @staticmethod
+    def _create_schema(connection):
+        connection.executescript(
+            """
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires REAL,
+                accessed REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cache_entries_expires_idx ON cache_entries (expires);
+            CREATE INDEX IF NOT EXISTS cache_entries_accessed_idx ON cache_entries (accessed);
+
+            -- Число записей для проверки MAX_ENTRIES без COUNT(*) по всей таблице
+            CREATE TABLE IF NOT EXISTS cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                entries INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO cache_size (id, entries) VALUES (1, 0);
+            CREATE TRIGGER IF NOT EXISTS cache_entries_ai AFTER INSERT ON cache_entries BEGIN
+                UPDATE cache_size SET entries = entries + 1 WHERE id = 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS cache_entries_ad AFTER DELETE ON cache_entries BEGIN
+                UPDATE cache_size SET entries = entries - 1 WHERE id = 1;
+            END;
+            COMMIT;
+            """
+        )
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._connection())
+
+    def get(self, key, default=None, version=None):
+        pickled, _ = self._read_entry(self.make_and_validate_key(key, version=version))
+        return default if pickled is None else pickle.loads(pickled)
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        entries = self._read_entries(list(key_map))
+        return {key_map[cache_key]: pickle.loads(pickled) for cache_key, (pickled, _) in entries.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write_entries(
+            [(self.make_and_validate_key(key, version=version), pickle.dumps(value, self.pickle_protocol))],
+            self.get_backend_timeout(timeout),
+        )
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write_entries(
+            [
+                (self.make_and_validate_key(key, version=version), pickle.dumps(value, self.pickle_protocol))
+                for key, value in data.items()
+            ],
+            self.get_backend_timeout(timeout),
+        )
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Перезаписывается только истёкшая запись, поэтому add() атомарен между процессами
+        cache_key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, "
+                "accessed = excluded.accessed WHERE cache_entries.expires < ?",
+                [cache_key, pickle.dumps(value, self.pickle_protocol), self.get_backend_timeout(timeout), now, now],
+            )
+            added = cursor.rowcount > 0
+            if added:
+                self._cull(connection, now)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE cache_entries SET expires = ?, accessed = ? "
+            "WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+            [self.get_backend_timeout(timeout), now, self.make_and_validate_key(key, version=version), now],
+        )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        cache_key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+                [cache_key, time.time()],
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+
+            new_value = pickle.loads(row[0]) + delta
+            connection.execute(
+                "UPDATE cache_entries SET value = ? WHERE key = ?",
+                [pickle.dumps(new_value, self.pickle_protocol), cache_key],
+            )
+        return new_value
+
+    def delete(self, key, version=None):
+        return self._delete_entries([self.make_and_validate_key(key, version=version)]) > 0
+
+    def delete_many(self, keys, version=None):
+        self._delete_entries([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def has_key(self, key, version=None):
+        row = self._connection().execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+            [self.make_and_validate_key(key, version=version), time.time()],
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM cache_entries")
+
+    def close(self, **kwargs):
+        # Соединение потока переиспользуется между запросами
+        pass
+
+    def _read_entry(self, cache_key):
+        return self._read_entries([cache_key]).get(cache_key, (None, None))
+
+    def _read_entries(self, cache_keys) -> dict:
+        """
+        {cache_key: (pickle, expiry)} для живых записей.
+        """
+        connection = self._connection()
+        now = time.time()
+        entries = {}
+        touched = []
+
+        for start in range(0, len(cache_keys), SQLITE_MAX_VARIABLES):
+            chunk = cache_keys[start:start + SQLITE_MAX_VARIABLES]
+            rows = connection.execute(
+                f"SELECT key, value, expires, accessed FROM cache_entries "
+                f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for cache_key, value, expires, accessed in rows:
+                if expires is not None and expires < now:
+                    continue
+                entries[cache_key] = (value, expires)
+                if accessed < now - self.access_resolution:
+                    touched.append((now, cache_key))
+
+        if touched:
+            connection.executemany("UPDATE cache_entries SET accessed = ? WHERE key = ?", touched)
+        return entries
+
+    def _write_entries(self, entries, expiry):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, "
+                "accessed = excluded.accessed",
+                [(cache_key, pickled, expiry, now) for cache_key, pickled in entries],
+            )
+            self._cull(connection, now)
+
+    def _delete_entries(self, cache_keys) -> int:
+        deleted = 0
+        with self._transaction() as connection:
+            for start in range(0, len(cache_keys), SQLITE_MAX_VARIABLES):
+                chunk = cache_keys[start:start + SQLITE_MAX_VARIABLES]
+                deleted += connection.execute(
+                    f"DELETE FROM cache_entries WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).rowcount
+        return deleted
+
+    def _cull(self, connection, now):
+        entries = connection.execute("SELECT entries FROM cache_size WHERE id = 1").fetchone()[0]
+        if entries <= self._max_entries:
+            return
+
+        entries -= connection.execute("DELETE FROM cache_entries WHERE expires < ?", [now]).rowcount
+        if entries <= self._max_entries:
+            return
+
+        if self._cull_frequency == 0:
+            connection.execute("DELETE FROM cache_entries")
+            return
+
+        connection.execute(
+            "DELETE FROM cache_entries WHERE key IN "
+            "(SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)",
+            [max(entries // self._cull_frequency, entries - self._max_entries)],
+        )
+
+
+class _ImmediateTransaction:
+    """
+    BEGIN IMMEDIATE сразу берёт блокировку на запись и не даёт двум воркерам
+    упереться в SQLITE_BUSY при повышении блокировки посреди транзакции.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class TieredCacheMixin:
+    """
+    LRU в памяти процесса перед хранилищем бэкенда.
+
+    Бэкенд предоставляет _read_entries(cache_keys) -> {cache_key: (pickle, expiry)}
+    и _write_entries([(cache_key, pickle)], expiry). Дополнительные OPTIONS:
+        L1_MAX_BYTES — предел суммарного размера значений в L1 (по длине pickle);
+        L1_MAX_ENTRIES — предел числа записей в L1;
+        L1_MAX_VALUE_BYTES — значения крупнее в L1 не попадают;
+        GENERATION_SLOTS — число слотов счётчиков инвалидации.
+    """
+
+    def _init_tiers(self, location: str, counters_path: str, options: dict):
+        self.l1_max_bytes = int(options.get("L1_MAX_BYTES", 32 * 1024 * 1024))
+        self.l1_max_entries = int(options.get("L1_MAX_ENTRIES", 1000))
+        self.l1_max_value_bytes = int(options.get("L1_MAX_VALUE_BYTES", self.l1_max_bytes // 4))
+        slots = int(options.get("GENERATION_SLOTS", 65536))
+
+        with _registry_lock:
+            if location not in _l1_stores:
+                _l1_stores[location] = L1Store()
+                _counters[location] = GenerationCounters(counters_path, slots)
+                _stats[location] = Counter()
+
+        self._l1 = _l1_stores[location]
+        self._counters = _counters[location]
+        self._stats = _stats[location]
+
+    def _count(self, event: str, count: int = 1):
+        self._stats[event] += count
+        request_stats = _request_stats.get()
+        if request_stats is not None:
+            request_stats[event] += count
+
+    def _generation(self, cache_key):
+        return self._counters.read(self._counters.slot(cache_key))
+
+    def get(self, key, default=None, version=None):
+        cache_key = self.make_and_validate_key(key, version=version)
+        generation = self._generation(cache_key)
+
+        pickled = self._l1.get(cache_key, generation)
+        if pickled is not None:
+            self._count("l1_hits")
+            return pickle.loads(pickled)
+
+        # Счётчик прочитан до хранилища: запись, случившаяся между ними, изменит его,
+        # и сохранённое здесь значение не будет принято следующим чтением
+        pickled, expiry = self._read_entries([cache_key]).get(cache_key, (None, None))
+        if pickled is None:
+            self._count("misses")
+            return default
+
+        self._count("l2_hits")
+        self._remember(cache_key, pickled, expiry, generation)
+        return pickle.loads(pickled)
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        generations = {cache_key: self._generation(cache_key) for cache_key in key_map}
+        result = {}
+        missing = []
+
+        for cache_key, key in key_map.items():
+            pickled = self._l1.get(cache_key, generations[cache_key])
+            if pickled is None:
+                missing.append(cache_key)
+            else:
+                self._count("l1_hits")
+                result[key] = pickle.loads(pickled)
+
+        entries = self._read_entries(missing) if missing else {}
+        for cache_key in missing:
+            if cache_key not in entries:
+                self._count("misses")
+                continue
+            pickled, expiry = entries[cache_key]
+            self._count("l2_hits")
+            self._remember(cache_key, pickled, expiry, generations[cache_key])
+            result[key_map[cache_key]] = pickle.loads(pickled)
+
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expiry = self.get_backend_timeout(timeout)
+        entries = [
+            (self.make_and_validate_key(key, version=version), pickle.dumps(value, self.pickle_protocol))
+            for key, value in data.items()
+        ]
+
+        self._write_entries(entries, expiry)
+        for cache_key, pickled in entries:
+            generation = self._counters.bump(self._counters.slot(cache_key))
+            self._remember(cache_key, pickled, expiry, generation)
+        self._count("sets", len(entries))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version)
+        if added:
+            self._invalidate(self.make_and_validate_key(key, version=version))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = super().touch(key, timeout, version)
+        self._invalidate(self.make_and_validate_key(key, version=version))
+        return touched
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        self._invalidate(self.make_and_validate_key(key, version=version))
+        return value
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version)
+        self._invalidate(self.make_and_validate_key(key, version=version))
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version)
+        for key in keys:
+            self._invalidate(self.make_and_validate_key(key, version=version))
+
+    def has_key(self, key, version=None):
+        cache_key = self.make_and_validate_key(key, version=version)
+        if self._l1.get(cache_key, self._generation(cache_key)) is not None:
+            return True
+        return super().has_key(key, version)
+
+    def clear(self):
+        super().clear()
+        self._counters.bump(0)
+        self._l1.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Попадания по уровням в текущем процессе.
+        """
+        stats = dict(self._stats)
+        reads = stats.get("l1_hits", 0) + stats.get("l2_hits", 0) + stats.get("misses", 0)
+        stats["l1_hit_ratio"] = round(stats.get("l1_hits", 0) / reads, 4) if reads else None
+        stats["l2_hit_ratio"] = round(stats.get("l2_hits", 0) / reads, 4) if reads else None
+        stats["l1_entries"] = len(self._l1)
+        stats["l1_bytes"] = self._l1.size
+        return stats
+
+    def _remember(self, cache_key, pickled, expiry, generation):
+        if len(pickled) <= self.l1_max_value_bytes:
+            self._l1.put(cache_key, pickled, expiry, generation, self.l1_max_bytes, self.l1_max_entries)
+
+    def _invalidate(self, cache_key):
+        self._counters.bump(self._counters.slot(cache_key))
+        self._l1.pop(cache_key)
+
+
+class TieredSQLiteCache(TieredCacheMixin, SQLiteCache):
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+        self._init_tiers(self._path, f"{self._path}.generations", params.get("OPTIONS", {}))
+
+
+class TieredFileBasedCache(TieredCacheMixin, FileBasedCache):
+    """
+    FileBasedCache с LRU в памяти процесса.
+
+    CULL_INTERVAL в OPTIONS — не чаще чем раз в столько секунд проверять MAX_ENTRIES,
+    чтобы не обходить каталог кеша на каждой записи.
+    """
+
+    counters_filename = "generations.mmap"
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        options = params.get("OPTIONS", {})
+        self.cull_interval = float(options.get("CULL_INTERVAL", 10))
+        self._last_cull = 0.0
+        self._init_tiers(self._dir, os.path.join(self._dir, self.counters_filename), options)
+
+    def _entry_file(self, cache_key):
+        return os.path.join(self._dir, md5(cache_key.encode(), usedforsecurity=False).hexdigest() + self.cache_suffix)
+
+    def _read_entries(self, cache_keys) -> dict:
+        entries = {}
+        for cache_key in cache_keys:
+            fname = self._entry_file(cache_key)
+            try:
+                with open(fname, "rb") as f:
+                    try:
+                        expiry = pickle.load(f)
+                    except EOFError:
+                        continue
+                    if expiry is None or expiry >= time.time():
+                        entries[cache_key] = (zlib.decompress(f.read()), expiry)
+                        continue
+            except FileNotFoundError:
+                continue
+            self._delete(fname)
+        return entries
+
+    def _write_entries(self, entries, expiry):
+        self._createdir()
+        self._cull()
+
+        for cache_key, pickled in entries:
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+            renamed = False
+            try:
+                with open(fd, "wb") as f:
+                    f.write(pickle.dumps(expiry, self.pickle_protocol))
+                    f.write(zlib.compress(pickled))
+                file_move_safe(tmp_path, self._entry_file(cache_key), allow_overwrite=True)
+                renamed = True
+            finally:
+                if not renamed:
+                    os.remove(tmp_path)
+
+    def _cull(self):
+        now = time.monotonic()
+        if now - self._last_cull < self.cull_interval:
+            return
+        self._last_cull = now
+        super()._cull()
@@ -0,0 +1,244 @@
+"""
+Запись в SQLite из нескольких воркеров gunicorn.
+
+SQLite допускает одного писателя на всю базу. Профиль в settings.DATABASES
+включает WAL, в котором чтения не блокируются записью и не блокируют её, и
+transaction_mode=IMMEDIATE: транзакция берёт блокировку на запись уже на BEGIN
+и ждёт её до busy_timeout. Без этого транзакция, начавшая с чтения, при первой
+записи получает "database is locked" сразу, не дожидаясь busy_timeout.
+
+write_transaction выполняет функцию в отдельной транзакции и при "database is
+locked" повторяет её целиком с экспоненциальной задержкой, не больше
+WRITE_RETRY_ATTEMPTS раз. Внутри уже открытой транзакции повтор невозможен,
+поэтому там функция просто выполняется, а повторяет внешний write_transaction.
+
+Чтение безопасных GET-запросов (списки, выгрузки, фид) идёт через ReadReplicaRouter
+в базу settings.REPLICA_DATABASE: сейчас это тот же файл, открытый с mode=ro и
+query_only, позже её можно заменить настоящей репликой, поменяв только DATABASES.
+После изменяющего запроса PrimaryPinMiddleware ставит cookie, и следующие
+REPLICA_PIN_SECONDS секунд чтения этого клиента идут в основную базу: реплика
+может отставать, а пользователь должен видеть свои изменения.
+"""
+
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+log = logging.getLogger(__name__)
+
+WRITE_RETRY_ATTEMPTS = 5
+# Задержка перед первым повтором, дальше удваивается, но не больше WRITE_RETRY_MAX_DELAY
+WRITE_RETRY_BACKOFF = 0.05
+WRITE_RETRY_MAX_DELAY = 1.0
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+
+def is_database_locked(exc: Exception) -> bool:
+    message = str(exc).lower()
+    return "database is locked" in message or "database table is locked" in message or "database is busy" in message
+
+
+def write_transaction(
+    func=None,
+    *,
+    using: str = DEFAULT_DB_ALIAS,
+    attempts: int = WRITE_RETRY_ATTEMPTS,
+    backoff: float = WRITE_RETRY_BACKOFF,
+):
+    """
+    Декоратор: функция выполняется в transaction.atomic() и повторяется, пока база занята.
+
+    Повтор выполняет функцию заново, поэтому её побочные эффекты вне базы
+    (файлы в хранилище) должны переживать повторный вызов.
+    """
+    if func is None:
+        return lambda func: write_transaction(func, using=using, attempts=attempts, backoff=backoff)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if connections[using].in_atomic_block:
+            return func(*args, **kwargs)
+
+        for attempt in range(1, attempts + 1):
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_database_locked(exc) or attempt == attempts:
+                    raise
+                delay = min(backoff * 2 ** (attempt - 1), WRITE_RETRY_MAX_DELAY) * random.uniform(0.5, 1.5)
+                log.warning("%s: database is locked, retry %d/%d in %.3fs", func.__qualname__, attempt, attempts - 1, delay)
+                time.sleep(delay)
+
+    return wrapper
+
+
+class WriteTransactionMixin:
+    """
+    Для представлений: запросы, меняющие данные (POST, PUT, PATCH, DELETE), выполняются в write_transaction.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        return write_transaction(super().dispatch)(request, *args, **kwargs)
+
+
+# *** Реплика для чтения ***
+
+PIN_COOKIE = "pin_primary"
+
+# База для чтения в текущем запросе; None - решение за Django (default)
+_read_database: ContextVar[str | None] = ContextVar("read_database", default=None)
+# Клиент недавно что-то изменил и читает из основной базы
+_pinned: ContextVar[bool] = ContextVar("pinned_to_primary", default=False)
+
+
+def replica_database() -> str | None:
+    """
+    Псевдоним базы для чтения или None, если отдельной реплики нет.
+
+    Реплика, которая указывает на ту же базу, что и default (в тестах она зеркало
+    default), не используется: незакоммиченные в тестовой транзакции данные видны
+    только через основное соединение.
+    """
+    alias = getattr(settings, "REPLICA_DATABASE", None)
+    if not alias or alias not in settings.DATABASES:
+        return None
+    if connections[alias].settings_dict["NAME"] == connections[DEFAULT_DB_ALIAS].settings_dict["NAME"]:
+        return None
+    return alias
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Чтения внутри блока идут в реплику, если клиент не привязан к основной базе.
+    """
+    token = _read_database.set(None if _pinned.get() else replica_database())
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Чтения внутри блока идут в основную базу, в том числе внутри read_from_replica.
+    """
+    token = _read_database.set(DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+def _stream_from(alias: str | None, content):
+    # Потоковый ответ читается уже после dispatch, поэтому база выставляется на время итерации
+    previous = _read_database.get()
+    _read_database.set(alias)
+    try:
+        yield from content
+    finally:
+        _read_database.set(previous)
+
+
+class ReadReplicaRouter:
+    """
+    Запись и миграции только в default, чтение - в базу, выбранную read_from_replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadReplicaMixin:
+    """
+    Для представлений: GET и HEAD читают из реплики, включая отрисовку шаблона и потоковый ответ.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        with read_from_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            # TemplateResponse выполняет ленивые запросы при отрисовке, уже после dispatch
+            if callable(getattr(response, "render", None)) and not response.is_rendered:
+                response.render()
+            if response.streaming:
+                response.streaming_content = _stream_from(_read_database.get(), response.streaming_content)
+        return response
+
+
+class PrimaryPinMiddleware:
+    """
+    Read-your-writes: после успешного изменяющего запроса клиент
+    REPLICA_PIN_SECONDS секунд читает из основной базы.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = _pinned.set(self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _pinned.set(self.is_pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def is_pinned(request) -> bool:
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    @staticmethod
+    def pin(request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                PIN_COOKIE,
+                str(time.time() + seconds),
+                max_age=seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
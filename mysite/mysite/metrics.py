@@ -0,0 +1,358 @@
+"""
+Метрики запросов в формате Prometheus.
+
+MetricsMiddleware для каждого запроса замеряет время ответа, число и суммарное
+время SQL-запросов (через execute_wrapper) и попадания в кеш именно этого запроса
+(mysite.cache_backends.track_request_stats), и складывает их
+в словарь процесса по имени URL (shopapp:products_list, shopapp:product-list, ...)
+и методу. Накладные расходы — несколько вызовов perf_counter и сложений на запрос,
+поэтому middleware включено всегда, а не только при DEBUG, как debug_toolbar.
+
+Воркеры gunicorn не делят память, поэтому каждый процесс не чаще раза в
+METRICS_FLUSH_INTERVAL секунд записывает свои счётчики в отдельный файл в
+METRICS_DIR (запись во временный файл и os.replace, без блокировок).
+MetricsView суммирует все файлы и отдаёт результат сотрудникам по /metrics.
+Счётчики накопительные, поэтому файлы завершившихся воркеров не удаляются, а
+сворачиваются в metrics-retired.json: сумма не уменьшается, а файлов не больше,
+чем живых воркеров. METRICS_DIR общий только для процессов одной машины:
+живость воркера проверяется по pid.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.files import locks
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from django.views import View
+
+from .cache_backends import track_request_stats
+
+# Границы корзин гистограммы времени ответа, в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNRESOLVED_VIEW = "<unresolved>"
+
+# Сумма счётчиков завершившихся воркеров
+RETIRED_FILENAME = "metrics-retired.json"
+
+# Счётчики процесса: {"view\tmethod": {...}}
+_metrics = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+# pid может достаться новому процессу, поэтому в имени файла ещё и время запуска
+_process_token = f"{os.getpid()}-{time.time_ns()}"
+
+
+def _empty_record() -> dict:
+    return {
+        "requests": 0,
+        "statuses": {},
+        "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+        "seconds": 0.0,
+        "db_queries": 0,
+        "db_seconds": 0.0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+    }
+
+
+class QueryCounter:
+    """
+    execute_wrapper, считающий запросы и их суммарное время.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+def record(view: str, method: str, status: int, seconds: float, queries: QueryCounter, cache_stats: dict):
+    status_class = f"{status // 100}xx"
+    with _lock:
+        metric = _metrics.get(f"{view}\t{method}")
+        if metric is None:
+            metric = _metrics[f"{view}\t{method}"] = _empty_record()
+
+        metric["requests"] += 1
+        metric["statuses"][status_class] = metric["statuses"].get(status_class, 0) + 1
+        metric["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metric["seconds"] += seconds
+        metric["db_queries"] += queries.queries
+        metric["db_seconds"] += queries.seconds
+        metric["cache_hits"] += cache_stats.get("l1_hits", 0) + cache_stats.get("l2_hits", 0)
+        metric["cache_misses"] += cache_stats.get("misses", 0)
+
+
+def flush_due() -> bool:
+    return time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+
+def flush(force: bool = False):
+    """
+    Записывает счётчики процесса в его файл, если с прошлой записи прошло
+    больше METRICS_FLUSH_INTERVAL секунд.
+    """
+    global _last_flush
+
+    now = time.monotonic()
+    if not force and not flush_due():
+        return
+
+    with _lock:
+        if not _metrics:
+            return
+        _last_flush = now
+        data = json.dumps(_metrics)
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _write(os.path.join(settings.METRICS_DIR, f"metrics-{_process_token}.json"), data)
+
+
+atexit.register(flush, force=True)
+
+
+def reset():
+    """
+    Сбрасывает счётчики процесса, не записывая их (тестовый прогон после смены METRICS_DIR).
+    """
+    with _lock:
+        _metrics.clear()
+
+
+def _write(path: str, data: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _merge(totals: dict, process_metrics: dict):
+    for key, metric in process_metrics.items():
+        total = totals.setdefault(key, _empty_record())
+        for field, value in metric.items():
+            if field == "statuses":
+                for status, count in value.items():
+                    total["statuses"][status] = total["statuses"].get(status, 0) + count
+            elif field == "buckets":
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], value)]
+            else:
+                total[field] += value
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _locked_dir():
+    # Сворачивание и чтение файлов под одной блокировкой: иначе параллельный collect()
+    # может увидеть счётчики воркера и в его файле, и уже в metrics-retired.json
+    with open(os.path.join(settings.METRICS_DIR, "metrics.lock"), "a") as lock_file:
+        locks.lock(lock_file, locks.LOCK_EX)
+        try:
+            yield
+        finally:
+            locks.unlock(lock_file)
+
+
+def _retire_dead(names: list[str]) -> list[str]:
+    """
+    Добавляет файлы завершившихся воркеров к metrics-retired.json и удаляет их.
+    """
+    dead = [
+        name for name in names
+        if name != RETIRED_FILENAME and not _is_alive(int(name[len("metrics-"):].split("-", 1)[0]))
+    ]
+    if not dead:
+        return names
+
+    retired_path = os.path.join(settings.METRICS_DIR, RETIRED_FILENAME)
+    retired = _read(retired_path)
+    for name in dead:
+        _merge(retired, _read(os.path.join(settings.METRICS_DIR, name)))
+    _write(retired_path, json.dumps(retired))
+
+    for name in dead:
+        os.remove(os.path.join(settings.METRICS_DIR, name))
+    return [name for name in names if name not in dead] + [RETIRED_FILENAME] * (RETIRED_FILENAME not in names)
+
+
+def collect() -> dict:
+    """
+    Сумма счётчиков всех процессов: {(view, method): {...}}.
+    """
+    flush(force=True)
+
+    if not os.path.isdir(settings.METRICS_DIR):
+        return {}
+
+    totals = {}
+    with _locked_dir():
+        names = [
+            name for name in os.listdir(settings.METRICS_DIR)
+            if name.startswith("metrics-") and name.endswith(".json")
+        ]
+        for name in _retire_dead(names):
+            _merge(totals, _read(os.path.join(settings.METRICS_DIR, name)))
+
+    return {tuple(key.split("\t", 1)): metric for key, metric in totals.items()}
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def render(totals: dict) -> str:
+    """
+    Текстовый формат Prometheus (version 0.0.4).
+    """
+    items = sorted(totals.items())
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+
+    family(
+        "django_http_requests_total", "counter", "Requests by URL name, method and status class.",
+        [
+            f"django_http_requests_total{_labels(view=view, method=method, status=status)} {count}"
+            for (view, method), metric in items
+            for status, count in sorted(metric["statuses"].items())
+        ],
+    )
+
+    samples = []
+    for (view, method), metric in items:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), metric["buckets"]):
+            cumulative += count
+            samples.append(
+                f"django_http_request_duration_seconds_bucket{_labels(view=view, method=method, le=bound)} {cumulative}"
+            )
+        samples.append(f"django_http_request_duration_seconds_sum{_labels(view=view, method=method)} {metric['seconds']}")
+        samples.append(f"django_http_request_duration_seconds_count{_labels(view=view, method=method)} {metric['requests']}")
+    family("django_http_request_duration_seconds", "histogram", "Response time.", samples)
+
+    for name, field, help_text in (
+        ("django_db_queries_total", "db_queries", "SQL queries executed while handling requests."),
+        ("django_db_query_duration_seconds_total", "db_seconds", "Time spent in SQL queries."),
+        ("django_cache_hits_total", "cache_hits", "Cache hits while handling requests."),
+        ("django_cache_misses_total", "cache_misses", "Cache misses while handling requests."),
+    ):
+        family(
+            name, "counter", help_text,
+            [f"{name}{_labels(view=view, method=method)} {metric[field]}" for (view, method), metric in items],
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = QueryCounter()
+        started = time.perf_counter()
+
+        with track_request_stats() as cache_stats, self.wrap_connections(queries):
+            response = self.get_response(request)
+
+        self.observe(request, response, started, queries, cache_stats)
+        flush()
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        queries = QueryCounter()
+        started = time.perf_counter()
+
+        # Async ORM ходит в базу из потока sync_to_async со своими соединениями, и под
+        # ASGI все такие вызовы одного запроса идут в один поток: обёртки ставятся там
+        stack = await sync_to_async(self.wrap_connections)(queries)
+        try:
+            with track_request_stats() as cache_stats:
+                response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+        self.observe(request, response, started, queries, cache_stats)
+        # Запись файла блокирует, поэтому не в цикле событий; поток занимается, только когда пора писать
+        if flush_due():
+            await sync_to_async(flush)()
+        return response
+
+    @staticmethod
+    def wrap_connections(queries: QueryCounter) -> ExitStack:
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(queries))
+        return stack
+
+    @staticmethod
+    def observe(request, response, started, queries, cache_stats):
+        seconds = time.perf_counter() - started
+        match = request.resolver_match
+        record(
+            match.view_name if match is not None else UNRESOLVED_VIEW,
+            request.method,
+            response.status_code,
+            seconds,
+            queries,
+            cache_stats,
+        )
+
+
+class MetricsView(UserPassesTestMixin, View):
+    """
+    Метрики всех воркеров в текстовом формате Prometheus.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return HttpResponse(render(collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
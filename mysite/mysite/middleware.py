@@ -0,0 +1,39 @@
+"""
+Middleware, которое работает и под WSGI, и под ASGI без переключения потоков.
+
+Если хотя бы одно middleware умеет только синхронный режим, Django под ASGI
+выполняет его и всё, что ниже по цепочке, через sync_to_async, то есть занимает
+поток на каждый запрос, и асинхронные представления теряют смысл.
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise import middleware as whitenoise_middleware
+
+
+class WhiteNoiseMiddleware(whitenoise_middleware.WhiteNoiseMiddleware):
+    """
+    WhiteNoise с асинхронным режимом: запросы не к статике сразу идут дальше,
+    а файл статики отдаётся из потока.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
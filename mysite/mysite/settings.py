@@ -71,8 +71,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mysite.metrics.MetricsMiddleware',
+    'mysite.db.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'mysite.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -110,19 +112,67 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': DATABASE_DIR / 'db.sqlite3',
-    }
+        # Профиль для нескольких воркеров gunicorn: WAL, IMMEDIATE-транзакции, ожидание блокировки (см. mysite.db)
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA mmap_size=268435456;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Тот же файл только для чтения (см. mysite.db.ReadReplicaRouter); для настоящей реплики достаточно
+    # поменять NAME/ENGINE. Журнал WAL задаёт основное соединение, читатель его только использует
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{DATABASE_DIR / 'db.sqlite3'}?mode=ro",
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA query_only=1;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA mmap_size=268435456;'
+            ),
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['mysite.db.ReadReplicaRouter']
+REPLICA_DATABASE = 'replica'
+# Сколько секунд после изменения клиент читает из основной базы
+REPLICA_PIN_SECONDS = 10
+
 
 # Caches
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '/var/tmp/django_cache',
+        'BACKEND': 'mysite.cache_backends.TieredSQLiteCache',
+        'LOCATION': '/var/tmp/django_cache/cache.sqlite3',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'L1_MAX_BYTES': 32 * 1024 * 1024,
+            'L1_MAX_ENTRIES': 1000,
+        },
     }
 }
 
+# Подменяет LOCATION кешей на временный каталог на время тестов
+TEST_RUNNER = 'mysite.test_runner.TestRunner'
+
+
+# Metrics
+
+# Каталог для файлов счётчиков воркеров (см. mysite.metrics), общий для всех процессов
+METRICS_DIR = os.getenv('DJANGO_METRICS_DIR', '/var/tmp/django_metrics')
+METRICS_FLUSH_INTERVAL = 1
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -168,11 +218,28 @@ STORAGES = {
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
     },
+    # Изображения товаров, аватары и чеки: файлы по SHA-256 содержимого (см. shopapp.storage)
+    "blobs": {
+        "BACKEND": "shopapp.storage.ContentAddressedStorage",
+    },
 }
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Ширины уменьшенных копий изображений товаров для srcset (см. shopapp.thumbnails)
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_QUALITY = 80
+
+# Приём изображений товара из формы: потоков на запрос и качество пересохранения (см. shopapp.images)
+IMAGE_INGEST_WORKERS = 8
+IMAGE_INGEST_QUALITY = 90
+
+# Аватары: предел размера загрузки и квадратные копии в WebP (см. myauth.avatars)
+AVATAR_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+AVATAR_SIZES = (48, 96, 192)
+AVATAR_QUALITY = 85
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -0,0 +1,32 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from mysite import metrics
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Тесты без своего override_settings(CACHES=...) пишут в файловый кеш и
+    файлы метрик во временном каталоге, а не в общие каталоги из настроек.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.temp_dir = tempfile.mkdtemp(prefix="django_test_")
+        caches = {
+            alias: {**config, "LOCATION": f"{self.temp_dir}/{alias}.sqlite3"}
+            for alias, config in settings.CACHES.items()
+        }
+        self.settings_override = override_settings(CACHES=caches, METRICS_DIR=f"{self.temp_dir}/metrics")
+        self.settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        # Иначе atexit запишет счётчики тестов в общий METRICS_DIR
+        metrics.reset()
+        self.settings_override.disable()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -18,11 +18,17 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from mysite.metrics import MetricsView
+from shopapp.storage import BLOBS_DIR
+from shopapp.views import MediaBlobView
 
 urlpatterns = [
     path('accounts/', include('myauth.urls')),
     path('admin/', admin.site.urls),
     path('shop/', include('shopapp.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    # Файлы по содержимому отдаются и без DEBUG, с Cache-Control: immutable
+    path(f'{settings.MEDIA_URL.lstrip("/")}{BLOBS_DIR}/<path:name>', MediaBlobView.as_view(), name='media_blob'),
 ]
 
 if settings.DEBUG:
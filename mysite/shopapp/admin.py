@@ -5,17 +5,11 @@ from django.shortcuts import render, redirect
 from django.urls import path
 
 from .admin_mixins import ExportAsCSVMixin
-from .common import save_csv_products, save_csv_orders
-from .forms import CSVImportForm
-from .models import Product, ProductImage, Order
-
-
-class ProductInline(admin.StackedInline):
-    model = Order.products.through
-
-
-class OrderInline(admin.TabularInline):
-    model = Product.orders.through
+from .caching import PRODUCTS, bump_generation, product_card_namespace
+from .jobs import enqueue_job
+from .forms import CSVImportForm, ProductAdminForm
+from .models import BackgroundJob, Product, ProductImage, Order
+from .search import search_products
 
 
 class ProductImageInline(admin.StackedInline):
@@ -24,24 +18,29 @@ class ProductImageInline(admin.StackedInline):
 
 @admin.action(description="Archive products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
+    product_ids = list(queryset.values_list("pk", flat=True))
     queryset.update(archived=True)
+    # update() не отправляет post_save
+    bump_generation(PRODUCTS, *map(product_card_namespace, product_ids))
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
+    product_ids = list(queryset.values_list("pk", flat=True))
     queryset.update(archived=False)
+    bump_generation(PRODUCTS, *map(product_card_namespace, product_ids))
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     change_list_template = 'shopapp/products_changelist.html'
+    form = ProductAdminForm
     actions = [
         mark_archived,
         mark_unarchived,
         "export_csv",
     ]
     inlines = [
-        OrderInline,
         ProductImageInline,
     ]
     list_display = "pk", "name", "description_short", "price", "discount", "created_by", "archived"
@@ -59,6 +58,10 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         ("Images", {
             "fields": ("preview",),
         }),
+        ("Orders", {
+            "fields": ("orders",),
+            "classes": ("collapse",),
+        }),
         ("Extra options", {
             "fields": ("archived",),
             "classes": ("collapse",),
@@ -66,6 +69,14 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         })
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Тот же FTS5 индекс, что и у API; на других СУБД - стандартный поиск админки
+        if search_term:
+            result = search_products(queryset, search_term.split(), ranked=False)
+            if result is not None:
+                return result, False
+        return super().get_search_results(request, queryset, search_term)
+
     def description_short(self, obj: Product) -> str:
         if len(obj.description) < 48:
             return obj.description
@@ -87,8 +98,13 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, 'admin/csv_form.html', context=context, status=400)
 
-        save_csv_products(file=form.files["csv_file"].file, encoding=request.encoding)
-        self.message_user(request, "Data from CSV was imported.")
+        job = enqueue_job(
+            BackgroundJob.Kind.PRODUCTS_IMPORT,
+            user=request.user,
+            source_file=form.files["csv_file"],
+            params={"encoding": request.encoding},
+        )
+        self.message_user(request, f"CSV import was queued as job #{job.pk}.")
 
         return redirect("..")
 
@@ -107,9 +123,8 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     change_list_template = 'shopapp/orders_changelist.html'
-    inlines = [
-        ProductInline,
-    ]
+    # Товары меняются через m2m поле (m2m_changed), а не inline по Order.products.through
+    filter_horizontal = ("products",)
     list_display = "delivery_address", "promocode", "created_at", "user_verbose"
 
     def get_queryset(self, request):
@@ -138,8 +153,13 @@ class OrderAdmin(admin.ModelAdmin):
             }
             return render(request, 'admin/csv_form.html', context=context, status=400)
 
-        save_csv_orders(file=form.files["csv_file"].file, encoding=request.encoding)
-        self.message_user(request, "Data from CSV was imported.")
+        job = enqueue_job(
+            BackgroundJob.Kind.ORDERS_IMPORT,
+            user=request.user,
+            source_file=form.files["csv_file"],
+            params={"encoding": request.encoding},
+        )
+        self.message_user(request, f"CSV import was queued as job #{job.pk}.")
 
         return redirect("..")
 
@@ -153,4 +173,15 @@ class OrderAdmin(admin.ModelAdmin):
                 name="import_orders_csv"
             ),
         ]
-        return new_urls + urls
\ No newline at end of file
+        return new_urls + urls
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = "pk", "kind", "status", "rows_processed", "created_by", "created_at", "finished_at"
+    list_filter = "kind", "status"
+    ordering = "-created_at", "-pk"
+    readonly_fields = [field.name for field in BackgroundJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        from . import signals
+        from .search import ensure_search_index
+
+        signals.connect_blob_signals()
+
+        post_migrate.connect(ensure_search_index, sender=self)
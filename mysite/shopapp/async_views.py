@@ -0,0 +1,147 @@
+"""
+Асинхронные представления каталога для запуска под ASGI.
+
+Только чтение: список товаров с поиском и сортировкой, товар, RSS и выгрузки.
+Ответы совпадают с синхронными аналогами из views.py, а кешированные данные
+хранятся под теми же ключами, так что обе версии делят кеш.
+
+Запросы к базе идут через async ORM (aget, aiterator, async for), поэтому под
+ASGI-воркером (uvicorn) процесс не держит поток на каждого медленного клиента.
+Поиск по FTS5 выполняется сырым SQL и уходит в поток через sync_to_async.
+Под WSGI эти представления тоже работают, но Django выполняет их через
+async_to_sync, без выигрыша.
+"""
+
+from hashlib import md5
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views import View
+from rest_framework.request import Request
+
+from mysite.db import read_from_replica
+
+from .caching import PRODUCTS, acached_compute, aversioned_key
+from .models import Product
+from .pagination import ProductCursorPagination
+from .serializers import ProductSerializer
+from .views import (
+    CSV_EXPORT_CHUNK_SIZE,
+    LatestProductsFeed,
+    OrdersDataExportView,
+    ProductsDataExportView,
+    ProductViewSet,
+)
+
+
+class AsyncProductListView(View):
+    """
+    Как GET api/products/: тот же формат, курсоры, ?search= и ?ordering=.
+    """
+
+    # Фильтры DRF и пагинация читают настройки с представления, как у ProductViewSet
+    filter_backends = ProductViewSet.filter_backends
+    search_fields = ProductViewSet.search_fields
+    ordering_fields = ProductViewSet.ordering_fields
+
+    async def get(self, request: HttpRequest) -> JsonResponse:
+        api_request = Request(request)
+        # Как у ProductViewSet.list: ссылки next/previous абсолютные
+        path_hash = md5(request.build_absolute_uri().encode("utf-8")).hexdigest()
+
+        with read_from_replica():
+            cache_key = await aversioned_key(f"async_products_api_list:{path_hash}", PRODUCTS)
+            data = await acached_compute(
+                cache_key,
+                lambda: self.get_page(api_request),
+                name="async_products_api_list",
+            )
+        return JsonResponse(data)
+
+    async def get_page(self, request: Request) -> dict:
+        # Полнотекстовый фильтр сразу читает индекс сырым SQL, поэтому фильтры - в потоке
+        queryset = await sync_to_async(self.filter_queryset)(request, Product.objects.all())
+
+        paginator = ProductCursorPagination()
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+        serializer = ProductSerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data).data
+
+    def filter_queryset(self, request: Request, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        return queryset
+
+
+class AsyncProductDetailsView(View):
+    """
+    Как GET api/products/<pk>/.
+    """
+
+    async def get(self, request: HttpRequest, pk: int) -> JsonResponse:
+        with read_from_replica():
+            try:
+                product = await Product.objects.aget(pk=pk)
+            except Product.DoesNotExist:
+                return JsonResponse({"detail": "No Product matches the given query."}, status=404)
+
+        serializer = ProductSerializer(product, context={"request": request})
+        return JsonResponse(serializer.data)
+
+
+class PrefetchedProductsFeed(LatestProductsFeed):
+    """
+    LatestProductsFeed по уже загруженным товарам: сборка RSS не обращается к базе.
+    """
+
+    def __init__(self, products: list):
+        self.products = products
+
+    def items(self):
+        return self.products
+
+
+class AsyncLatestProductsFeedView(View):
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        with read_from_replica():
+            cache_key = await aversioned_key("products_feed", PRODUCTS)
+            products = await acached_compute(
+                cache_key,
+                lambda: self.as_list(LatestProductsFeed.get_latest_products()),
+            )
+        return PrefetchedProductsFeed(products)(request)
+
+    @staticmethod
+    async def as_list(queryset) -> list:
+        return [instance async for instance in queryset]
+
+
+class AsyncProductsDataExportView(View):
+    async def get(self, request: HttpRequest) -> JsonResponse:
+        with read_from_replica():
+            cache_key = await aversioned_key("products_data_export", PRODUCTS)
+            products_data = await acached_compute(cache_key, self.get_products_data)
+        return JsonResponse({"products": products_data})
+
+    @staticmethod
+    async def get_products_data() -> list:
+        products = Product.objects.order_by("pk").aiterator(chunk_size=CSV_EXPORT_CHUNK_SIZE)
+        return [ProductsDataExportView.export_product(product) async for product in products]
+
+
+class AsyncOrdersDataExportView(View):
+    async def get(self, request: HttpRequest) -> JsonResponse:
+        # Как UserPassesTestMixin у OrdersDataExportView, но без синхронного request.user
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not user.is_staff:
+            raise PermissionDenied
+
+        with read_from_replica():
+            # aiterator выполняет prefetch_related для каждой пачки
+            orders = OrdersDataExportView.get_orders().aiterator(chunk_size=CSV_EXPORT_CHUNK_SIZE)
+            orders_data = [OrdersDataExportView.export_order(order) async for order in orders]
+        return JsonResponse({"orders": orders_data})
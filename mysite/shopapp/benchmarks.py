@@ -0,0 +1,285 @@
+"""
+Сквозные HTTP-бенчмарки горячих страниц и API магазина.
+
+Запросы идут через django.test.Client в том же процессе, то есть через весь стек
+middleware, представлений и шаблонов, но без сети и сервера приложений. Для каждого
+сценария считаются пропускная способность и перцентили p50/p95/p99 времени ответа.
+Результат сравнивается с сохранённым baseline (JSON): сценарий считается регрессией,
+если p95 вырос или пропускная способность упала больше чем на threshold.
+Базу и данные готовит команда benchmark_http.
+
+Второй режим - нагрузка по сети на настоящий сервер (команда benchmark_servers):
+много одновременных соединений к gunicorn с синхронными воркерами (WSGI) и к
+gunicorn с воркером uvicorn (ASGI) на асинхронные представления каталога.
+"""
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import urlencode
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Count
+from django.urls import reverse
+
+from .models import BackgroundJob, Product
+
+DEFAULT_THRESHOLD = 0.2
+
+CSV_UPLOAD_ROWS = 100
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    url_name: str
+    method: str = "get"
+    # Маршрут с pk самого популярного товара
+    detail: bool = False
+    params: dict = field(default_factory=dict)
+    # Вызывается после каждого запроса, вне замера
+    cleanup: Callable = None
+
+
+def discard_jobs():
+    """
+    Удаляет поставленные в очередь задачи и их файлы: воркер в бенчмарке не запущен.
+    """
+    for job in BackgroundJob.objects.all():
+        job.source_file.delete(save=False)
+        job.result_file.delete(save=False)
+    BackgroundJob.objects.all().delete()
+
+
+SCENARIOS = (
+    Scenario("products_list", "shopapp:products_list"),
+    Scenario("product_details", "shopapp:product_details", detail=True),
+    Scenario("api_products", "shopapp:product-list"),
+    Scenario("api_products_search", "shopapp:product-list", params={"search": "wireless", "ordering": "-price"}),
+    Scenario("api_products_ordering", "shopapp:product-list", params={"ordering": "price"}),
+    Scenario("api_orders", "shopapp:order-list"),
+    Scenario("products_export", "shopapp:products_export"),
+    Scenario("orders_export", "shopapp:orders_export"),
+    Scenario("products_feed", "shopapp:products_feed"),
+    Scenario("download_csv", "shopapp:product-download-csv"),
+    # Только приём файла и постановка задачи в очередь, сам импорт выполняет runworker
+    Scenario("upload_csv_enqueue", "shopapp:product-upload-csv", method="post", cleanup=discard_jobs),
+)
+
+
+@dataclass(frozen=True)
+class ServerScenario:
+    name: str
+    # Один и тот же ответ: синхронное представление для WSGI и асинхронное для ASGI
+    wsgi_url_name: str
+    asgi_url_name: str
+    detail: bool = False
+    params: dict = field(default_factory=dict)
+
+    def url(self, mode: str, product_id: int) -> str:
+        url_name = self.asgi_url_name if mode == "asgi" else self.wsgi_url_name
+        url = reverse(url_name, kwargs={"pk": product_id} if self.detail else None)
+        if self.params:
+            url = f"{url}?{urlencode(self.params)}"
+        return url
+
+
+SERVER_SCENARIOS = (
+    ServerScenario("api_products", "shopapp:product-list", "shopapp:async_products_list"),
+    ServerScenario(
+        "api_products_search",
+        "shopapp:product-list",
+        "shopapp:async_products_list",
+        params={"search": "wireless", "ordering": "-price"},
+    ),
+    ServerScenario("api_product_details", "shopapp:product-detail", "shopapp:async_product_details", detail=True),
+    ServerScenario("products_feed", "shopapp:products_feed", "shopapp:async_products_feed"),
+    ServerScenario("products_export", "shopapp:products_export", "shopapp:async_products_export"),
+)
+
+
+def upload_payload(user_id: int) -> dict:
+    rows = "".join(f"Benchmark product {index},,{index}.99,0,{user_id}\n" for index in range(CSV_UPLOAD_ROWS))
+    content = f"name,description,price,discount,created_by\n{rows}".encode("utf-8")
+    return {"file": SimpleUploadedFile("products.csv", content, content_type="text/csv")}
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """
+    Перцентиль по ближайшему рангу (значения уже отсортированы).
+    """
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "rps": round(len(values) / elapsed, 2),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def run_scenario(client, scenario: Scenario, requests: int, warmup: int, user_id: int, product_id: int) -> dict:
+    kwargs = {"pk": product_id} if scenario.detail else None
+    url = reverse(scenario.url_name, kwargs=kwargs)
+    if scenario.params:
+        url = f"{url}?{urlencode(scenario.params)}"
+
+    def request():
+        if scenario.method == "post":
+            response = client.post(url, upload_payload(user_id))
+        else:
+            response = client.get(url)
+        # Потоковый ответ считается отданным, когда прочитан целиком
+        if getattr(response, "streaming", False):
+            for _ in response.streaming_content:
+                pass
+        if response.status_code >= 400:
+            raise RuntimeError(f"{scenario.name}: {url} returned {response.status_code}")
+
+    for _ in range(warmup):
+        request()
+        if scenario.cleanup is not None:
+            scenario.cleanup()
+
+    latencies = []
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        request()
+        latencies.append(time.perf_counter() - request_started)
+        if scenario.cleanup is not None:
+            scenario.cleanup()
+
+    return summarize(latencies, sum(latencies))
+
+
+def run_benchmarks(client, user_id: int, scenarios=SCENARIOS, requests: int = 50, warmup: int = 5) -> dict:
+    # Самый популярный товар: на его странице больше всего рекомендаций
+    product_id = (
+        Product.objects.filter(archived=False)
+        .annotate(orders_count=Count("orders"))
+        .order_by("-orders_count", "pk")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    return {
+        scenario.name: run_scenario(client, scenario, requests, warmup, user_id, product_id)
+        for scenario in scenarios
+    }
+
+
+async def http_get(host: str, port: int, path: str, send_delay: float = 0.0) -> int:
+    """
+    Один GET по HTTP/1.1 с Connection: close, возвращает код ответа.
+
+    send_delay имитирует медленного клиента: заголовки уходят двумя частями с паузой,
+    и всё это время сервер, уже принявший соединение, ждёт окончания запроса.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\n".encode("ascii"))
+        if send_delay:
+            await writer.drain()
+            await asyncio.sleep(send_delay)
+        writer.write(f"Host: {host}\r\nConnection: close\r\n\r\n".encode("ascii"))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        while await reader.read(65536):
+            pass
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run_load(
+    host: str,
+    port: int,
+    path: str,
+    requests: int,
+    concurrency: int,
+    slow_clients: int = 0,
+    send_delay: float = 1.0,
+) -> dict:
+    """
+    requests запросов через concurrency одновременных клиентов.
+
+    Параллельно slow_clients медленных клиентов без перерыва шлют свои запросы с паузой
+    send_delay; их ответы не измеряются. Синхронный воркер, принявший такое соединение,
+    ждёт его всю паузу, а ASGI-воркер в это время обслуживает остальных.
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            request_started = time.perf_counter()
+            try:
+                status = await http_get(host, port, path)
+            except OSError:
+                status = None
+            if status is None or status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - request_started)
+
+    async def slow_client():
+        while True:
+            try:
+                await http_get(host, port, path, send_delay)
+            except OSError:
+                await asyncio.sleep(send_delay)
+
+    slow_tasks = [asyncio.create_task(slow_client()) for _ in range(slow_clients)]
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    finally:
+        elapsed = time.perf_counter() - started
+        for task in slow_tasks:
+            task.cancel()
+        await asyncio.gather(*slow_tasks, return_exceptions=True)
+
+    result = summarize(latencies, elapsed) if latencies else {"requests": 0}
+    result["errors"] = errors
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """
+    Сравнение с baseline по каждому общему сценарию; regression=True при ухудшении больше threshold.
+    """
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        rps_change = current["rps"] / previous["rps"] - 1 if previous["rps"] else 0.0
+        rows.append({
+            "name": name,
+            "p95_change": p95_change,
+            "rps_change": rps_change,
+            "regression": p95_change > threshold or rps_change < -threshold,
+        })
+    return rows
+
+
+def load_results(path) -> dict:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_results(path, results: dict, meta: dict) -> None:
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -0,0 +1,304 @@
+"""
+Версионированные ключи кеша и защита от одновременного пересчёта.
+
+Вместо короткого TTL каждый кешированный ответ привязан к счётчикам поколений
+(generation) тех данных, из которых он построен. Сигналы моделей увеличивают
+счётчик, ключ меняется, и старая запись просто перестаёт читаться, поэтому
+записи можно хранить часами и делить между воркерами без риска отдать устаревшие данные.
+
+cached_compute() пересчитывает значение только в одном воркере (блокировка через
+cache.add), а остальные в это время отдают предыдущее значение или ждут первое.
+Значение блокировки - уникальный токен воркера: если пересчёт шёл дольше
+RECOMPUTE_LOCK_TIMEOUT и блокировку уже взял другой воркер, снимать её нельзя.
+Сохраняемое значение считается по основной базе даже внутри read_from_replica:
+отстающая реплика записала бы под новым поколением данные до изменения, которое
+это поколение сбросило, и они отдавались бы до следующего изменения.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from mysite.db import read_from_primary
+
+log = logging.getLogger(__name__)
+
+# Сколько живут версионированные записи: инвалидация идёт через смену поколения
+VERSIONED_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Сколько после логического истечения запись ещё хранится, чтобы её можно было отдать,
+# пока другой воркер пересчитывает значение
+STALE_GRACE_PERIOD = 60 * 5
+
+# Блокировка пересчёта и ожидание первого значения другими воркерами
+RECOMPUTE_LOCK_TIMEOUT = 30
+RECOMPUTE_WAIT_TIMEOUT = 5
+
+# Счётчики этого процесса: (name, event) -> количество
+CACHE_STATS = Counter()
+
+PRODUCTS = "products"
+ORDERS = "orders"
+
+
+def user_orders_namespace(user_id) -> str:
+    return f"orders:user:{user_id}"
+
+
+def related_products_namespace(product_id) -> str:
+    return f"related:product:{product_id}"
+
+
+def product_card_namespace(product_id) -> str:
+    return f"card:product:{product_id}"
+
+
+def order_card_namespace(order_id) -> str:
+    return f"card:order:{order_id}"
+
+
+def _generation_key(namespace: str) -> str:
+    return f"generation:{namespace}"
+
+
+def _initial_generation() -> int:
+    # Если счётчик вытеснен из кеша, новое значение не совпадёт ни с одним прежним
+    return int(time.time() * 1000)
+
+
+def get_generations(*namespaces: str) -> list[int]:
+    keys = [_generation_key(namespace) for namespace in namespaces]
+    values = cache.get_many(keys)
+
+    generations = []
+    for key in keys:
+        if key not in values:
+            cache.add(key, _initial_generation(), timeout=None)
+            values[key] = cache.get(key)
+        generations.append(values[key])
+
+    return generations
+
+
+def versioned_key(base: str, *namespaces: str) -> str:
+    """
+    Ключ вида "<base>:v<g1>.<g2>" для данных, зависящих от перечисленных пространств.
+    """
+    generations = get_generations(*namespaces)
+    return f"{base}:v{'.'.join(str(generation) for generation in generations)}"
+
+
+# Для асинхронных представлений; счётчики поколений читаются одним запросом к кешу
+aversioned_key = sync_to_async(versioned_key)
+
+
+def _bump(namespaces) -> None:
+    for namespace in namespaces:
+        key = _generation_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_generation(), timeout=None)
+
+
+def bump_generation(*namespaces: str) -> None:
+    """
+    Инвалидирует все записи, зависящие от namespaces.
+
+    Внутри транзакции счётчик увеличивается после коммита: иначе другой воркер
+    успеет закешировать ещё не изменённые данные уже под новым поколением.
+    """
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+def cached_compute(
+    key: str,
+    compute,
+    timeout: int = VERSIONED_CACHE_TIMEOUT,
+    name: str = None,
+    beta: float = 1.0,
+):
+    """
+    Возвращает значение из кеша или вычисляет его через compute().
+
+    Запись хранит время вычисления (delta) и логическое время истечения. Ещё до
+    истечения каждый запрос с вероятностью, растущей к концу срока, решает
+    пересчитать значение заранее (XFetch: now - delta * beta * ln(rand) >= expiry),
+    поэтому дорогие значения обычно обновляются до того, как истекут.
+    Пересчитывает только воркер, взявший блокировку, остальные отдают текущее значение.
+    При полном промахе остальные до RECOMPUTE_WAIT_TIMEOUT ждут результат первого,
+    а если блокировка так и не освободилась, вычисляют значение без записи в кеш.
+    """
+    name = name or key.split(":", 1)[0]
+    lock_key = f"{key}:lock"
+    token = _lock_token()
+    entry = cache.get(key)
+
+    if entry is not None:
+        value, delta, expiry = entry
+        if _is_fresh(delta, expiry, beta):
+            CACHE_STATS[(name, "hit")] += 1
+            return value
+
+        if not cache.add(lock_key, token, RECOMPUTE_LOCK_TIMEOUT):
+            # Пересчёт уже идёт в другом воркере
+            CACHE_STATS[(name, "stale")] += 1
+            return value
+
+        CACHE_STATS[(name, "early_recompute")] += 1
+    else:
+        CACHE_STATS[(name, "miss")] += 1
+
+        if not cache.add(lock_key, token, RECOMPUTE_LOCK_TIMEOUT):
+            entry = _wait_for_entry(key, lock_key)
+            if entry is not None:
+                CACHE_STATS[(name, "wait_hit")] += 1
+                return entry[0]
+
+            if not cache.add(lock_key, token, RECOMPUTE_LOCK_TIMEOUT):
+                # Блокировку держит другой воркер: вычисляем для себя, не трогая ни запись, ни его блокировку
+                CACHE_STATS[(name, "unlocked_compute")] += 1
+                return compute()
+
+    try:
+        started = time.monotonic()
+        with read_from_primary():
+            value = compute()
+        delta = time.monotonic() - started
+        cache.set(key, (value, delta, time.time() + timeout), timeout + STALE_GRACE_PERIOD)
+        CACHE_STATS[(name, "recompute")] += 1
+        log.debug("Recomputed %s in %.3fs", key, delta)
+    finally:
+        _release_lock(lock_key, token)
+
+    return value
+
+
+async def acached_compute(
+    key: str,
+    compute,
+    timeout: int = VERSIONED_CACHE_TIMEOUT,
+    name: str = None,
+    beta: float = 1.0,
+):
+    """
+    cached_compute() для асинхронных представлений: compute - корутинная функция.
+
+    Записи, блокировки и счётчики общие с cached_compute(), поэтому синхронное и
+    асинхронное представление с одним ключом пользуются одной записью кеша.
+    """
+    name = name or key.split(":", 1)[0]
+    lock_key = f"{key}:lock"
+    token = _lock_token()
+    entry = await cache.aget(key)
+
+    if entry is not None:
+        value, delta, expiry = entry
+        if _is_fresh(delta, expiry, beta):
+            CACHE_STATS[(name, "hit")] += 1
+            return value
+
+        if not await cache.aadd(lock_key, token, RECOMPUTE_LOCK_TIMEOUT):
+            CACHE_STATS[(name, "stale")] += 1
+            return value
+
+        CACHE_STATS[(name, "early_recompute")] += 1
+    else:
+        CACHE_STATS[(name, "miss")] += 1
+
+        if not await cache.aadd(lock_key, token, RECOMPUTE_LOCK_TIMEOUT):
+            entry = await _await_entry(key, lock_key)
+            if entry is not None:
+                CACHE_STATS[(name, "wait_hit")] += 1
+                return entry[0]
+
+            if not await cache.aadd(lock_key, token, RECOMPUTE_LOCK_TIMEOUT):
+                CACHE_STATS[(name, "unlocked_compute")] += 1
+                return await compute()
+
+    try:
+        started = time.monotonic()
+        with read_from_primary():
+            value = await compute()
+        delta = time.monotonic() - started
+        await cache.aset(key, (value, delta, time.time() + timeout), timeout + STALE_GRACE_PERIOD)
+        CACHE_STATS[(name, "recompute")] += 1
+        log.debug("Recomputed %s in %.3fs", key, delta)
+    finally:
+        await _arelease_lock(lock_key, token)
+
+    return value
+
+
+def _lock_token() -> str:
+    return f"{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def _release_lock(lock_key: str, token: str) -> None:
+    # Без compare-and-delete в API кеша между get и delete остаётся узкое окно,
+    # но блокировку, истёкшую и взятую другим воркером, мы больше не снимаем
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+async def _arelease_lock(lock_key: str, token: str) -> None:
+    if await cache.aget(lock_key) == token:
+        await cache.adelete(lock_key)
+
+
+def _is_fresh(delta: float, expiry: float, beta: float) -> bool:
+    return time.time() - delta * beta * math.log(1.0 - random.random()) < expiry
+
+
+def _wait_for_entry(key: str, lock_key: str):
+    deadline = time.monotonic() + RECOMPUTE_WAIT_TIMEOUT
+    pause = 0.01
+
+    while time.monotonic() < deadline:
+        time.sleep(pause)
+        pause = min(pause * 2, 0.2)
+
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key) is None:
+            # Блокировка снята: значение либо уже записано, либо пересчёт упал
+            return cache.get(key)
+
+    return None
+
+
+async def _await_entry(key: str, lock_key: str):
+    deadline = time.monotonic() + RECOMPUTE_WAIT_TIMEOUT
+    pause = 0.01
+
+    while time.monotonic() < deadline:
+        await asyncio.sleep(pause)
+        pause = min(pause * 2, 0.2)
+
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry
+        if await cache.aget(lock_key) is None:
+            return await cache.aget(key)
+
+    return None
+
+
+def get_cache_stats() -> dict:
+    """
+    Счётчики текущего процесса в виде {name: {event: count}}.
+    """
+    stats = {}
+    for (name, event), count in CACHE_STATS.items():
+        stats.setdefault(name, {})[event] = count
+    return stats
@@ -1,59 +1,366 @@
-from csv import DictReader
+import zlib
+from csv import DictReader, writer as csv_writer
+from dataclasses import dataclass, field
 from io import TextIOWrapper
+from itertools import islice
 
 from django.contrib.auth.models import User
-from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.utils import timezone
 
+from mysite.db import write_transaction
+
+from .caching import ORDERS, PRODUCTS, bump_generation
 from .models import Product, Order
+from .recommendations import apply_pair_changes
+from .reports import SalesDeltas, order_identity
+from .search import deferred_search_index
+from .totals import totals_for_products
+
+# Сколько строк CSV обрабатывается за одну транзакцию импорта
+CSV_IMPORT_CHUNK_SIZE = 5000
+# Сколько строк передаётся в один executemany
+CSV_IMPORT_BATCH_SIZE = 500
+# Сколько ошибок по строкам сохраняется в отчёте (счётчик failed считает все)
+CSV_IMPORT_MAX_REPORTED_ERRORS = 1000
+
+PRODUCT_CSV_FIELDS = ("name", "description", "price", "discount")
+PRODUCT_FIELDS = {name: Product._meta.get_field(name) for name in PRODUCT_CSV_FIELDS}
+
+ORDER_CSV_FIELDS = ("delivery_address", "promocode")
+ORDER_FIELDS = {name: Order._meta.get_field(name) for name in ORDER_CSV_FIELDS}
+
+
+@dataclass
+class ImportResult:
+    """
+    Отчёт об импорте CSV: сколько строк обработано, создано и какие строки не прошли проверку.
+    """
+
+    processed: int = 0
+    created: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line: int, error: ValidationError):
+        self.failed += 1
+        if len(self.errors) < CSV_IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "errors": error.message_dict})
+
+    def as_dict(self) -> dict:
+        return {
+            "processed": self.processed,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def parse_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def save_csv_products(file, encoding, chunk_size=CSV_IMPORT_CHUNK_SIZE, batch_size=CSV_IMPORT_BATCH_SIZE, progress=None):
+    """
+    Потоковый импорт товаров из CSV.
+
+    Файл читается пачками по chunk_size строк. На пачку делается один запрос за
+    пользователями (in_bulk) и вставка по batch_size строк в отдельной транзакции.
+    Строки проверяются валидаторами полей Product без запросов к БД; ошибочные строки
+    попадают в отчёт и не прерывают импорт.
+    """
+    reader = DictReader(TextIOWrapper(file, encoding=encoding))
+    result = ImportResult()
+
+    # Первая строка файла - заголовок, поэтому данные начинаются со второй
+    for chunk in iter_chunks(enumerate(reader, start=2), chunk_size):
+        user_ids = {parse_pk(row.get("created_by")) for _, row in chunk}
+        users = User.objects.in_bulk(user_ids - {None})
+        rows = []
+
+        for line, row in chunk:
+            try:
+                rows.append(clean_product_row(row, users))
+            except ValidationError as exc:
+                result.add_error(line, exc)
+
+        insert_products(rows, batch_size)
+
+        result.created += len(rows)
+        result.processed += len(chunk)
+        if progress is not None:
+            progress(result)
+
+    return result
+
+
+def clean_product_row(row, users) -> tuple:
+    """
+    Проверяет строку CSV валидаторами полей Product без запросов к БД.
+
+    Возвращает значения в порядке PRODUCT_CSV_FIELDS + created_by_id.
+    """
+    user = users.get(parse_pk(row.get("created_by")))
+    if user is None:
+        raise ValidationError({"created_by": f"User {row.get('created_by')!r} does not exist."})
+
+    values = []
+    errors = {}
+
+    for name in PRODUCT_CSV_FIELDS:
+        field = PRODUCT_FIELDS[name]
+        raw_value = row.get(name)
+
+        # Колонки нет в файле - как и Product(**row), берём значение по умолчанию
+        if raw_value is None:
+            values.append(field.get_default())
+            continue
+
+        try:
+            values.append(field.clean(raw_value, None))
+        except ValidationError as exc:
+            errors[name] = exc.messages
+
+    if errors:
+        raise ValidationError(errors)
+
+    # created_by уже проверен по in_bulk, валидация FK сделала бы запрос на каждую строку
+    values.append(user.pk)
+    return tuple(values)
+
+
+def bulk_insert(model, fields, rows, batch_size=CSV_IMPORT_BATCH_SIZE, using="default"):
+    """
+    INSERT уже проверенных строк через executemany, без экземпляров модели.
 
+    bulk_create тратит на компиляцию SQL для каждой строки больше времени, чем сама
+    вставка, поэтому импорт CSV использует этот путь. Остальные поля модели получают
+    значения по умолчанию (auto_now/auto_now_add - текущее время). Сигналы не отправляются.
+    """
+    connection = connections[using]
+    opts = model._meta
+    quote_name = connection.ops.quote_name
 
-def save_csv_products(file, encoding):
-    csv_file = TextIOWrapper(
-        file,
-        encoding=encoding,
+    row_fields = [opts.get_field(name) for name in fields]
+    default_fields = [
+        field for field in opts.concrete_fields
+        if not field.primary_key and field not in row_fields
+    ]
+    now = timezone.now()
+    default_values = tuple(
+        field.get_db_prep_save(
+            now if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False) else field.get_default(),
+            connection,
+        )
+        for field in default_fields
     )
 
-    reader = DictReader(csv_file)
-    products = []
+    columns = ", ".join(quote_name(field.column) for field in row_fields + default_fields)
+    placeholders = ", ".join(["%s"] * (len(row_fields) + len(default_fields)))
+    sql = f"INSERT INTO {quote_name(opts.db_table)} ({columns}) VALUES ({placeholders})"
 
-    for row in reader:
-        user_id = row.pop("created_by")
-        user = User.objects.get(pk=user_id)
-        product = Product(**row, created_by=user)
-        products.append(product)
+    prepare = [field.get_db_prep_save for field in row_fields]
 
-    Product.objects.bulk_create(products)
-    return products
+    with connection.cursor() as cursor:
+        for batch in iter_chunks(rows, batch_size):
+            cursor.executemany(sql, [
+                tuple(prep(value, connection) for prep, value in zip(prepare, row)) + default_values
+                for row in batch
+            ])
 
 
-def save_csv_orders(file, encoding):
-    csv_file = TextIOWrapper(
-        file,
-        encoding=encoding,
+def save_csv_orders(file, encoding, chunk_size=CSV_IMPORT_CHUNK_SIZE, batch_size=CSV_IMPORT_BATCH_SIZE, progress=None):
+    """
+    Потоковый импорт заказов из CSV.
+
+    На пачку из chunk_size строк: один запрос за пользователями, один за товарами,
+    bulk_create заказов и bulk_create строк промежуточной таблицы Order.products
+    и обновление дневных итогов продаж и пар товаров в одной транзакции. Ошибочные строки попадают
+    в отчёт и не прерывают импорт.
+    """
+    reader = DictReader(TextIOWrapper(file, encoding=encoding))
+    result = ImportResult()
+
+    for chunk in iter_chunks(enumerate(reader, start=2), chunk_size):
+        user_ids = set()
+        product_ids = set()
+        for _, row in chunk:
+            user_ids.add(parse_pk(row.get("user")))
+            product_ids.update(parse_pk_list(row.get("product")) or ())
+
+        users = User.objects.in_bulk(user_ids - {None})
+        products = Product.objects.in_bulk(product_ids - {None})
+        orders = []
+        order_products = []
+
+        for line, row in chunk:
+            try:
+                order, row_product_ids = build_order(row, users, products)
+            except ValidationError as exc:
+                result.add_error(line, exc)
+                continue
+
+            orders.append(order)
+            order_products.append(row_product_ids)
+
+        insert_orders(orders, order_products, products, batch_size)
+
+        result.created += len(orders)
+        result.processed += len(chunk)
+        if progress is not None:
+            progress(result)
+
+    return result
+
+
+@write_transaction
+def insert_products(rows, batch_size):
+    with deferred_search_index():
+        bulk_insert(Product, PRODUCT_CSV_FIELDS + ("created_by_id",), rows, batch_size=batch_size)
+        bump_generation(PRODUCTS)
+
+
+@write_transaction
+def insert_orders(orders, order_products, products, batch_size):
+    OrderProducts = Order.products.through
+
+    # После отката неудачной попытки у заказов остались бы pk от bulk_create
+    for order in orders:
+        order.pk = None
+
+    Order.objects.bulk_create(orders, batch_size=batch_size)
+    OrderProducts.objects.bulk_create(
+        [
+            OrderProducts(order_id=order.pk, product_id=product_id)
+            for order, row_product_ids in zip(orders, order_products)
+            for product_id in row_product_ids
+        ],
+        batch_size=batch_size,
     )
+    sales_deltas(orders, order_products, products).save()
+    pairs = {order.pk: set(row_product_ids) for order, row_product_ids in zip(orders, order_products)}
+    apply_pair_changes(pairs, 1, current=pairs)
+    # bulk_create не отправляет сигналы, а заказы могут быть у многих пользователей
+    bump_generation(ORDERS)
+
+
+def sales_deltas(orders, order_products, products) -> SalesDeltas:
+    """
+    Вклад импортированных заказов в дневные итоги продаж (сигналы bulk_create не отправляет).
+    """
+    deltas = SalesDeltas()
+    for order, row_product_ids in zip(orders, order_products):
+        identity = order_identity(order)
+        deltas.add_order(*identity)
+        for product_id in row_product_ids:
+            product = products[product_id]
+            deltas.add_line(*identity, product_id, product.price, product.discount)
+    return deltas
+
+
+def build_order(row, users, products):
+    """
+    Проверяет строку CSV заказа по уже загруженным пользователям и товарам.
+
+    Возвращает несохранённый Order с заполненными итогами и список pk его товаров.
+    """
+    errors = {}
+
+    user = users.get(parse_pk(row.get("user")))
+    if user is None:
+        errors["user"] = [f"User {row.get('user')!r} does not exist."]
+
+    product_ids = parse_pk_list(row.get("product"))
+    if product_ids is None:
+        errors["product"] = [f"Invalid product list {row.get('product')!r}."]
+    else:
+        missing = [product_id for product_id in product_ids if product_id not in products]
+        if missing:
+            errors["product"] = [f"Products {missing} do not exist."]
+
+    values = {}
+    for name in ORDER_CSV_FIELDS:
+        try:
+            values[name] = ORDER_FIELDS[name].clean(row.get(name, ""), None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+
+    if errors:
+        raise ValidationError(errors)
+
+    order = Order(user=user, **values)
+    # Строки Order.products вставляются через bulk_create без m2m_changed
+    totals_for_products(products[product_id] for product_id in product_ids).apply_to(order)
+    return order, product_ids
+
+
+def parse_pk_list(value):
+    """
+    "1, 2,3" -> [1, 2, 3] без повторов; пустая строка - пустой список, мусор - None.
+    """
+    if not value or not value.strip():
+        return []
+
+    pks = []
+    for item in value.split(","):
+        pk = parse_pk(item.strip())
+        if pk is None:
+            return None
+        if pk not in pks:
+            pks.append(pk)
+    return pks
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer: write() возвращает строку вместо записи,
+    чтобы строки CSV можно было отдавать из генератора.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows, encoding="utf-8", chunk_rows=500):
+    """
+    Генератор CSV для StreamingHttpResponse.
 
-    reader = DictReader(csv_file)
-    orders = []
+    Заголовок отдаётся сразу, строки - пачками по chunk_rows, так что в памяти
+    держится только одна пачка вне зависимости от размера выгрузки.
+    """
+    writer = csv_writer(Echo())
+    yield writer.writerow(header).encode(encoding)
 
-    with transaction.atomic():
-        for i, row in enumerate(reader):
-            delivery_address = row.get("delivery_address", "")
-            promocode = row.get("promocode", "")
+    buffer = []
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= chunk_rows:
+            yield "".join(buffer).encode(encoding)
+            buffer = []
 
-            user_id = row.get("user")
-            user = User.objects.get(pk=user_id)
+    if buffer:
+        yield "".join(buffer).encode(encoding)
 
-            order = Order.objects.create(
-                user=user,
-                delivery_address=delivery_address,
-                promocode=promocode,
-            )
 
-            product_ids_str = row.get("product", "")
+def gzip_stream(chunks, level=6):
+    """
+    Сжимает поток байтов в gzip на лету.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
 
-            if product_ids_str:
-                product_ids = [int(p_id.strip()) for p_id in product_ids_str.split(',')]
-                products = Product.objects.filter(pk__in=product_ids)
-                order.products.set(products)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
 
-    return orders
+    yield compressor.flush()
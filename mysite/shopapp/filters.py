@@ -0,0 +1,24 @@
+from rest_framework.filters import SearchFilter
+
+from .search import search_products
+
+
+class ProductFullTextSearchFilter(SearchFilter):
+    """
+    SearchFilter поверх FTS5 индекса товаров.
+
+    Находит pk по индексу (bm25) и отдаёт queryset с аннотацией search_rank.
+    Представление с search_ranked = False (выгрузки) получает все совпадения без ранжирования,
+    а не лучшие SEARCH_MAX_RESULTS.
+    Если индекс недоступен (не SQLite), работает как обычный SearchFilter по search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        result = search_products(queryset, search_terms, ranked=getattr(view, "search_ranked", True))
+        if result is None:
+            return super().filter_queryset(request, queryset, view)
+        return result
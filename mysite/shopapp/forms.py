@@ -1,5 +1,7 @@
 from django import forms
+from django.contrib.admin.widgets import FilteredSelectMultiple
 
+from .images import normalize_images
 from .models import Order, Product
 from .widgets import MultipleFileField
 
@@ -11,6 +13,9 @@ class ProductForm(forms.ModelForm):
 
     images = MultipleFileField()
 
+    def clean_images(self):
+        # Все файлы проверяются и пересохраняются без EXIF сразу, в пуле потоков (см. shopapp.images)
+        return normalize_images(upload for upload in self.cleaned_data["images"] if upload)
 
 
 class OrderForm(forms.ModelForm):
@@ -26,5 +31,34 @@ class OrderForm(forms.ModelForm):
         self.fields['products'].queryset = Product.objects.filter(archived=False)
 
 
+class ProductAdminForm(forms.ModelForm):
+    """
+    Форма товара в админке с его заказами.
+
+    Заказы меняются через product.orders.set(), а не строками Order.products.through
+    в inline: только так срабатывает m2m_changed, на котором держатся итоги заказов,
+    дневные итоги продаж, совместные покупки и инвалидация кеша.
+    """
+
+    class Meta:
+        model = Product
+        fields = "__all__"
+
+    orders = forms.ModelMultipleChoiceField(
+        queryset=Order.objects.all(),
+        required=False,
+        widget=FilteredSelectMultiple("orders", is_stacked=False),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial.setdefault("orders", self.instance.orders.all())
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        self.instance.orders.set(self.cleaned_data["orders"])
+
+
 class CSVImportForm(forms.Form):
     csv_file = forms.FileField()
@@ -0,0 +1,154 @@
+"""
+Кеш HTML-карточек товаров и заказов на страницах списков.
+
+Карточка кешируется под ключом из pk объекта и счётчиков поколений
+(shopapp.caching), от которых зависит её содержимое. Сигналы увеличивают счётчик
+объекта при сохранении, изменении Order.products и архивации, а счётчики заказов -
+и при изменении названия, цены или удалении их товаров, и старая карточка
+перестаёт читаться. Страница читает счётчики и все карточки двумя запросами
+get_many и рендерит шаблон карточки только для промахов, поэтому для связанных
+объектов (prefetch) подготавливаются только промахи.
+
+Карточка не зависит от запроса и пользователя: в шаблоне карточки нет csrf_token,
+perms и request.
+
+Список читается из реплики (ReadReplicaMixin), но промахи перед рендером
+перечитываются из основной базы: отстающая реплика записала бы под текущим
+поколением карточку до изменения, которое это поколение сбросило.
+"""
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from mysite.db import read_from_primary
+
+from .caching import (
+    CACHE_STATS,
+    VERSIONED_CACHE_TIMEOUT,
+    get_generations,
+    order_card_namespace,
+    product_card_namespace,
+)
+from .models import Order
+from .thumbnails import get_manifest
+
+
+def render_cards(
+    objects,
+    name: str,
+    template_name: str,
+    context_object_name: str,
+    namespaces,
+    prepare=None,
+    cacheable=None,
+    queryset=None,
+) -> list[str]:
+    """
+    HTML карточек objects в том же порядке.
+
+    Шаблон получает объект в переменной context_object_name;
+    namespaces(obj) - пространства поколений, от которых зависит карточка obj;
+    prepare(misses) - подготовка объектов, карточек которых нет в кеше (например, prefetch);
+    cacheable(obj) - можно ли сохранить карточку (по умолчанию да);
+    queryset - откуда перечитать промахи из основной базы (по умолчанию все объекты модели).
+    """
+    objects = list(objects)
+    if not objects:
+        return []
+
+    object_namespaces = [tuple(namespaces(obj)) for obj in objects]
+    unique_namespaces = list(dict.fromkeys(namespace for group in object_namespaces for namespace in group))
+    generations = dict(zip(unique_namespaces, get_generations(*unique_namespaces)))
+
+    keys = [
+        f"{name}:{obj.pk}:v{'.'.join(str(generations[namespace]) for namespace in group)}"
+        for obj, group in zip(objects, object_namespaces)
+    ]
+    cards = cache.get_many(keys)
+
+    misses = [(key, obj) for key, obj in zip(keys, objects) if key not in cards]
+    if len(misses) < len(objects):
+        CACHE_STATS[(name, "hit")] += len(objects) - len(misses)
+
+    if misses:
+        CACHE_STATS[(name, "miss")] += len(misses)
+        rendered = {}
+        # Связанные объекты (prepare, ленивые запросы шаблона) тоже читаются из основной базы
+        with read_from_primary():
+            misses = _reload_from_primary(misses, queryset)
+            if prepare is not None:
+                prepare([obj for _, obj, _ in misses])
+
+            template = get_template(template_name)
+            for key, obj, primary in misses:
+                cards[key] = template.render({context_object_name: obj})
+                if primary and (cacheable is None or cacheable(obj)):
+                    rendered[key] = cards[key]
+        cache.set_many(rendered, VERSIONED_CACHE_TIMEOUT)
+
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def _reload_from_primary(misses, queryset) -> list[tuple]:
+    """
+    (key, obj, primary) для промахов: объекты из реплики заменяются прочитанными из основной базы.
+
+    primary=False у объектов, которых в основной базе уже нет: их карточка
+    рендерится из прочитанного, но не кешируется.
+    """
+    stale = [obj.pk for _, obj in misses if obj._state.db != DEFAULT_DB_ALIAS]
+    if not stale:
+        return [(key, obj, True) for key, obj in misses]
+
+    if queryset is None:
+        queryset = type(misses[0][1])._base_manager.all()
+    fresh = queryset.using(DEFAULT_DB_ALIAS).in_bulk(stale)
+
+    reloaded = []
+    for key, obj in misses:
+        if obj._state.db == DEFAULT_DB_ALIAS:
+            reloaded.append((key, obj, True))
+        elif obj.pk in fresh:
+            reloaded.append((key, fresh[obj.pk], True))
+        else:
+            reloaded.append((key, obj, False))
+    return reloaded
+
+
+def product_card_namespaces(product) -> tuple[str, ...]:
+    return (product_card_namespace(product.pk),)
+
+
+def product_card_cacheable(product) -> bool:
+    # Пока уменьшенных копий нет, в srcset ссылки на ThumbnailView; такую карточку не кешируем
+    return not product.preview or get_manifest(product.preview.name) is not None
+
+
+def render_product_cards(products) -> list[str]:
+    return render_cards(
+        products,
+        name="product_card",
+        template_name="shopapp/includes/product_card.html",
+        context_object_name="product",
+        namespaces=product_card_namespaces,
+        cacheable=product_card_cacheable,
+    )
+
+
+def order_card_namespaces(order) -> tuple[str, ...]:
+    # Названия и цены товаров и итоги заказа тоже сбрасывают счётчик заказа (shopapp.signals)
+    return (order_card_namespace(order.pk),)
+
+
+def render_order_cards(orders, prepare=None) -> list[str]:
+    return render_cards(
+        orders,
+        name="order_card",
+        template_name="shopapp/includes/order_card.html",
+        context_object_name="order",
+        namespaces=order_card_namespaces,
+        prepare=prepare,
+        queryset=Order.objects.select_related("user"),
+    )
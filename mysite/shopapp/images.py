@@ -0,0 +1,112 @@
+"""
+Приём изображений товара, загруженных через форму.
+
+Все файлы обрабатываются одновременно в пуле потоков. Каждый файл декодируется
+целиком, поэтому битые файлы и не-изображения отклоняются. Затем он
+поворачивается по EXIF и кодируется заново без EXIF, в котором бывают
+координаты съёмки. Потом файлы так же параллельно пишутся в хранилище, а строки
+ProductImage вставляются одним bulk_create. Pillow и файловый ввод-вывод
+отпускают GIL, поэтому пачка фотографий обрабатывается примерно за время самой
+тяжёлой из них.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePath
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .media import add_references
+from .models import Product, ProductImage
+
+# Принимаемые форматы -> формат, в котором файл сохраняется, и его расширение
+# (MPO - JPEG с дополнительными кадрами, так сохраняют снимки многие телефоны)
+INGEST_FORMATS = {
+    "JPEG": ("JPEG", "jpg"),
+    "MPO": ("JPEG", "jpg"),
+    "PNG": ("PNG", "png"),
+    "WEBP": ("WEBP", "webp"),
+}
+
+
+def map_in_threads(func, items) -> list:
+    """
+    func для каждого элемента в пуле из settings.IMAGE_INGEST_WORKERS потоков.
+
+    Результаты идут в порядке items, первая ошибка пробрасывается после завершения остальных.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(len(items), settings.IMAGE_INGEST_WORKERS)) as pool:
+        futures = [pool.submit(func, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def normalize_image(upload) -> ContentFile:
+    """
+    Загруженный файл, пересохранённый без метаданных; ValidationError, если это не изображение.
+    """
+    try:
+        with Image.open(upload) as original:
+            if original.format not in INGEST_FORMATS:
+                raise ValueError(f"unsupported format {original.format}")
+            image_format, extension = INGEST_FORMATS[original.format]
+            # Загружает изображение целиком: обрезанный файл даст ошибку здесь, а не при отдаче
+            image = ImageOps.exif_transpose(original)
+    except Exception as exc:
+        raise ValidationError(
+            "%(name)s: upload a valid JPEG, PNG or WebP image.",
+            code="invalid_image",
+            params={"name": upload.name},
+        ) from exc
+
+    # EXIF не передаётся и не сохраняется, цветовой профиль сохраняется
+    options = {"icc_profile": image.info.get("icc_profile")}
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = settings.IMAGE_INGEST_QUALITY
+
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return ContentFile(buffer.getvalue(), name=f"{PurePath(upload.name).stem}.{extension}")
+
+
+def normalize_images(uploads) -> list[ContentFile]:
+    """
+    normalize_image для всех файлов сразу; ValidationError перечисляет все неподходящие файлы.
+    """
+    def normalize(upload):
+        try:
+            return normalize_image(upload)
+        except ValidationError as exc:
+            return exc
+
+    results = map_in_threads(normalize, uploads)
+    errors = [result for result in results if isinstance(result, ValidationError)]
+    if errors:
+        raise ValidationError(errors)
+    return results
+
+
+def save_product_images(product: Product, files: list[ContentFile]) -> list[ProductImage]:
+    """
+    Пишет файлы в хранилище параллельно и создаёт строки ProductImage одним запросом.
+    """
+    images = [ProductImage(product=product) for _ in files]
+
+    def store(pair):
+        image, file = pair
+        image.image.save(file.name, file, save=False)
+
+    # Если bulk_create не удался, файлы не удаляются: тот же блоб может принадлежать
+    # другому изображению, а блоб без ссылок gc_media удалит после GC_GRACE_PERIOD
+    map_in_threads(store, zip(images, files))
+    images = ProductImage.objects.bulk_create(images)
+
+    # bulk_create не отправляет post_save, ссылки на файлы считаются здесь
+    add_references(image.image.name for image in images)
+    return images
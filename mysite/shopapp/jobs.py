@@ -0,0 +1,245 @@
+"""
+Фоновые задачи: импорт и экспорт CSV и задачи других приложений, например обработка
+аватаров (myauth.avatars), чьи обработчики регистрируются через register_job_handler.
+
+Очередь хранится в таблице BackgroundJob. Веб-запрос только создаёт задачу
+(enqueue_job) и сразу отвечает 202, а выполняет её команда runworker в пуле процессов.
+"""
+
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.core.files import File
+from django.db.models import Q
+from django.utils import timezone
+
+from .common import gzip_stream, save_csv_orders, save_csv_products, stream_csv
+from .models import BackgroundJob, Product
+from .search import search_products
+
+log = logging.getLogger(__name__)
+
+# Через сколько без обновлений задача в статусе running считается брошенной
+STALE_JOB_TIMEOUT = timedelta(minutes=30)
+
+# Сколько хранятся файлы завершённых задач (результаты выгрузок)
+JOB_FILES_RETENTION = timedelta(days=7)
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def enqueue_job(kind: str, user=None, source_file=None, params=None) -> BackgroundJob:
+    job = BackgroundJob(
+        kind=kind,
+        params=params or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    if source_file is not None:
+        job.source_file.save(source_file.name, source_file, save=False)
+    job.save()
+    log.info("Enqueued %s", job)
+    return job
+
+
+def claim_next_job():
+    """
+    Забирает самую старую задачу из очереди.
+
+    Статус меняется условным UPDATE, поэтому несколько воркеров не возьмут одну задачу.
+    """
+    Status = BackgroundJob.Status
+
+    while True:
+        job_id = (
+            BackgroundJob.objects
+            .filter(status=Status.PENDING)
+            .order_by("created_at", "pk")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+
+        now = timezone.now()
+        claimed = (
+            BackgroundJob.objects
+            .filter(pk=job_id, status=Status.PENDING)
+            .update(status=Status.RUNNING, started_at=now, updated_at=now)
+        )
+        if claimed:
+            return job_id
+
+
+# Импорт коммитит строки пачками (write_transaction на пачку), и повтор с первой
+# строки создал бы уже сохранённые товары и заказы заново
+NON_RESTARTABLE_KINDS = (BackgroundJob.Kind.PRODUCTS_IMPORT, BackgroundJob.Kind.ORDERS_IMPORT)
+
+
+def stale_jobs():
+    Status = BackgroundJob.Status
+    return BackgroundJob.objects.filter(status=Status.RUNNING, updated_at__lt=timezone.now() - STALE_JOB_TIMEOUT)
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Возвращает в очередь задачи, воркер которых умер, не завершив их (кроме импорта).
+    """
+    return (
+        stale_jobs()
+        .exclude(kind__in=NON_RESTARTABLE_KINDS)
+        .update(status=BackgroundJob.Status.PENDING, started_at=None, updated_at=timezone.now())
+    )
+
+
+def fail_stale_imports() -> int:
+    """
+    Завершает с ошибкой брошенные импорты: часть строк уже сохранена, повторять их нельзя.
+    """
+    failed = 0
+    for job in stale_jobs().filter(kind__in=NON_RESTARTABLE_KINDS).iterator():
+        error = (
+            f"The worker stopped after {job.rows_processed} row(s); "
+            "the import was not restarted, upload the remaining rows again"
+        )
+        # Условный UPDATE: задачу мог тем временем обработать другой воркер
+        if not BackgroundJob.objects.filter(pk=job.pk, status=BackgroundJob.Status.RUNNING).update(
+            status=BackgroundJob.Status.FAILED,
+            errors=job.errors + [{"error": error}],
+            finished_at=timezone.now(),
+            source_file="",
+        ):
+            continue
+        if job.source_file:
+            job.source_file.delete(save=False)
+        failed += 1
+    return failed
+
+
+def delete_expired_job_files() -> int:
+    """
+    Удаляет файлы задач, завершённых раньше JOB_FILES_RETENTION, и возвращает число задач.
+    """
+    jobs = (
+        BackgroundJob.objects
+        .filter(finished_at__lt=timezone.now() - JOB_FILES_RETENTION)
+        .exclude(Q(source_file="") | Q(source_file__isnull=True), Q(result_file="") | Q(result_file__isnull=True))
+    )
+
+    deleted = 0
+    for job in jobs.iterator():
+        for file in (job.source_file, job.result_file):
+            if file:
+                file.delete(save=False)
+        BackgroundJob.objects.filter(pk=job.pk).update(source_file="", result_file="")
+        deleted += 1
+    return deleted
+
+
+def run_job(job_id: int) -> str:
+    """
+    Выполняет задачу в текущем процессе и возвращает итоговый статус.
+    """
+    job = BackgroundJob.objects.get(pk=job_id)
+    handler = JOB_HANDLERS[job.kind]
+    log.info("Running %s", job)
+
+    try:
+        handler(job)
+    except Exception as exc:
+        log.exception("%s failed", job)
+        job.status = BackgroundJob.Status.FAILED
+        job.errors = job.errors + [{"error": str(exc)}]
+    else:
+        job.status = BackgroundJob.Status.DONE
+
+    # Загруженный файл нужен только для выполнения задачи
+    if job.source_file:
+        job.source_file.delete(save=False)
+
+    job.finished_at = timezone.now()
+    job.save()
+    return job.status
+
+
+def update_progress(job: BackgroundJob, processed: int):
+    # updated_at заодно показывает requeue_stale_jobs, что задача ещё выполняется
+    job.rows_processed = processed
+    BackgroundJob.objects.filter(pk=job.pk).update(rows_processed=processed, updated_at=timezone.now())
+
+
+def report_progress(job: BackgroundJob):
+    def progress(result):
+        update_progress(job, result.processed)
+
+    return progress
+
+
+def run_import(job: BackgroundJob, save_csv):
+    with job.source_file.open("rb") as source:
+        result = save_csv(
+            file=source.file,
+            encoding=job.params.get("encoding") or "utf-8",
+            progress=report_progress(job),
+        )
+
+    job.rows_processed = result.processed
+    job.result = {"created": result.created, "failed": result.failed}
+    job.errors = result.errors
+
+
+def import_products(job: BackgroundJob):
+    run_import(job, save_csv_products)
+
+
+def import_orders(job: BackgroundJob):
+    run_import(job, save_csv_orders)
+
+
+def export_products(job: BackgroundJob):
+    queryset = Product.objects.order_by("pk")
+    search = job.params.get("search")
+    if search:
+        result = search_products(queryset, search.split(), ranked=False)
+        queryset = result if result is not None else queryset.filter(name__icontains=search)
+
+    fields = ["name", "description", "price", "discount", "created_by"]
+    rows = (
+        queryset
+        .values_list("name", "description", "price", "discount", "created_by_id")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+    processed = 0
+
+    def counted(rows):
+        nonlocal processed
+        for row in rows:
+            processed += 1
+            if processed % EXPORT_CHUNK_SIZE == 0:
+                update_progress(job, processed)
+            yield row
+
+    with tempfile.TemporaryFile() as tmp:
+        for chunk in gzip_stream(stream_csv(header=fields, rows=counted(rows))):
+            tmp.write(chunk)
+        tmp.seek(0)
+        job.result_file.save(f"products-export-{job.pk}.csv.gz", File(tmp), save=False)
+
+    job.rows_processed = processed
+    job.result = {"exported": processed}
+
+
+JOB_HANDLERS = {
+    BackgroundJob.Kind.PRODUCTS_IMPORT: import_products,
+    BackgroundJob.Kind.ORDERS_IMPORT: import_orders,
+    BackgroundJob.Kind.PRODUCTS_EXPORT: export_products,
+}
+
+
+def register_job_handler(kind: str, handler):
+    """
+    Обработчик задач вида kind из другого приложения (вызывается из AppConfig.ready).
+    """
+    JOB_HANDLERS[kind] = handler
+    return handler
@@ -63,5 +63,15 @@ class Command(BaseCommand):
         # Order  # 2; Number of products: 2; Total worth: $352.990000000000.
         # Order  # 7; Number of products: 4; Total worth: $2798.43000000000.
 
+        # То же самое без join: итоги хранятся в заказе и поддерживаются сигналами (shopapp.totals)
+        orders = Order.objects.only("pk", "total_price", "discounted_total", "products_count")
+
+        for order in orders:
+            print(
+                f"Order #{order.pk}; "
+                f"Number of products: {order.products_count}; "
+                f"Total worth: ${order.total_price}; "
+                f"With discounts: ${order.discounted_total}."
+            )
 
         self.stdout.write("done")
\ No newline at end of file
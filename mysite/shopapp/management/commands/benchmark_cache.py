@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import time
+from hashlib import md5
+from multiprocessing import get_context
+from random import Random
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import BaseCommand
+
+from mysite.cache_backends import SQLiteCache, TieredFileBasedCache, TieredSQLiteCache
+
+BACKENDS = {
+    "file": (FileBasedCache, "dir"),
+    "tiered-file": (TieredFileBasedCache, "dir"),
+    "sqlite": (SQLiteCache, "file"),
+    "tiered-sqlite": (TieredSQLiteCache, "file"),
+}
+
+
+def make_backend(name, location, max_entries):
+    backend_class, _ = BACKENDS[name]
+    return backend_class(location, {"OPTIONS": {"MAX_ENTRIES": max_entries}})
+
+
+def run_phases(name, location, options, seed):
+    """
+    Выполняет сценарий в одном процессе и возвращает {фаза: (операций, секунд)}.
+    """
+    cache = make_backend(name, location, options["max_entries"])
+    random = Random(seed)
+    value = {"results": ["x" * options["value_size"]]}
+    # Как у cache_page для ProductViewSet.list: отдельный ключ на каждую строку запроса
+    keys = [f"products_api_list:{md5(str(index).encode()).hexdigest()}" for index in range(options["keys"])]
+    hot_keys = keys[:50]
+    results = {}
+
+    def measure(phase, operations, func):
+        started = time.perf_counter()
+        func()
+        results[phase] = (operations, time.perf_counter() - started)
+
+    measure("set", len(keys), lambda: [cache.set(key, value) for key in keys])
+    for key in hot_keys:
+        cache.set(key, value)
+
+    reads = options["reads"]
+    measure("get_hot", reads, lambda: [cache.get(random.choice(hot_keys)) for _ in range(reads)])
+    measure("get_random", reads, lambda: [cache.get(random.choice(keys)) for _ in range(reads)])
+    measure("has_key", reads, lambda: [cache.has_key(random.choice(keys)) for _ in range(reads)])
+    measure(
+        "get_many_50",
+        reads // 50,
+        lambda: [cache.get_many(random.sample(keys, 50)) for _ in range(reads // 50)],
+    )
+    measure(
+        "set_many_50",
+        len(keys) // 50,
+        lambda: [
+            cache.set_many({key: value for key in keys[start:start + 50]})
+            for start in range(0, len(keys), 50)
+        ],
+    )
+    return results
+
+
+class Command(BaseCommand):
+    """
+    Compares cache backends on a cache_page-like workload
+    """
+
+    help = "Benchmark FileBasedCache against the SQLite and tiered cache backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+        parser.add_argument("--keys", type=int, default=5000, help="Distinct keys (query string variants).")
+        parser.add_argument("--max-entries", type=int, default=2000, help="MAX_ENTRIES, below --keys to force culling.")
+        parser.add_argument("--value-size", type=int, default=2048, help="Approximate value size in bytes.")
+        parser.add_argument("--reads", type=int, default=20000, help="Reads per read phase and process.")
+        parser.add_argument("--processes", type=int, default=1, help="Concurrent processes sharing the cache.")
+
+    def handle(self, *args, **options):
+        for name in options["backends"]:
+            root = tempfile.mkdtemp(prefix="cache-benchmark-")
+            _, kind = BACKENDS[name]
+            location = root if kind == "dir" else os.path.join(root, "cache.sqlite3")
+
+            try:
+                results = self.run_backend(name, location, options)
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+
+            self.stdout.write(f"\n{name}")
+            for phase, (operations, seconds) in results.items():
+                self.stdout.write(
+                    f"  {phase:<12} {operations / seconds:>12,.0f} ops/s  {seconds * 1000:>9.1f} ms"
+                )
+
+    def run_backend(self, name, location, options):
+        processes = options["processes"]
+        if processes == 1:
+            return run_phases(name, location, options, seed=0)
+
+        with get_context("fork").Pool(processes) as pool:
+            per_process = pool.starmap(
+                run_phases,
+                [(name, location, options, seed) for seed in range(processes)],
+            )
+
+        # Суммарная пропускная способность: все операции за время самого медленного процесса
+        return {
+            phase: (
+                sum(result[phase][0] for result in per_process),
+                max(result[phase][1] for result in per_process),
+            )
+            for phase in per_process[0]
+        }
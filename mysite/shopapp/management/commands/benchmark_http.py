@@ -0,0 +1,134 @@
+import platform
+import shutil
+import tempfile
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from shopapp.benchmarks import DEFAULT_THRESHOLD, SCENARIOS, compare, load_results, run_benchmarks, save_results
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "http-baseline.json"
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the hot shop pages and API endpoints in-process against a generated dataset
+    """
+
+    help = (
+        "Create a throwaway file-based test database, fill it with generate_shop_data, measure throughput and "
+        "p50/p95/p99 latency of the hot endpoints and compare them with a stored JSON baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", nargs="+", choices=[scenario.name for scenario in SCENARIOS])
+        parser.add_argument("--requests", type=int, default=30, help="Measured requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests per scenario.")
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write results as JSON to this file.")
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON to compare with.")
+        parser.add_argument("--save-baseline", action="store_true", help="Overwrite the baseline with these results.")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=DEFAULT_THRESHOLD,
+            help="Allowed p95 growth / throughput drop as a fraction (0.2 = 20%%).",
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options["scenarios"] or scenario.name in options["scenarios"]
+        ]
+        results = self.run(scenarios, options)
+        meta = {
+            "created_at": timezone.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "machine": platform.machine(),
+            "dataset": {name: options[name] for name in ("users", "products", "orders", "seed")},
+            "requests": options["requests"],
+        }
+
+        self.stdout.write(f"{'scenario':<24} {'rps':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<24} {result['rps']:>10.1f} {result['p50_ms']:>10.2f} "
+                f"{result['p95_ms']:>10.2f} {result['p99_ms']:>10.2f}"
+            )
+
+        if options["output"]:
+            save_results(options["output"], results, meta)
+
+        baseline_path = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            save_results(baseline_path, results, meta)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}"))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}, nothing to compare"))
+            return
+
+        rows = compare(results, load_results(baseline_path), options["threshold"])
+        self.stdout.write(f"\n{'scenario':<24} {'p95':>10} {'rps':>10}")
+        for row in rows:
+            line = f"{row['name']:<24} {row['p95_change']:>+10.1%} {row['rps_change']:>+10.1%}"
+            self.stdout.write(self.style.ERROR(line) if row["regression"] else line)
+
+        regressions = [row["name"] for row in rows if row["regression"]]
+        if regressions:
+            raise CommandError(f"Regressions over {options['threshold']:.0%}: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
+
+    def run(self, scenarios, options):
+        # Кеш, загрузки и метрики во временном каталоге, чтобы не трогать рабочие
+        root = tempfile.mkdtemp(prefix="http-benchmark-")
+        overrides = override_settings(
+            CACHES={
+                "default": {
+                    **settings.CACHES["default"],
+                    "LOCATION": str(Path(root) / "cache" / "cache.sqlite3"),
+                },
+            },
+            MEDIA_ROOT=str(Path(root) / "uploads"),
+            METRICS_DIR=str(Path(root) / "metrics"),
+        )
+
+        setup_test_environment()
+        # Файловая база с OPTIONS из настроек (WAL, mmap, ...), как в работе, а не SQLite в памяти
+        connection.settings_dict["TEST"]["NAME"] = str(Path(root) / "db.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Реплика должна смотреть в ту же тестовую базу, как при запуске тестов
+        for alias in connections:
+            if connections[alias].settings_dict["TEST"]["MIRROR"] == connection.alias:
+                connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            with overrides:
+                call_command(
+                    "generate_shop_data",
+                    users=options["users"],
+                    products=options["products"],
+                    orders=options["orders"],
+                    seed=options["seed"],
+                    stdout=self.stdout,
+                )
+                user = User.objects.create_superuser(username="benchmark", password="benchmark")
+                client = Client()
+                client.force_login(user)
+                return run_benchmarks(client, user.pk, scenarios, options["requests"], options["warmup"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(root, ignore_errors=True)
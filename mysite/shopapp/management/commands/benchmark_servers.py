@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.benchmarks import SERVER_SCENARIOS, http_get, run_load
+
+HOST = "127.0.0.1"
+
+SERVER_COMMANDS = {
+    "wsgi": ["mysite.wsgi:application"],
+    "asgi": ["mysite.asgi:application", "--worker-class", "uvicorn_worker.UvicornWorker"],
+}
+
+# Настройки серверов: всё рабочее (база, кеш, загрузки, метрики) - во временном каталоге
+SETTINGS_TEMPLATE = """\
+from mysite.settings import *  # noqa: F401,F403
+
+DATABASES["default"] = {{**DATABASES["default"], "NAME": {database!r}}}
+DATABASES["replica"] = {{**DATABASES["replica"], "NAME": {replica!r}}}
+CACHES = {{"default": {{**CACHES["default"], "LOCATION": {cache!r}}}}}
+MEDIA_ROOT = {media!r}
+METRICS_DIR = {metrics!r}
+DEBUG = False
+"""
+
+SERVER_START_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    """
+    Compares gunicorn sync workers (WSGI) with uvicorn workers (ASGI) at high concurrency
+    """
+
+    help = (
+        "Generate a throwaway database, start gunicorn with sync workers on the sync catalog views "
+        "and gunicorn with uvicorn workers on their async counterparts, and load both over HTTP "
+        "with many concurrent clients, optionally next to a pool of slow clients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modes", nargs="+", choices=list(SERVER_COMMANDS), default=list(SERVER_COMMANDS))
+        parser.add_argument("--scenarios", nargs="+", choices=[scenario.name for scenario in SERVER_SCENARIOS])
+        parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes.")
+        parser.add_argument("--concurrency", type=int, default=100, help="Concurrent clients.")
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario.")
+        parser.add_argument(
+            "--slow-clients",
+            type=int,
+            default=0,
+            help="Extra unmeasured clients that keep sending requests slowly during each scenario.",
+        )
+        parser.add_argument(
+            "--send-delay",
+            type=float,
+            default=1.0,
+            help="Seconds a slow client pauses in the middle of sending its request.",
+        )
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--orders", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        scenarios = [
+            scenario for scenario in SERVER_SCENARIOS
+            if not options["scenarios"] or scenario.name in options["scenarios"]
+        ]
+        self.root = Path(tempfile.mkdtemp(prefix="server-benchmark-"))
+        try:
+            env = self.prepare(options)
+            product_id = self.most_popular_product(env)
+            results = {
+                mode: self.run_mode(mode, scenarios, product_id, env, options)
+                for mode in options["modes"]
+            }
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+        self.stdout.write(
+            f"{'mode':<6} {'scenario':<22} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+        )
+        for mode, mode_results in results.items():
+            for name, result in mode_results.items():
+                if not result["requests"]:
+                    self.stdout.write(self.style.ERROR(f"{mode:<6} {name:<22} all requests failed"))
+                    continue
+                self.stdout.write(
+                    f"{mode:<6} {name:<22} {result['rps']:>9.1f} {result['p50_ms']:>9.2f} "
+                    f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['errors']:>7}"
+                )
+
+        if options["output"]:
+            meta = {
+                name: options[name]
+                for name in (
+                    "workers", "concurrency", "requests", "slow_clients", "send_delay",
+                    "users", "products", "orders", "seed",
+                )
+            }
+            with open(options["output"], "w") as f:
+                json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+    def prepare(self, options) -> dict:
+        root = self.root
+        database = root / "db.sqlite3"
+        (root / "benchmark_settings.py").write_text(SETTINGS_TEMPLATE.format(
+            database=str(database),
+            replica=f"file:{database}?mode=ro",
+            cache=str(root / "cache" / "cache.sqlite3"),
+            media=str(root / "uploads"),
+            metrics=str(root / "metrics"),
+        ))
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "benchmark_settings",
+            "PYTHONPATH": os.pathsep.join([str(root), str(settings.BASE_DIR)]),
+        }
+
+        self.stdout.write("Generating data...")
+        self.manage(env, "migrate", "--verbosity", "0")
+        self.manage(
+            env,
+            "generate_shop_data",
+            "--users", str(options["users"]),
+            "--products", str(options["products"]),
+            "--orders", str(options["orders"]),
+            "--seed", str(options["seed"]),
+        )
+        return env
+
+    def manage(self, env: dict, *args) -> str:
+        result = subprocess.run(
+            [sys.executable, "manage.py", *args],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"manage.py {args[0]} failed:\n{result.stderr}")
+        return result.stdout
+
+    def most_popular_product(self, env: dict) -> int:
+        output = self.manage(
+            env,
+            "shell",
+            "-c",
+            "from django.db.models import Count; from shopapp.models import Product; "
+            "print(Product.objects.filter(archived=False).annotate(orders_count=Count('orders'))"
+            ".order_by('-orders_count', 'pk').values_list('pk', flat=True).first())",
+        )
+        return int(output.strip().splitlines()[-1])
+
+    def run_mode(self, mode: str, scenarios, product_id: int, env: dict, options) -> dict:
+        port = free_port()
+        log_path = self.root / f"{mode}.log"
+        with log_path.open("w") as log:
+            server = subprocess.Popen(
+                [
+                    sys.executable, "-m", "gunicorn", *SERVER_COMMANDS[mode],
+                    "--bind", f"{HOST}:{port}",
+                    "--workers", str(options["workers"]),
+                    "--log-level", "warning",
+                ],
+                cwd=settings.BASE_DIR,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=log,
+            )
+            try:
+                results = {}
+                for scenario in scenarios:
+                    path = scenario.url(mode, product_id)
+                    self.wait_until_ready(server, port, path, log_path)
+                    self.stdout.write(f"{mode}: {scenario.name} ({path})")
+                    results[scenario.name] = asyncio.run(run_load(
+                        HOST,
+                        port,
+                        path,
+                        options["requests"],
+                        options["concurrency"],
+                        options["slow_clients"],
+                        options["send_delay"],
+                    ))
+                return results
+            finally:
+                server.terminate()
+                server.wait()
+
+    @staticmethod
+    def wait_until_ready(server: subprocess.Popen, port: int, path: str, log_path: Path):
+        # Заодно прогревает кеш сценария
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"Server exited with code {server.returncode}:\n{log_path.read_text()}")
+            try:
+                if asyncio.run(http_get(HOST, port, path)) < 400:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise CommandError(f"Server did not answer {path} in {SERVER_START_TIMEOUT}s")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
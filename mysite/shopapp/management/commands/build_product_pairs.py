@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from shopapp.caching import PRODUCTS, bump_generation
+from shopapp.recommendations import build_product_pairs
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the "frequently bought together" index from Order.products
+    """
+
+    help = "Rebuild ProductPair co-occurrence counts in one pass over the order/product table."
+
+    def handle(self, *args, **options):
+        pairs = build_product_pairs()
+        # Кешированные топы привязаны и к поколению товаров
+        bump_generation(PRODUCTS)
+        self.stdout.write(self.style.SUCCESS(f"Built {pairs} product pair(s)"))
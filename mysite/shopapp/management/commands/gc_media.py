@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+
+from shopapp.media import GC_GRACE_PERIOD, collect_garbage
+
+
+class Command(BaseCommand):
+    """
+    Removes content-addressed media files nothing refers to
+    """
+
+    help = (
+        "Recount MediaBlob references from the model fields and delete blobs (with their thumbnails) "
+        "that are unreferenced and were not touched during the grace period."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=GC_GRACE_PERIOD.total_seconds() / 3600,
+            help="Keep unreferenced blobs changed within this many hours (uploads may be in flight).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+
+    def handle(self, *args, **options):
+        stats = collect_garbage(timedelta(hours=options["grace_hours"]), dry_run=options["dry_run"])
+
+        action = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(f"Blobs: {stats['blobs']}, references fixed: {stats['fixed']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {stats['deleted']} unreferenced blob(s), {stats['freed_bytes']} bytes"
+        ))
@@ -0,0 +1,238 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+from random import Random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from myauth.models import Profile
+from shopapp.caching import ORDERS, PRODUCTS, bump_generation
+from shopapp.common import bulk_insert, iter_chunks
+from shopapp.models import Order, Product, ProductImage
+from shopapp.recommendations import build_product_pairs
+from shopapp.reports import SalesDeltas, order_day
+from shopapp.search import deferred_search_index
+from shopapp.totals import Totals
+
+ADJECTIVES = ("Compact", "Smart", "Wireless", "Classic", "Portable", "Ultra", "Eco", "Pro", "Mini", "Premium")
+NOUNS = ("Laptop", "Phone", "Headphones", "Keyboard", "Monitor", "Camera", "Speaker", "Watch", "Tablet", "Router")
+WORDS = (
+    "durable", "lightweight", "fast", "quiet", "waterproof", "bluetooth", "ergonomic", "battery",
+    "aluminium", "warranty", "charger", "display", "storage", "memory", "gift", "travel",
+)
+STREETS = ("Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Lake", "Hill", "Park", "River")
+PROMOCODES = ("SALE", "WELCOME10", "BLACKFRIDAY", "SUMMER", "VIP")
+DISCOUNTS = (5, 10, 15, 20, 25, 50)
+
+
+def zipf_cum_weights(count: int, exponent: float) -> list[float]:
+    """
+    Накопленные веса распределения Ципфа: элемент ранга r выбирается с весом 1 / r ** exponent.
+    """
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    """
+    Generates a large synthetic dataset with skewed product popularity and buyers
+    """
+
+    help = (
+        "Generate users with profiles, products with images, orders and order/product rows "
+        "in batches for load testing. Image rows point to files that are not created."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument("--max-images", type=int, default=3, help="Images per product, up to this number.")
+        parser.add_argument("--max-order-products", type=int, default=8, help="Products per order, up to this number.")
+        parser.add_argument("--days", type=int, default=365, help="Spread order dates over this many days.")
+        parser.add_argument("--product-skew", type=float, default=1.1, help="Zipf exponent of product popularity.")
+        parser.add_argument("--buyer-skew", type=float, default=1.0, help="Zipf exponent of orders per user.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=10000, help="Rows per transaction.")
+        parser.add_argument(
+            "--skip-pairs",
+            action="store_true",
+            help="Do not rebuild product pairs (run build_product_pairs later).",
+        )
+
+    def handle(self, *args, **options):
+        self.random = Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.prefix = f"gen{options['seed']}_"
+        self.started = time.monotonic()
+
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(f"Data for seed {options['seed']} already exists (users {self.prefix}*).")
+
+        user_ids = self.generate_users(options["users"])
+        products = self.generate_products(options["products"], user_ids)
+        self.generate_images(products, options["max_images"])
+        self.generate_orders(options, user_ids, products)
+
+        if not options["skip_pairs"]:
+            self.log(f"Built {build_product_pairs()} product pair(s)")
+
+        with transaction.atomic():
+            bump_generation(PRODUCTS, ORDERS)
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - self.started:.1f}s"))
+
+    def log(self, message):
+        self.stdout.write(f"[{time.monotonic() - self.started:8.1f}s] {message}")
+
+    def new_ids(self, model, last_pk):
+        return list(model.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True))
+
+    def last_pk(self, model):
+        return model.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+
+    def generate_users(self, count):
+        # Хеширование пароля дорогое, поэтому у всех пользователей один и тот же хеш
+        password = make_password("Qwerty123!")
+        last_pk = self.last_pk(User)
+
+        for batch in iter_chunks(range(count), self.batch_size):
+            with transaction.atomic():
+                bulk_insert(
+                    User,
+                    ("username", "email", "password"),
+                    [(f"{self.prefix}{index}", f"{self.prefix}{index}@example.com", password) for index in batch],
+                    batch_size=self.batch_size,
+                )
+
+        user_ids = self.new_ids(User, last_pk)
+        for batch in iter_chunks(user_ids, self.batch_size):
+            with transaction.atomic():
+                bulk_insert(Profile, ("user_id", "bio"), [(pk, "Generated buyer") for pk in batch], batch_size=self.batch_size)
+
+        self.log(f"Created {len(user_ids)} user(s) with profiles")
+        return user_ids
+
+    def generate_products(self, count, user_ids):
+        """
+        Возвращает {pk: (price, discount)} созданных товаров.
+        """
+        random = self.random
+        fields = ("name", "description", "price", "discount", "created_by_id")
+        products = {}
+
+        for batch in iter_chunks(range(count), self.batch_size):
+            rows = []
+            for index in batch:
+                price = min(Decimal(str(round(random.lognormvariate(3.5, 1.0), 2))), Decimal("999999.99"))
+                discount = random.choice(DISCOUNTS) if random.random() < 0.3 else 0
+                rows.append((
+                    f"{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {self.prefix}{index}",
+                    " ".join(random.choices(WORDS, k=8)),
+                    price,
+                    discount,
+                    random.choice(user_ids),
+                ))
+
+            with transaction.atomic(), deferred_search_index():
+                last_pk = self.last_pk(Product)
+                bulk_insert(Product, fields, rows, batch_size=self.batch_size)
+                product_ids = self.new_ids(Product, last_pk)
+
+            products.update((pk, (row[2], row[3])) for pk, row in zip(product_ids, rows))
+
+        self.log(f"Created {len(products)} product(s)")
+        return products
+
+    def generate_images(self, products, max_images):
+        rows = (
+            (pk, f"products/product_{pk}/images/{number}.jpg", f"Image {number}")
+            for pk in products
+            for number in range(1, self.random.randint(0, max_images) + 1)
+        )
+        created = 0
+        for batch in iter_chunks(rows, self.batch_size):
+            with transaction.atomic():
+                bulk_insert(ProductImage, ("product_id", "image", "description"), batch, batch_size=self.batch_size)
+            created += len(batch)
+        self.log(f"Created {created} product image(s)")
+
+    def generate_orders(self, options, user_ids, products):
+        random = self.random
+        OrderProducts = Order.products.through
+
+        # Популярность не совпадает с порядком pk: ранги раздаются случайно
+        popular_products = list(products)
+        random.shuffle(popular_products)
+        product_weights = zipf_cum_weights(len(popular_products), options["product_skew"])
+        buyers = list(user_ids)
+        random.shuffle(buyers)
+        buyer_weights = zipf_cum_weights(len(buyers), options["buyer_skew"])
+        # Чаще всего в заказе один-два товара
+        sizes = range(1, options["max_order_products"] + 1)
+        size_weights = zipf_cum_weights(len(sizes), 1.0)
+
+        # Заказы идут по времени, как в рабочей базе: pk растёт вместе с created_at, и каждая
+        # пачка затрагивает немного дней, так что строк дневных итогов обновляется меньше
+        count = options["orders"]
+        period = timedelta(days=options["days"]).total_seconds()
+        start = timezone.now() - timedelta(seconds=period)
+        fields = (
+            "delivery_address", "promocode", "user_id", "created_at",
+            "total_price", "discounted_total", "products_count",
+        )
+        created = 0
+        links = 0
+
+        for batch in iter_chunks(range(count), self.batch_size):
+            orders = []
+            order_products = []
+            deltas = SalesDeltas()
+            for index in batch:
+                size = random.choices(sizes, cum_weights=size_weights)[0]
+                product_ids = list(dict.fromkeys(random.choices(popular_products, cum_weights=product_weights, k=size)))
+                promocode = random.choice(PROMOCODES) if random.random() < 0.1 else ""
+                user_id = random.choices(buyers, cum_weights=buyer_weights)[0]
+                created_at = start + timedelta(seconds=period * (index + random.random()) / count)
+
+                # Итоги заказа и дневные итоги продаж считаются сразу, без пересчёта по базе
+                identity = (order_day(created_at), user_id, promocode)
+                deltas.add_order(*identity)
+                totals = Totals()
+                for product_id in product_ids:
+                    totals.add(*products[product_id])
+                    deltas.add_line(*identity, product_id, *products[product_id])
+
+                orders.append((
+                    f"{random.randint(1, 999)} {random.choice(STREETS)} st",
+                    promocode,
+                    user_id,
+                    created_at,
+                    totals.total_price,
+                    totals.discounted_total,
+                    totals.products_count,
+                ))
+                order_products.append(product_ids)
+
+            with transaction.atomic():
+                last_pk = self.last_pk(Order)
+                bulk_insert(Order, fields, orders, batch_size=self.batch_size)
+                order_ids = self.new_ids(Order, last_pk)
+                bulk_insert(
+                    OrderProducts,
+                    ("order_id", "product_id"),
+                    [
+                        (order_id, product_id)
+                        for order_id, product_ids in zip(order_ids, order_products)
+                        for product_id in product_ids
+                    ],
+                    batch_size=self.batch_size,
+                )
+                deltas.save()
+
+            created += len(orders)
+            links += sum(len(product_ids) for product_ids in order_products)
+            self.log(f"Created {created}/{count} order(s), {links} order/product row(s)")
@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+
+from shopapp.caching import ORDERS, bump_generation, order_card_namespace
+from shopapp.models import Order
+from shopapp.totals import REBUILD_BATCH_SIZE, rebuild_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Recalculates materialized order totals from Order.products
+    """
+
+    help = "Rebuild Order.total_price, discounted_total and products_count (e.g. after raw SQL or bulk updates)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE, help="Orders per UPDATE batch.")
+        parser.add_argument("--order", type=int, nargs="*", help="Only rebuild these order pks.")
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options["order"]:
+            orders = orders.filter(pk__in=options["order"])
+
+        # Пачки коммитятся по отдельности, чтобы не держать блокировку на запись всю команду
+        processed = rebuild_order_totals(orders, batch_size=options["batch_size"])
+        # Итоги есть и в карточках заказов
+        bump_generation(ORDERS, *map(order_card_namespace, orders.values_list("pk", flat=True)))
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt totals for {processed} order(s)"))
@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from shopapp.reports import REBUILD_BATCH_SIZE, rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    """
+    Recalculates the daily sales rollups used by /shop/api/reports/
+    """
+
+    help = "Rebuild DailySales, ProductDailySales, UserDailySales and PromocodeDailySales from orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE, help="Orders per batch.")
+
+    def handle(self, *args, **options):
+        processed = rebuild_sales_rollups(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups from {processed} order(s)"))
@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+import django
+from django.core.management import BaseCommand
+from django.db import connections
+
+from shopapp.jobs import claim_next_job, delete_expired_job_files, fail_stale_imports, requeue_stale_jobs, run_job
+
+# Как часто возвращать в очередь брошенные задачи и удалять старые файлы задач, секунд
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    """
+    Runs background CSV import/export jobs in a process pool
+    """
+
+    help = "Process queued BackgroundJob rows (CSV imports and exports)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2, help="Size of the process pool.")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between queue polls.")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        poll_interval = options["poll_interval"]
+
+        self.stdout.write(f"Starting worker with {processes} process(es)")
+
+        # spawn: дочерние процессы не наследуют открытые соединения с БД,
+        # а django.setup() в initializer готовит приложения до первой задачи
+        executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=get_context("spawn"),
+            initializer=django.setup,
+        )
+        running = {}
+        last_maintenance = None
+
+        try:
+            while True:
+                if last_maintenance is None or time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                    self.run_maintenance()
+                    last_maintenance = time.monotonic()
+
+                while len(running) < processes:
+                    job_id = claim_next_job()
+                    if job_id is None:
+                        break
+                    self.stdout.write(f"Job #{job_id} started")
+                    running[executor.submit(run_job, job_id)] = job_id
+
+                # Соединение родителя не должно висеть открытым между опросами
+                connections.close_all()
+
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as exc:
+                        self.stderr.write(f"Job #{job_id} crashed: {exc}")
+                    else:
+                        self.stdout.write(f"Job #{job_id} {status}")
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping worker")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self.stdout.write(self.style.SUCCESS("Worker stopped"))
+
+    def run_maintenance(self):
+        # Не только при старте: воркер другого контейнера мог умереть, пока этот работает
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        failed = fail_stale_imports()
+        if failed:
+            self.stdout.write(f"Failed {failed} stale import job(s)")
+
+        expired = delete_expired_job_files()
+        if expired:
+            self.stdout.write(f"Deleted files of {expired} expired job(s)")
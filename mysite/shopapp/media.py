@@ -0,0 +1,187 @@
+"""
+Учёт ссылок на файлы ContentAddressedStorage и сборка мусора.
+
+MediaBlob.references - сколько значений полей моделей указывают на файл. Сигналы
+увеличивают счётчик, когда в поле загружается файл, и уменьшают его при замене
+файла и удалении строки. Файл при этом не удаляется, ведь им может пользоваться
+ещё не зафиксированная транзакция.
+
+update() и bulk_create сигналов не отправляют, и счётчик может разойтись со
+строками. Поэтому collect_garbage сначала пересчитывает ссылки по самим строкам и
+удаляет только файлы без ссылок, которые не менялись дольше grace-периода.
+"""
+
+import logging
+import os
+from collections import Counter
+from datetime import timedelta
+from functools import cache
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import MediaBlob
+from .storage import BLOBS_DIR, BLOBS_TMP_DIR, THUMBNAILS_DIR, ContentAddressedStorage, blob_storage, is_blob_name
+
+log = logging.getLogger(__name__)
+
+# Сколько файл без ссылок хранится после последнего изменения: загрузка могла ещё не зафиксироваться
+GC_GRACE_PERIOD = timedelta(hours=24)
+GC_DELETE_BATCH_SIZE = 500
+
+
+# Функции, которые возвращают имена файлов, хранящихся не в FileField (например, копий аватаров)
+_reference_sources = []
+
+
+def register_reference_source(func):
+    _reference_sources.append(func)
+    return func
+
+
+@cache
+def blob_fields(model) -> list[str]:
+    """
+    attname полей модели, которые хранят файлы в ContentAddressedStorage.
+    """
+    return [
+        field.attname
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def add_references(names, sign: int = 1):
+    counts = Counter(name for name in names if name and is_blob_name(name))
+    now = timezone.now()
+
+    for name, count in counts.items():
+        if sign < 0:
+            # Счётчик может быть уже занижен (см. collect_garbage), ниже нуля он не уходит
+            MediaBlob.objects.filter(name=name).update(
+                references=Greatest(F("references") - count, 0),
+                updated_at=now,
+            )
+            continue
+
+        if MediaBlob.objects.filter(name=name).update(references=F("references") + count, updated_at=now):
+            continue
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.create(name=name, references=count)
+        except IntegrityError:
+            # Строку одновременно создал другой запрос
+            MediaBlob.objects.filter(name=name).update(references=F("references") + count, updated_at=now)
+
+
+def remove_references(names):
+    add_references(names, sign=-1)
+
+
+def count_references() -> Counter:
+    """
+    Ссылки на файлы по всем полям всех моделей и зарегистрированным источникам.
+    """
+    references = Counter()
+    for model in apps.get_models():
+        for attname in blob_fields(model):
+            names = model._base_manager.exclude(**{attname: ""}).exclude(**{f"{attname}__isnull": True})
+            references.update(name for name in names.values_list(attname, flat=True).iterator() if is_blob_name(name))
+    for source in _reference_sources:
+        references.update(name for name in source() if is_blob_name(name))
+    return references
+
+
+def stored_blobs(storage) -> dict[str, float]:
+    """
+    Файлы хранилища (без копий в thumbs/ и недописанных) и время их изменения.
+    """
+    blobs = {}
+    for prefix in storage.listdir(BLOBS_DIR)[0]:
+        directory = f"{BLOBS_DIR}/{prefix}"
+        if directory == BLOBS_TMP_DIR:
+            continue
+        for filename in storage.listdir(directory)[1]:
+            name = f"{directory}/{filename}"
+            blobs[name] = os.path.getmtime(storage.path(name))
+    return blobs
+
+
+def delete_blob(storage, name: str, dry_run: bool = False) -> int:
+    """
+    Удаляет файл и его уменьшенные копии, возвращает число освобождённых байт.
+    """
+    directory, filename = name.rsplit("/", 1)
+    stem = filename.split(".", 1)[0]
+    names = [name]
+
+    thumbs_dir = f"{directory}/{THUMBNAILS_DIR}"
+    if storage.exists(thumbs_dir):
+        names.extend(f"{thumbs_dir}/{thumb}" for thumb in storage.listdir(thumbs_dir)[1] if thumb.startswith(f"{stem}."))
+
+    freed = 0
+    for path in map(storage.path, names):
+        freed += os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+    return freed
+
+
+def collect_garbage(grace_period: timedelta = GC_GRACE_PERIOD, dry_run: bool = False) -> dict:
+    """
+    Пересчитывает MediaBlob.references и удаляет файлы, на которые ничто не ссылается.
+    """
+    storage = blob_storage()
+    cutoff = timezone.now() - grace_period
+
+    references = count_references()
+    saved = dict(MediaBlob.objects.values_list("name", "references"))
+    stale = [name for name, count in saved.items() if references.get(name, 0) != count]
+    missing = [name for name in references if name not in saved]
+
+    stats = {"blobs": 0, "fixed": len(stale) + len(missing), "deleted": 0, "freed_bytes": 0}
+    if not storage.exists(BLOBS_DIR):
+        return stats
+
+    if not dry_run:
+        with transaction.atomic():
+            for name in stale:
+                MediaBlob.objects.filter(name=name).update(references=references.get(name, 0))
+            MediaBlob.objects.bulk_create(
+                [MediaBlob(name=name, references=references[name]) for name in missing],
+                ignore_conflicts=True,
+            )
+
+    recently_changed = set(MediaBlob.objects.filter(updated_at__gte=cutoff).values_list("name", flat=True))
+    blobs = stored_blobs(storage)
+    stats["blobs"] = len(blobs)
+
+    for name, modified in blobs.items():
+        if name in references or name in recently_changed or modified >= cutoff.timestamp():
+            continue
+        # Пока шёл пересчёт, этот же файл могли загрузить заново (см. ContentAddressedStorage._save)
+        if os.path.getmtime(storage.path(name)) >= cutoff.timestamp():
+            continue
+        log.info("Deleting unreferenced %s", name)
+        stats["deleted"] += 1
+        stats["freed_bytes"] += delete_blob(storage, name, dry_run)
+        if not dry_run:
+            MediaBlob.objects.filter(name=name, references=0).delete()
+
+    if not dry_run:
+        # Строки файлов, которых уже нет
+        orphan_rows = MediaBlob.objects.filter(references=0, updated_at__lt=cutoff).values_list("pk", "name")
+        orphan_pks = [pk for pk, name in orphan_rows.iterator() if name not in blobs]
+        for start in range(0, len(orphan_pks), GC_DELETE_BATCH_SIZE):
+            MediaBlob.objects.filter(pk__in=orphan_pks[start:start + GC_DELETE_BATCH_SIZE]).delete()
+
+    if not dry_run and storage.exists(BLOBS_TMP_DIR):
+        for filename in storage.listdir(BLOBS_TMP_DIR)[1]:
+            path = storage.path(f"{BLOBS_TMP_DIR}/{filename}")
+            if os.path.getmtime(path) < cutoff.timestamp():
+                os.remove(path)
+
+    return stats
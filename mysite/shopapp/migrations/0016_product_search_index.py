@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+# SQL на момент миграции; текущая схема индекса - в shopapp.search
+CREATE_SEARCH_INDEX_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS shopapp_product_fts USING fts5(
+        name,
+        description,
+        archived UNINDEXED,
+        content='shopapp_product',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_ai AFTER INSERT ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(rowid, name, description, archived)
+        VALUES (new.id, new.name, new.description, new.archived);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_ad AFTER DELETE ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(shopapp_product_fts, rowid, name, description, archived)
+        VALUES ('delete', old.id, old.name, old.description, old.archived);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_au
+    AFTER UPDATE OF name, description, archived ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(shopapp_product_fts, rowid, name, description, archived)
+        VALUES ('delete', old.id, old.name, old.description, old.archived);
+        INSERT INTO shopapp_product_fts(rowid, name, description, archived)
+        VALUES (new.id, new.name, new.description, new.archived);
+    END
+    """,
+    "INSERT INTO shopapp_product_fts(shopapp_product_fts) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_INDEX_SQL = [
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_ai",
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_ad",
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_au",
+    "DROP TABLE IF EXISTS shopapp_product_fts",
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        with schema_editor.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_order_shopapp_order_keyset_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='description',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(run_sqlite(CREATE_SEARCH_INDEX_SQL), run_sqlite(DROP_SEARCH_INDEX_SQL)),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+from django.db import migrations
+
+# Триггер на вставку теперь учитывает флаг отложенной индексации (shopapp.search.deferred_search_index).
+# SQL на момент миграции; текущая схема индекса - в shopapp.search
+RECREATE_INSERT_TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_ai",
+    """
+    CREATE TABLE IF NOT EXISTS shopapp_product_fts_sync (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        deferred INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT OR IGNORE INTO shopapp_product_fts_sync (id, deferred) VALUES (1, 0)",
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_ai AFTER INSERT ON shopapp_product
+    WHEN (SELECT deferred FROM shopapp_product_fts_sync WHERE id = 1) = 0
+    BEGIN
+        INSERT INTO shopapp_product_fts(rowid, name, description, archived)
+        VALUES (new.id, new.name, new.description, new.archived);
+    END
+    """,
+]
+
+RESTORE_INSERT_TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_ai",
+    "DROP TABLE IF EXISTS shopapp_product_fts_sync",
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_ai AFTER INSERT ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(rowid, name, description, archived)
+        VALUES (new.id, new.name, new.description, new.archived);
+    END
+    """,
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        with schema_editor.connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0016_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(RECREATE_INSERT_TRIGGER_SQL), run_sqlite(RESTORE_INSERT_TRIGGER_SQL)),
+    ]
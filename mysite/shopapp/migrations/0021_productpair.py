@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from shopapp.recommendations import build_product_pairs
+
+
+def backfill_product_pairs(apps, schema_editor):
+    build_product_pairs(apps=apps, using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0020_dailysales_promocodedailysales_productdailysales_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shopapp.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shopapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-count'], name='shopapp_productpair_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related'), name='shopapp_productpair_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_product_pairs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:39
+
+import shopapp.models
+import shopapp.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0021_productpair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='receipt',
+            field=models.FileField(null=True, storage=shopapp.storage.blob_storage, upload_to='orders/receipts/'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='preview',
+            field=models.ImageField(blank=True, null=True, storage=shopapp.storage.blob_storage, upload_to=shopapp.models.product_preview_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=shopapp.storage.blob_storage, upload_to=shopapp.models.product_image_directory_path),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0022_mediablob_alter_order_receipt_alter_product_preview_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('products_import', 'Products import'), ('orders_import', 'Orders import'), ('products_export', 'Products export'), ('avatar_process', 'Avatar processing')], max_length=32),
+        ),
+    ]
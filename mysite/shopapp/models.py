@@ -1,8 +1,12 @@
+from decimal import ROUND_HALF_UP, Decimal
+
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.urls import reverse
 
+from .storage import blob_storage
+
 
 def product_preview_directory_path(instance: "Product", filename: str) -> str:
     return f"products/product_{instance.pk}/preview/{filename}"
@@ -11,12 +15,25 @@ def product_image_directory_path(instance: "ProductImage", filename: str) -> str
     return f"products/product_{instance.product.pk}/images/{filename}"
 
 
+def discounted_price(price, discount) -> Decimal:
+    """
+    Цена со скидкой в процентах, округлённая до копеек, как она входит в Order.discounted_total.
+    """
+    price = Decimal(price)
+    return (price * (100 - discount) / 100).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
 class Product(models.Model):
     class Meta:
         ordering = ["name", "price"]
+        indexes = [
+            # Ключ keyset пагинации API (ProductCursorPagination)
+            models.Index(fields=["name", "price", "id"], name="shopapp_product_keyset_idx"),
+        ]
 
     name = models.CharField(max_length=100, db_index=True)
-    description = models.TextField(null=False, blank=True, db_index=True)
+    # Поиск по description идёт через FTS5 индекс (shopapp.search), B-tree индекс не нужен
+    description = models.TextField(null=False, blank=True)
     price = models.DecimalField(
         default=0,
         max_digits=8,
@@ -34,11 +51,15 @@ class Product(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.PROTECT)
     created_at = models.DateTimeField(auto_now_add=True)
     archived = models.BooleanField(default=False)
-    preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
+    preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path, storage=blob_storage)
 
     def get_absolute_url(self):
         return reverse("shopapp:product_details", kwargs={"pk": self.pk})
 
+    @property
+    def discounted_price(self) -> Decimal:
+        return discounted_price(self.price, self.discount)
+
 
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
@@ -46,14 +67,167 @@ class Product(models.Model):
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
-    image = models.ImageField(upload_to=product_image_directory_path)
+    image = models.ImageField(upload_to=product_image_directory_path, storage=blob_storage)
     description = models.CharField(max_length=200, null=False, blank=True)
 
 
 class Order(models.Model):
+    class Meta:
+        indexes = [
+            # Ключ keyset пагинации API (OrderCursorPagination)
+            models.Index(fields=["created_at", "id"], name="shopapp_order_keyset_idx"),
+            # Сортировка и фильтрация по сумме заказа без join с товарами
+            models.Index(fields=["total_price", "id"], name="shopapp_order_total_idx"),
+        ]
+
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
-    receipt = models.FileField(null=True, upload_to="orders/receipts/")
+    receipt = models.FileField(null=True, upload_to="orders/receipts/", storage=blob_storage)
+
+    # Материализованные итоги по products, поддерживаются shopapp.totals
+    total_price = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    discounted_total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+
+    TOTALS_FIELDS = ("total_price", "discounted_total", "products_count")
+
+    def save(self, *args, **kwargs):
+        # Итоги меняются только UPDATE с F() из shopapp.totals, и save() уже существующего
+        # заказа не должен затирать их значениями, прочитанными до изменения products.
+        # Как и save(update_fields=...), save() заказа, удалённого тем временем, выбрасывает
+        # DatabaseError, а не вставляет его заново с итогами удалённых товаров
+        if not self._state.adding and not kwargs.get("force_insert") and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.TOTALS_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class ProductPair(models.Model):
+    """
+    Сколько заказов содержат оба товара ("часто покупают вместе").
+
+    Каждая пара хранится в обе стороны, чтобы топ для товара читался одним запросом по индексу.
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "related"], name="shopapp_productpair_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "-count"], name="shopapp_productpair_top_idx"),
+        ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    count = models.IntegerField(default=0)
+
+
+class MediaBlob(models.Model):
+    """
+    Файл ContentAddressedStorage и число ссылок на него из полей моделей (см. shopapp.media).
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"MediaBlob(name={self.name!r}, references={self.references})"
+
+
+class BackgroundJob(models.Model):
+    """
+    Фоновая задача (импорт/экспорт CSV, обработка аватара), которую выполняет команда runworker.
+    """
+
+    class Kind(models.TextChoices):
+        PRODUCTS_IMPORT = "products_import", "Products import"
+        ORDERS_IMPORT = "orders_import", "Orders import"
+        PRODUCTS_EXPORT = "products_export", "Products export"
+        AVATAR_PROCESS = "avatar_process", "Avatar processing"
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    class Meta:
+        indexes = [
+            # Очередь: самые старые задачи в статусе pending
+            models.Index(fields=["status", "created_at"], name="shopapp_job_queue_idx"),
+        ]
+
+    kind = models.CharField(max_length=32, choices=Kind.choices)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    params = models.JSONField(default=dict, blank=True)
+    source_file = models.FileField(null=True, blank=True, upload_to="jobs/sources/")
+    result_file = models.FileField(null=True, blank=True, upload_to="jobs/results/")
+    rows_processed = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict, blank=True)
+    errors = models.JSONField(default=list, blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"BackgroundJob(pk={self.pk}, kind={str(self.kind)!r}, status={str(self.status)!r})"
+
+
+class SalesRollup(models.Model):
+    """
+    Дневные итоги продаж, которые shopapp.reports увеличивает на разницу при изменении заказов.
+
+    revenue - сумма со скидками (Order.discounted_total), gross_revenue - без скидок.
+    """
+
+    class Meta:
+        abstract = True
+
+    day = models.DateField()
+    orders_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    gross_revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day"], name="shopapp_dailysales_day_uniq"),
+        ]
+
+
+class ProductDailySales(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "product"], name="shopapp_productdailysales_uniq"),
+        ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+
+
+class UserDailySales(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "user"], name="shopapp_userdailysales_uniq"),
+        ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+
+
+class PromocodeDailySales(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "promocode"], name="shopapp_promocodedailysales_uniq"),
+        ]
+
+    promocode = models.CharField(max_length=20, blank=True)
@@ -0,0 +1,227 @@
+"""
+Пагинация для API магазина.
+
+Keyset (cursor) пагинация: курсор хранит значения всех полей сортировки
+последней (или первой) записи страницы, и следующая страница выбирается условием
+по этим значениям, а не через OFFSET. Поэтому глубокие страницы стоят столько же,
+сколько первая, и COUNT(*) не выполняется вовсе.
+"""
+
+import datetime
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from decimal import Decimal
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor пагинация по составному ключу сортировки.
+
+    CursorPagination из DRF кладёт в курсор только значение первого поля сортировки
+    и смещение внутри группы одинаковых значений, что на неуникальных полях
+    (name, price) снова превращается в OFFSET. Здесь курсор содержит значения всех
+    полей, а к сортировке всегда добавляется pk, чтобы ключ был уникальным.
+    Сортировка берётся из OrderingFilter, если он подключён к представлению.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = ("pk",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        queryset, values = self.get_page_queryset(queryset, request, view)
+        return self.set_page(list(queryset), values)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() для асинхронных представлений: страница читается через async ORM.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        queryset, values = self.get_page_queryset(queryset, request, view)
+        return self.set_page([instance async for instance in queryset], values)
+
+    def get_page_queryset(self, queryset, request, view):
+        """
+        Запрос страницы (с одной лишней записью для has_more) и значения курсора.
+        """
+        self.base_url = request.build_absolute_uri()
+        self.keys = self.get_keys(request, queryset, view)
+        values, self.reverse = self.decode_keyset_cursor(request)
+
+        queryset = queryset.order_by(*self.get_order_expressions(reverse=self.reverse))
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(values, reverse=self.reverse))
+
+        return queryset[:self.page_size + 1], values
+
+    def set_page(self, results, values):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = values is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = values is not None
+
+        self.display_page_controls = self.template is not None and (self.has_next or self.has_previous)
+        return self.page
+
+    def get_keys(self, request, queryset, view):
+        """
+        Список ключей сортировки: (attname, descending, nullable).
+        """
+        opts = queryset.model._meta
+        keys = []
+
+        for field_name in self.get_ordering(request, queryset, view):
+            descending = field_name.startswith("-")
+            name = field_name.lstrip("-")
+
+            if name == "pk" or name in queryset.query.annotations:
+                keys.append((name, descending, False))
+                continue
+
+            field = opts.get_field(name)
+            keys.append((field.attname, descending, field.null))
+
+        if not any(attname in ("pk", opts.pk.attname) for attname, _, _ in keys):
+            keys.append(("pk", False, False))
+
+        return keys
+
+    def get_order_expressions(self, reverse):
+        expressions = []
+
+        for attname, descending, nullable in self.keys:
+            if descending != reverse:
+                expression = F(attname).desc(nulls_last=True) if nullable else F(attname).desc()
+            else:
+                expression = F(attname).asc(nulls_first=True) if nullable else F(attname).asc()
+            expressions.append(expression)
+
+        return expressions
+
+    def get_keyset_filter(self, values, reverse):
+        """
+        Условие "строго после курсора" в порядке обхода.
+
+        (a, b, pk) > (x, y, z) раскрывается в
+        a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z).
+        NULL считается меньше любого значения, как и в get_order_expressions.
+        """
+        if len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = Q()
+
+        for (attname, descending, nullable), value in zip(self.keys, values):
+            after = self._after(attname, value, descending != reverse, nullable)
+            if after is not None:
+                condition |= equal & after
+
+            if value is None:
+                equal &= Q(**{f"{attname}__isnull": True})
+            else:
+                equal &= Q(**{attname: value})
+
+        # Избыточное ограничение по первому полю даёт планировщику range scan по индексу
+        attname, descending, nullable = self.keys[0]
+        if values[0] is not None and not nullable:
+            lookup = "lte" if descending != reverse else "gte"
+            condition &= Q(**{f"{attname}__{lookup}": values[0]})
+
+        return condition
+
+    @staticmethod
+    def _after(attname, value, descending, nullable):
+        if descending:
+            if value is None:
+                return None
+            after = Q(**{f"{attname}__lt": value})
+            if nullable:
+                after |= Q(**{f"{attname}__isnull": True})
+            return after
+
+        if value is None:
+            return Q(**{f"{attname}__isnull": False})
+        return Q(**{f"{attname}__gt": value})
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_keyset_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_keyset_cursor(self.page[0], reverse=True)
+
+    def encode_keyset_cursor(self, instance, reverse):
+        payload = {"v": [getattr(instance, attname) for attname, _, _ in self.keys]}
+        if reverse:
+            payload["r"] = 1
+
+        encoded = b64encode(json.dumps(payload, default=self._json_default).encode("utf-8")).decode("ascii")
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def _json_default(value):
+        # DjangoJSONEncoder обрезает datetime до миллисекунд, а курсору нужно точное значение
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError(f"Unsupported cursor value: {value!r}")
+
+    def decode_keyset_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            payload = json.loads(b64decode(encoded.encode("ascii")).decode("utf-8"))
+            values = payload["v"]
+            reverse = bool(payload.get("r"))
+        except (TypeError, ValueError, KeyError, UnicodeError, BinasciiError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list):
+            raise NotFound(self.invalid_cursor_message)
+
+        return values, reverse
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    # Совпадает с Product.Meta.ordering, pk добавляется автоматически
+    ordering = ("name", "price")
+
+    def get_ordering(self, request, queryset, view):
+        # При полнотекстовом поиске без явного ?ordering= отдаём результаты по релевантности
+        if "search_rank" in queryset.query.annotations and not request.query_params.get("ordering"):
+            return ("search_rank",)
+        return super().get_ordering(request, queryset, view)
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    ordering = ("-created_at", "-pk")
@@ -0,0 +1,134 @@
+"""
+"Часто покупают вместе": индекс совместных покупок товаров.
+
+Считать рекомендации на лету - это self-join промежуточной таблицы Order.products
+на каждый запрос. Вместо этого в ProductPair хранится, сколько заказов содержат
+оба товара. Полный индекс строится одним INSERT ... SELECT с self-join (команда
+build_product_pairs), а дальше поддерживается на разницу при изменении
+Order.products (сигналы в shopapp.signals). Топ для товара кешируется до изменения
+его пар или товаров, так что страница товара делает не больше одного запроса по индексу.
+"""
+
+from collections import Counter, defaultdict
+
+from django.apps import apps as django_apps
+from django.db import connections, transaction
+
+from .caching import PRODUCTS, bump_generation, cached_compute, related_products_namespace, versioned_key
+from .models import Order, ProductPair
+
+RELATED_PRODUCTS_LIMIT = 5
+
+
+def build_product_pairs(apps=django_apps, using: str = "default") -> int:
+    """
+    Перестраивает ProductPair целиком. Возвращает число записанных пар (в обе стороны).
+    """
+    pair_model = apps.get_model("shopapp", "ProductPair")
+    through = apps.get_model("shopapp", "Order").products.through
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+
+    pairs_table = quote_name(pair_model._meta.db_table)
+    through_table = quote_name(through._meta.db_table)
+    order_column = quote_name(through._meta.get_field("order").column)
+    product_column = quote_name(through._meta.get_field("product").column)
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {pairs_table}")
+        cursor.execute(
+            f"INSERT INTO {pairs_table} (product_id, related_id, {quote_name('count')}) "
+            f"SELECT a.{product_column}, b.{product_column}, COUNT(*) "
+            f"FROM {through_table} a JOIN {through_table} b "
+            f"ON a.{order_column} = b.{order_column} AND a.{product_column} <> b.{product_column} "
+            f"GROUP BY a.{product_column}, b.{product_column}"
+        )
+        return cursor.rowcount
+
+
+def apply_pair_changes(changes: dict, sign: int, current: dict = None, using: str = "default") -> set:
+    """
+    Учитывает добавление (sign=1) или удаление (sign=-1) товаров из заказов.
+
+    changes - {order_id: изменённые product_id}, current - {order_id: товары заказа
+    на момент вызова}; если не передан, читается одним запросом. Изменённый товар
+    образует пары с остальными товарами заказа и с другими изменёнными.
+    Возвращает pk товаров, у которых поменялись пары.
+    """
+    if current is None:
+        current = defaultdict(set)
+        rows = (
+            Order.products.through.objects.using(using)
+            .filter(order_id__in=list(changes))
+            .values_list("order_id", "product_id")
+        )
+        for order_id, product_id in rows:
+            current[order_id].add(product_id)
+
+    counts = Counter()
+    for order_id, changed in changes.items():
+        others = set(current.get(order_id, ())) - set(changed)
+        for product_id in changed:
+            for other_id in others:
+                counts[(product_id, other_id)] += sign
+                counts[(other_id, product_id)] += sign
+            for other_id in changed:
+                if other_id != product_id:
+                    counts[(product_id, other_id)] += sign
+
+    counts = {pair: delta for pair, delta in counts.items() if delta}
+    if not counts:
+        return set()
+
+    save_pair_counts(counts, using=using)
+    affected = {product_id for product_id, _ in counts}
+    bump_generation(*(related_products_namespace(product_id) for product_id in affected))
+    return affected
+
+
+def save_pair_counts(counts: dict, using: str = "default"):
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    table = quote_name(ProductPair._meta.db_table)
+    count = quote_name("count")
+
+    with transaction.atomic(using=using):
+        ProductPair.objects.using(using).bulk_create(
+            [ProductPair(product_id=product_id, related_id=related_id) for product_id, related_id in counts],
+            ignore_conflicts=True,
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {table} SET {count} = {count} + %s WHERE product_id = %s AND related_id = %s",
+                [(delta, product_id, related_id) for (product_id, related_id), delta in counts.items()],
+            )
+        # Обнулиться пары могут только при удалении товаров из заказов
+        if any(delta < 0 for delta in counts.values()):
+            ProductPair.objects.using(using).filter(
+                product_id__in={product_id for product_id, _ in counts},
+                count__lte=0,
+            ).delete()
+
+
+def related_products(product_id: int, limit: int = RELATED_PRODUCTS_LIMIT) -> list[dict]:
+    """
+    Топ товаров, которые чаще всего заказывают вместе с product_id (без архивных).
+    """
+    cache_key = versioned_key(
+        f"related_products:{product_id}:{limit}",
+        PRODUCTS,
+        related_products_namespace(product_id),
+    )
+    return cached_compute(
+        cache_key,
+        lambda: [
+            {"pk": pk, "name": name, "price": price, "count": count}
+            for pk, name, price, count in (
+                ProductPair.objects
+                .filter(product_id=product_id, related__archived=False)
+                .order_by("-count", "related_id")
+                .values_list("related_id", "related__name", "related__price", "count")[:limit]
+            )
+        ],
+        name="related_products",
+    )
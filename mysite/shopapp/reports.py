@@ -0,0 +1,198 @@
+"""
+Дневные итоги продаж (rollup) для отчётов.
+
+Отчёты за период раньше требовали агрегировать все строки Order.products за этот
+период. Теперь итоги по дням хранятся в четырёх таблицах: общие (DailySales),
+по товару, по пользователю и по промокоду. Каждое изменение заказа превращается
+в набор разниц (SalesDeltas), которые применяются без чтения: сначала
+INSERT OR IGNORE нулевых строк для новых ключей, потом один executemany с
+"count = count + %s" на таблицу. Обработчики сигналов — в shopapp.signals,
+полный пересчёт — команда rebuild_sales_rollups.
+
+Вклад одной связи заказ-товар: units +1, revenue + цена со скидкой,
+gross_revenue + цена. Вклад самого заказа: orders_count +1 во всех таблицах,
+кроме таблицы по товарам, где orders_count считает заказы с этим товаром.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Order, Product, discounted_price
+
+REBUILD_BATCH_SIZE = 1000
+
+# Модель -> поле ключа (кроме day)
+ROLLUPS = (
+    ("DailySales", None),
+    ("ProductDailySales", "product"),
+    ("UserDailySales", "user"),
+    ("PromocodeDailySales", "promocode"),
+)
+
+
+def order_day(created_at):
+    return timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+
+
+class SalesDeltas:
+    """
+    Накопитель разниц: {(модель, ключ): [orders_count, units, revenue, gross_revenue]}.
+    """
+
+    def __init__(self):
+        self.deltas = {name: defaultdict(lambda: [0, 0, Decimal(0), Decimal(0)]) for name, _ in ROLLUPS}
+
+    def add_order(self, day, user_id, promocode, sign=1):
+        for name, key in (("DailySales", day), ("UserDailySales", (day, user_id)),
+                          ("PromocodeDailySales", (day, promocode))):
+            self.deltas[name][key][0] += sign
+
+    def add_line(self, day, user_id, promocode, product_id, price, discount, sign=1):
+        gross = Decimal(price) * sign
+        revenue = discounted_price(price, discount) * sign
+
+        # Товар встречается в заказе один раз, поэтому связь — это и заказ с этим товаром
+        self.deltas["ProductDailySales"][(day, product_id)][0] += sign
+
+        for name, key in (("DailySales", day), ("ProductDailySales", (day, product_id)),
+                          ("UserDailySales", (day, user_id)), ("PromocodeDailySales", (day, promocode))):
+            values = self.deltas[name][key]
+            values[1] += sign
+            values[2] += revenue
+            values[3] += gross
+
+    def save(self, using="default", apps=django_apps):
+        with transaction.atomic(using=using):
+            for name, key_field in ROLLUPS:
+                rows = {key: values for key, values in self.deltas[name].items() if any(values)}
+                if rows:
+                    self._save_model(apps.get_model("shopapp", name), key_field, rows, using)
+
+    @staticmethod
+    def _save_model(model, key_field, rows, using):
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        key_attname = key_field and model._meta.get_field(key_field).attname
+
+        def key_values(key):
+            return {"day": key} if key_field is None else {"day": key[0], key_attname: key[1]}
+
+        # Нулевые строки для ключей, которых ещё нет; уже существующие не трогаются
+        model.objects.using(using).bulk_create(
+            [model(**key_values(key)) for key in rows],
+            ignore_conflicts=True,
+        )
+
+        key_columns = ["day"] if key_field is None else ["day", model._meta.get_field(key_field).column]
+        metrics = ("orders_count", "units", "revenue", "gross_revenue")
+        sql = (
+            f"UPDATE {quote_name(model._meta.db_table)} SET "
+            + ", ".join(f"{quote_name(name)} = {quote_name(name)} + %s" for name in metrics)
+            + " WHERE "
+            + " AND ".join(f"{quote_name(column)} = %s" for column in key_columns)
+        )
+        day_field = model._meta.get_field("day")
+
+        params = []
+        for key, values in rows.items():
+            key_params = list(key_values(key).values())
+            key_params[0] = day_field.get_db_prep_value(key_params[0], connection)
+            params.append(values + key_params)
+
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+
+def link_deltas(links, sign=1, orders=None, products=None, deltas=None, using="default") -> SalesDeltas:
+    """
+    Разницы для связей (order_id, product_id), добавленные в deltas или в новый SalesDeltas.
+
+    orders и products позволяют подставить прежние значения ({pk: (day, user_id, promocode)}
+    и {pk: (price, discount)}), если в базе они уже изменились.
+    """
+    if deltas is None:
+        deltas = SalesDeltas()
+    links = list(links)
+    if not links:
+        return deltas
+
+    orders = dict(orders or {})
+    missing_orders = {order_id for order_id, _ in links} - orders.keys()
+    if missing_orders:
+        for pk, created_at, user_id, promocode in (
+            Order.objects.using(using).filter(pk__in=missing_orders)
+            .values_list("pk", "created_at", "user_id", "promocode")
+        ):
+            orders[pk] = (order_day(created_at), user_id, promocode)
+
+    products = dict(products or {})
+    missing_products = {product_id for _, product_id in links} - products.keys()
+    if missing_products:
+        for pk, price, discount in (
+            Product.objects.using(using).filter(pk__in=missing_products).values_list("pk", "price", "discount")
+        ):
+            products[pk] = (price, discount)
+
+    for order_id, product_id in links:
+        if order_id in orders and product_id in products:
+            deltas.add_line(*orders[order_id], product_id, *products[product_id], sign=sign)
+    return deltas
+
+
+def order_links(order_ids=None, product_id=None, using="default"):
+    links = Order.products.through.objects.using(using)
+    if order_ids is not None:
+        links = links.filter(order_id__in=order_ids)
+    if product_id is not None:
+        links = links.filter(product_id=product_id)
+    return list(links.values_list("order_id", "product_id"))
+
+
+def order_identity(order):
+    return order_day(order.created_at), order.user_id, order.promocode
+
+
+def rebuild_sales_rollups(apps=django_apps, using="default", batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """
+    Пересчитывает все таблицы итогов по заказам. Возвращает число обработанных заказов.
+    """
+    HistoricalOrder = apps.get_model("shopapp", "Order")
+    through = HistoricalOrder.products.through
+    processed = 0
+    last_pk = 0
+
+    with transaction.atomic(using=using):
+        for name, _ in ROLLUPS:
+            apps.get_model("shopapp", name).objects.using(using).all().delete()
+
+        while True:
+            batch = list(
+                HistoricalOrder.objects.using(using)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "created_at", "user_id", "promocode")[:batch_size]
+            )
+            if not batch:
+                return processed
+
+            deltas = SalesDeltas()
+            identities = {}
+            for pk, created_at, user_id, promocode in batch:
+                identities[pk] = (order_day(created_at), user_id, promocode)
+                deltas.add_order(*identities[pk])
+
+            rows = (
+                through.objects.using(using)
+                .filter(order_id__in=identities)
+                .values_list("order_id", "product_id", "product__price", "product__discount")
+            )
+            for order_id, product_id, price, discount in rows:
+                deltas.add_line(*identities[order_id], product_id, price, discount)
+
+            deltas.save(using=using, apps=apps)
+            processed += len(batch)
+            last_pk = batch[-1][0]
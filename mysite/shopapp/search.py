@@ -0,0 +1,237 @@
+"""
+Полнотекстовый поиск по товарам.
+
+На SQLite поиск идёт через виртуальную таблицу FTS5 shopapp_product_fts, которая
+зеркалирует name/description/archived таблицы shopapp_product (external content)
+и синхронизируется триггерами на insert, update и delete. Триггеры срабатывают
+и для bulk_create, и для QuerySet.update(), поэтому отдельная синхронизация
+из Python не нужна. На остальных СУБД используется обычный SearchFilter.
+"""
+
+import logging
+from contextlib import contextmanager
+
+from django.db import DatabaseError, connections
+from django.db.models import Case, IntegerField, QuerySet, Value, When
+from django.db.models.expressions import RawSQL
+
+log = logging.getLogger(__name__)
+
+FTS_TABLE = "shopapp_product_fts"
+
+# Сколько лучших по bm25 товаров отдаёт ранжированный поиск API на один запрос;
+# поиск без ранжирования (админка, выгрузки) не ограничен
+SEARCH_MAX_RESULTS = 1000
+
+# Веса bm25 для колонок name, description, archived
+SEARCH_WEIGHTS = (10.0, 1.0, 0.0)
+
+CREATE_SEARCH_INDEX_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name,
+        description,
+        archived UNINDEXED,
+        content='shopapp_product',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    # Флаг для массовых вставок, см. deferred_search_index()
+    f"""
+    CREATE TABLE IF NOT EXISTS {FTS_TABLE}_sync (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        deferred INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    f"INSERT OR IGNORE INTO {FTS_TABLE}_sync (id, deferred) VALUES (1, 0)",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shopapp_product
+    WHEN (SELECT deferred FROM {FTS_TABLE}_sync WHERE id = 1) = 0
+    BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, archived)
+        VALUES (new.id, new.name, new.description, new.archived);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shopapp_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, archived)
+        VALUES ('delete', old.id, old.name, old.description, old.archived);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF name, description, archived ON shopapp_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, archived)
+        VALUES ('delete', old.id, old.name, old.description, old.archived);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, archived)
+        VALUES (new.id, new.name, new.description, new.archived);
+    END
+    """,
+]
+
+DROP_SEARCH_INDEX_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}_sync",
+]
+
+
+def search_index_available(using: str = "default") -> bool:
+    return connections[using].vendor == "sqlite"
+
+
+def create_search_index(connection, rebuild: bool = False) -> None:
+    """
+    Создаёт FTS таблицу и триггеры, если их нет.
+
+    SQLite пересоздаёт shopapp_product при многих AlterField/AddField и теряет
+    триггеры, поэтому функция вызывается и из миграции, и после каждого migrate.
+    """
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for sql in CREATE_SEARCH_INDEX_SQL:
+            cursor.execute(sql)
+        if rebuild:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(connection) -> None:
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for sql in DROP_SEARCH_INDEX_SQL:
+            cursor.execute(sql)
+
+
+@contextmanager
+def deferred_search_index(using: str = "default"):
+    """
+    Откладывает индексацию вставленных товаров до конца блока.
+
+    Триггер на каждую строку обходится импорту CSV в несколько раз дороже самой вставки,
+    поэтому на время блока он выключается флагом, а новые строки добавляются в индекс
+    одним INSERT ... SELECT. Флаг ставится и снимается в одной транзакции, и другие
+    соединения его не видят. Блок должен выполняться внутри transaction.atomic().
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        yield
+        return
+
+    assert connection.in_atomic_block, "deferred_search_index() requires transaction.atomic()"
+
+    with connection.cursor() as cursor:
+        # Сначала запись: она берёт блокировку на запись, и MAX(id) ниже уже не изменится извне
+        cursor.execute(f"UPDATE {FTS_TABLE}_sync SET deferred = 1 WHERE id = 1")
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM shopapp_product")
+        last_id = cursor.fetchone()[0]
+
+    try:
+        yield
+    finally:
+        # Если ошибку перехватили внутри транзакции, флаг всё равно нужно снять, иначе
+        # следующие вставки не попадут в индекс. Транзакцию, которая будет откачена
+        # целиком, трогать нельзя: откат вернёт и флаг
+        if not connection.needs_rollback:
+            with connection.cursor() as cursor:
+                cursor.execute(f"UPDATE {FTS_TABLE}_sync SET deferred = 0 WHERE id = 1")
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}(rowid, name, description, archived) "
+                    f"SELECT id, name, description, archived FROM shopapp_product WHERE id > %s",
+                    [last_id],
+                )
+
+
+def ensure_search_index(using: str = "default", **kwargs) -> None:
+    """
+    Обработчик post_migrate: восстанавливает триггеры после пересоздания таблицы.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite" or "shopapp_product" not in connection.introspection.table_names():
+        return
+    create_search_index(connection)
+
+
+def build_match_query(search_terms) -> str:
+    """
+    Каждый термин превращается в префиксный запрос "term"*, термины объединяются через AND.
+    Кавычки экранируются, поэтому синтаксис FTS5 из пользовательского ввода не исполняется.
+    """
+    phrases = []
+    for term in search_terms:
+        term = term.strip()
+        if term:
+            phrases.append('"{}"*'.format(term.replace('"', '""')))
+    return " ".join(phrases)
+
+
+def search_product_ids(
+    search_terms,
+    using: str = "default",
+    limit: int = SEARCH_MAX_RESULTS,
+    include_archived: bool = True,
+) -> list[int]:
+    """
+    Возвращает pk товаров, отсортированные по релевантности (bm25).
+    """
+    match_query = build_match_query(search_terms)
+    if not match_query:
+        return []
+
+    archived_filter = "" if include_archived else "AND archived = 0"
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    sql = (
+        f"SELECT rowid FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s {archived_filter} "
+        f"ORDER BY bm25({FTS_TABLE}, {weights}) "
+        f"LIMIT %s"
+    )
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [match_query, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(queryset: QuerySet, search_terms, ranked: bool = True) -> QuerySet | None:
+    """
+    Фильтрует queryset по полнотекстовому индексу.
+
+    При ranked=True индекс читается отдельным запросом, в выдачу попадают лучшие
+    SEARCH_MAX_RESULTS товаров с аннотацией search_rank (позиция по bm25), и queryset
+    сортируется по ней. При ranked=False индекс - подзапрос фильтра, и в выдачу
+    попадают все совпадения.
+    Если индекс недоступен, возвращает None, и вызывающий код должен откатиться на LIKE.
+    """
+    if not search_index_available(queryset.db):
+        return None
+
+    if not ranked:
+        match_query = build_match_query(search_terms)
+        if not match_query:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match_query]),
+        )
+
+    try:
+        product_ids = search_product_ids(search_terms, using=queryset.db, limit=SEARCH_MAX_RESULTS)
+    except DatabaseError:
+        log.exception("Full-text search failed, falling back to LIKE search")
+        return None
+
+    queryset = queryset.filter(pk__in=product_ids)
+    if not product_ids:
+        return queryset
+
+    search_rank = Case(
+        *[When(pk=pk, then=Value(position)) for position, pk in enumerate(product_ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.annotate(search_rank=search_rank).order_by("search_rank")
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Order, Product
+from .models import BackgroundJob, Order, Product
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -19,6 +19,13 @@ class ProductSerializer(serializers.ModelSerializer):
         )
 
 
+class RelatedProductSerializer(serializers.Serializer):
+    pk = serializers.IntegerField()
+    name = serializers.CharField()
+    price = serializers.DecimalField(max_digits=8, decimal_places=2)
+    count = serializers.IntegerField(help_text="Orders containing both products")
+
+
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
@@ -30,4 +37,70 @@ class OrderSerializer(serializers.ModelSerializer):
             "user",
             "products",
             "receipt",
+            "total_price",
+            "discounted_total",
+            "products_count",
+        )
+        read_only_fields = ("total_price", "discounted_total", "products_count")
+
+
+class BackgroundJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BackgroundJob
+        fields = (
+            "pk",
+            "kind",
+            "status",
+            "rows_processed",
+            "result",
+            "errors",
+            "result_file",
+            "created_at",
+            "started_at",
+            "finished_at",
         )
+        read_only_fields = fields
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    """
+    Параметры отчётов по продажам: период (включительно), размер и сортировка топа.
+    """
+
+    METRICS = ("revenue", "gross_revenue", "units", "orders_count")
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    ordering = serializers.ChoiceField(choices=METRICS, default="revenue")
+
+    def validate(self, attrs):
+        date_from, date_to = attrs.get("date_from"), attrs.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError({"date_to": "date_to must not be earlier than date_from."})
+        return attrs
+
+
+class SalesMetricsSerializer(serializers.Serializer):
+    orders_count = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    gross_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class DailySalesSerializer(SalesMetricsSerializer):
+    day = serializers.DateField()
+
+
+class ProductSalesSerializer(SalesMetricsSerializer):
+    product = serializers.IntegerField(source="product_id")
+    name = serializers.CharField(source="product__name")
+
+
+class UserSalesSerializer(SalesMetricsSerializer):
+    user = serializers.IntegerField(source="user_id")
+    username = serializers.CharField(source="user__username")
+
+
+class PromocodeSalesSerializer(SalesMetricsSerializer):
+    promocode = serializers.CharField()
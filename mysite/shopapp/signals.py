@@ -0,0 +1,260 @@
+"""
+Обработчики сигналов моделей магазина: инвалидация версионированного кеша
+и поддержка итогов заказа (shopapp.totals), дневных итогов продаж (shopapp.reports)
+индекса совместных покупок (shopapp.recommendations) и ссылок на файлы (shopapp.media).
+"""
+
+from collections import defaultdict
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import media, recommendations, reports, totals
+from .caching import (
+    ORDERS,
+    PRODUCTS,
+    bump_generation,
+    order_card_namespace,
+    product_card_namespace,
+    user_orders_namespace,
+)
+from .models import Order, Product
+
+
+def product_order_card_namespaces(product_id) -> list[str]:
+    order_ids = Order.products.through.objects.filter(product_id=product_id).values_list("order_id", flat=True)
+    return [order_card_namespace(order_id) for order_id in order_ids]
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_products(sender, instance: Product, **kwargs):
+    bump_generation(PRODUCTS, product_card_namespace(instance.pk))
+
+
+@receiver(post_save, sender=Product)
+def invalidate_order_cards_on_product_rename(sender, instance: Product, **kwargs):
+    # Название товара есть в карточках его заказов; цену обрабатывает update_order_aggregates_on_price_change
+    saved_name = instance.__dict__.pop("_saved_name", None)
+    if saved_name is not None and saved_name != instance.name:
+        bump_generation(*product_order_card_namespaces(instance.pk))
+
+
+@receiver(pre_delete, sender=Product)
+def invalidate_orders_on_product_delete(sender, instance: Product, **kwargs):
+    # Удаление товара удаляет строки Order.products без m2m_changed, поэтому заказы ищутся до него
+    bump_generation(ORDERS, *product_order_card_namespaces(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_user_orders(sender, instance: Order, **kwargs):
+    bump_generation(user_orders_namespace(instance.user_id), order_card_namespace(instance.pk))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def invalidate_user_orders_on_products_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # После product.orders.clear() затронутые заказы уже не узнать
+        instance._cleared_order_ids = list(
+            sender.objects.filter(product_id=instance.pk).values_list("order_id", flat=True)
+        )
+        return
+    if not action.startswith("post_"):
+        return
+
+    if not reverse:
+        bump_generation(user_orders_namespace(instance.user_id), order_card_namespace(instance.pk))
+        return
+
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_order_ids", [])
+    user_ids = set(Order.objects.filter(pk__in=pk_set).values_list("user_id", flat=True))
+    bump_generation(
+        *(user_orders_namespace(user_id) for user_id in user_ids),
+        *(order_card_namespace(order_id) for order_id in pk_set),
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_orders_on_user_change(sender, instance: User, created: bool, update_fields=None, **kwargs):
+    # В выгрузке заказов пользователя есть его username; вход в систему обновляет только last_login
+    if not created and update_fields != frozenset({"last_login"}):
+        # Имя пользователя есть и в карточках его заказов
+        order_ids = Order.objects.filter(user_id=instance.pk).values_list("pk", flat=True)
+        bump_generation(user_orders_namespace(instance.pk), *map(order_card_namespace, order_ids))
+
+
+# *** Итоги заказа, дневные итоги продаж и совместные покупки ***
+
+@receiver(m2m_changed, sender=Order.products.through)
+def update_order_aggregates(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("pre_remove", "pre_clear"):
+        # remove() передаёт в pk_set и отсутствующие связи, а после clear() их уже не узнать,
+        # поэтому реально удаляемые связи запоминаются до изменения
+        if reverse:
+            links = sender.objects.filter(product_id=instance.pk)
+            if pk_set is not None:
+                links = links.filter(order_id__in=pk_set)
+        else:
+            links = sender.objects.filter(order_id=instance.pk)
+            if pk_set is not None:
+                links = links.filter(product_id__in=pk_set)
+        instance._removed_links = list(links.values_list("order_id", "product_id"))
+        return
+
+    if action == "post_add":
+        sign = 1
+        links = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    elif action in ("post_remove", "post_clear"):
+        sign = -1
+        links = instance.__dict__.pop("_removed_links", [])
+    else:
+        return
+
+    if not links:
+        return
+
+    if reverse:
+        product_totals = totals.totals_for_products([instance])
+        totals.add_to_orders([order_id for order_id, _ in links], product_totals if sign > 0 else -product_totals)
+    elif sign > 0:
+        totals.products_added(instance.pk, [product_id for _, product_id in links])
+    else:
+        totals.products_removed(instance.pk, [product_id for _, product_id in links])
+
+    reports.link_deltas(links, sign).save()
+
+    changes = defaultdict(set)
+    for order_id, product_id in links:
+        changes[order_id].add(product_id)
+    recommendations.apply_pair_changes(changes, sign)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_identity(sender, instance: Order, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {"user", "promocode"} & set(update_fields):
+        return
+    saved = Order.objects.filter(pk=instance.pk).values_list("created_at", "user_id", "promocode").first()
+    if saved is not None:
+        created_at, user_id, promocode = saved
+        instance._saved_identity = (reports.order_day(created_at), user_id, promocode)
+
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups_on_order_save(sender, instance: Order, created: bool, raw=False, **kwargs):
+    identity = reports.order_identity(instance)
+
+    if created:
+        deltas = reports.SalesDeltas()
+        deltas.add_order(*identity)
+        deltas.save()
+        return
+
+    saved_identity = instance.__dict__.pop("_saved_identity", None)
+    if saved_identity is None or saved_identity == identity:
+        return
+
+    # Пользователь или промокод заказа изменился: его вклад переносится на новый ключ
+    links = reports.order_links([instance.pk])
+    deltas = reports.link_deltas(links, -1, orders={instance.pk: saved_identity})
+    reports.link_deltas(links, 1, orders={instance.pk: identity}, deltas=deltas)
+    deltas.add_order(*saved_identity, sign=-1)
+    deltas.add_order(*identity)
+    deltas.save()
+
+
+@receiver(pre_delete, sender=Order)
+def update_order_aggregates_on_order_delete(sender, instance: Order, **kwargs):
+    # Строки Order.products удаляются каскадом без m2m_changed
+    identity = reports.order_identity(instance)
+    links = reports.order_links([instance.pk])
+    deltas = reports.link_deltas(links, -1, orders={instance.pk: identity})
+    deltas.add_order(*identity, sign=-1)
+    deltas.save()
+
+    products = {instance.pk: {product_id for _, product_id in links}}
+    recommendations.apply_pair_changes(products, -1, current=products)
+
+
+@receiver(pre_save, sender=Product)
+def remember_saved_product(sender, instance: Product, raw=False, update_fields=None, **kwargs):
+    # Цена и скидка - для итогов заказов, название - для карточек заказов
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {"price", "discount", "name"} & set(update_fields):
+        return
+    saved = Product.objects.filter(pk=instance.pk).values_list("price", "discount", "name").first()
+    if saved is not None:
+        instance._saved_price = saved[:2]
+        instance._saved_name = saved[2]
+
+
+@receiver(post_save, sender=Product)
+def update_order_aggregates_on_price_change(sender, instance: Product, **kwargs):
+    saved_price = instance.__dict__.pop("_saved_price", None)
+    if saved_price is None:
+        return
+
+    old_price, old_discount = saved_price
+    if totals.product_price_changed(instance.pk, old_price, old_discount, instance.price, instance.discount):
+        links = reports.order_links(product_id=instance.pk)
+        deltas = reports.link_deltas(links, -1, products={instance.pk: saved_price})
+        reports.link_deltas(links, 1, deltas=deltas)
+        deltas.save()
+        # Цена товара и итоги есть в карточках его заказов
+        bump_generation(ORDERS, *product_order_card_namespaces(instance.pk))
+
+
+@receiver(pre_delete, sender=Product)
+def update_order_aggregates_on_product_delete(sender, instance: Product, **kwargs):
+    # Строки Order.products удаляются каскадом без m2m_changed
+    order_ids = Order.products.through.objects.filter(product_id=instance.pk).values("order_id")
+    totals.add_to_orders(order_ids, -totals.totals_for_products([instance]))
+    reports.link_deltas(reports.order_links(product_id=instance.pk), -1).save()
+
+
+# *** Ссылки на файлы ContentAddressedStorage ***
+
+def connect_blob_signals():
+    """
+    Подключает обработчики к моделям с файлами в ContentAddressedStorage (вызывается из AppConfig.ready).
+
+    Не к каждой модели: обработчик post_delete отключает быстрое каскадное удаление.
+    """
+    for model in apps.get_models():
+        if media.blob_fields(model):
+            pre_save.connect(remember_replaced_blobs, sender=model)
+            post_save.connect(count_uploaded_blobs, sender=model)
+            post_delete.connect(release_blobs, sender=model)
+
+
+def remember_replaced_blobs(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    attnames = media.blob_fields(sender)
+
+    # Новый файл в поле ещё не сохранён (_committed=False): его сохранит FileField.pre_save
+    uploaded = [attname for attname in attnames if getattr(instance, attname) and not getattr(instance, attname)._committed]
+    if not uploaded:
+        return
+
+    instance._uploaded_blobs = uploaded
+    if not instance._state.adding and instance.pk is not None:
+        saved = sender._base_manager.filter(pk=instance.pk).values_list(*uploaded).first()
+        instance._replaced_blobs = list(saved or ())
+
+
+def count_uploaded_blobs(sender, instance, **kwargs):
+    uploaded = instance.__dict__.pop("_uploaded_blobs", None)
+    if uploaded is None:
+        return
+
+    media.add_references(getattr(instance, attname).name for attname in uploaded)
+    media.remove_references(instance.__dict__.pop("_replaced_blobs", []))
+
+
+def release_blobs(sender, instance, **kwargs):
+    media.remove_references(getattr(instance, attname).name for attname in media.blob_fields(sender))
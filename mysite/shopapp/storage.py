@@ -0,0 +1,90 @@
+"""
+Хранилище файлов по содержимому (content-addressed).
+
+ContentAddressedStorage сохраняет файл под именем blobs/<ab>/<sha256>.<ext>, а не под
+именем из upload_to. Одинаковые файлы (одно фото у нескольких товаров, повторная
+загрузка) хранятся один раз. URL файла не меняется, пока файл существует, и
+MediaBlobView отдаёт его с Cache-Control: immutable.
+
+Само хранилище только пишет файлы и не обращается к базе (в него пишут из пула
+потоков, см. shopapp.images). Ссылки на файлы считает shopapp.media, а
+файлы без ссылок удаляет команда gc_media.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+from pathlib import PurePath
+
+from django.core.files.storage import FileSystemStorage, storages
+
+BLOBS_DIR = "blobs"
+# Недописанные файлы; gc_media удаляет забытые
+BLOBS_TMP_DIR = f"{BLOBS_DIR}/tmp"
+# Уменьшенные копии (shopapp.thumbnails) лежат в этом подкаталоге рядом с оригиналом
+THUMBNAILS_DIR = "thumbs"
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def blob_storage():
+    """
+    Хранилище для полей моделей (FileField(storage=blob_storage)), настраивается в STORAGES["blobs"].
+    """
+    return storages["blobs"]
+
+
+def is_blob_name(name: str) -> bool:
+    return name.startswith(f"{BLOBS_DIR}/") and not name.startswith(f"{BLOBS_TMP_DIR}/")
+
+
+def blob_name(digest: str, filename: str) -> str:
+    extension = PurePath(filename).suffix.lower()
+    return posixpath.join(BLOBS_DIR, digest[:2], f"{digest}{extension}")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage, который сохраняет файлы под именем по SHA-256 содержимого.
+
+    Файлы со старыми именами (до перехода на это хранилище) читаются и удаляются как раньше.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяет содержимое, совпадение имён - это тот же файл
+        return name
+
+    def _save(self, name, content):
+        tmp_dir = self.path(BLOBS_TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+
+            name = blob_name(sha256.hexdigest(), name)
+            path = self.path(name)
+            if os.path.exists(path):
+                # Свежий mtime защищает файл от gc_media, пока ссылка на него не сохранена
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                # Атомарно: одновременная запись того же содержимого даёт тот же файл
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return name
+
+    def delete(self, name):
+        # Файл может использоваться другими строками; удаляет его только gc_media
+        if not is_blob_name(name):
+            super().delete(name)
@@ -0,0 +1,22 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from ..thumbnails import thumbnail_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(file, sizes="100vw", **attrs):
+    """
+    <img> с уменьшенными копиями изображения в srcset:
+    {% responsive_image product.preview sizes="30vw" alt=product.name %}.
+
+    sizes - ширина изображения на странице, по ней браузер выбирает копию из srcset.
+    """
+    src, srcset = thumbnail_srcset(file.name)
+    return format_html(
+        "<img{}>",
+        flatatt({"src": src, "srcset": srcset, "sizes": sizes, "loading": "lazy", **attrs}),
+    )
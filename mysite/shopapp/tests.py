@@ -1,14 +1,84 @@
+import asyncio
+import csv
+import gzip
 import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 from random import choices
 from string import ascii_letters
+from unittest import mock
 
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import Permission, User
-from django.test import TestCase
-from django.urls import reverse
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, OperationalError, connection, connections, router, transaction
+from django.db.models import Count, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from django.views import View
+from PIL import Image
 
-from .models import Product, Order
+from myauth.forms import ProfileAvatarForm
+from myauth.models import Profile
+from mysite import metrics
+from mysite.cache_backends import SQLiteCache, TieredFileBasedCache, TieredSQLiteCache, track_request_stats
+from mysite.db import (
+    PIN_COOKIE,
+    WRITE_RETRY_ATTEMPTS,
+    PrimaryPinMiddleware,
+    ReadReplicaMixin,
+    read_from_replica,
+    replica_database,
+    write_transaction,
+)
+
+from .admin import mark_archived
+from .benchmarks import SCENARIOS, compare, run_benchmarks, run_load
+from .caching import CACHE_STATS, acached_compute, cached_compute, get_cache_stats
+from .common import insert_orders, save_csv_orders, save_csv_products
+from .fragments import render_product_cards
+from .images import map_in_threads, normalize_image
+from .jobs import (
+    claim_next_job,
+    delete_expired_job_files,
+    enqueue_job,
+    fail_stale_imports,
+    requeue_stale_jobs,
+    run_job,
+)
+from .media import count_references
+from .models import (
+    BackgroundJob,
+    DailySales,
+    MediaBlob,
+    Order,
+    Product,
+    ProductDailySales,
+    ProductImage,
+    ProductPair,
+    PromocodeDailySales,
+    UserDailySales,
+)
+from .recommendations import build_product_pairs, related_products
+from .reports import SalesDeltas, rebuild_sales_rollups
+from .search import deferred_search_index, search_product_ids, search_products
+from .thumbnails import generate_thumbnails, get_manifest
+from .totals import rebuild_order_totals
 
 
 class AddTwoNumbersTestCase(TestCase):
@@ -235,6 +305,9 @@ class OrdersExportTestCase(TestCase):
                 "promocode": order.promocode,
                 "user": order.user.pk,
                 "products": [product.pk for product in order.products.all()],
+                "total_price": str(order.total_price),
+                "discounted_total": str(order.discounted_total),
+                "products_count": order.products_count,
             }
             for order in orders
         ]
@@ -245,4 +318,2204 @@ class OrdersExportTestCase(TestCase):
         print('\n*** Orders data ***')
         print(json.dumps(orders_data["orders"], indent=4, default=str))
 
-        self.assertEqual(orders_data["orders"], expected_data)
\ No newline at end of file
+        self.assertEqual(orders_data["orders"], expected_data)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductViewSetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        # Одинаковые имена и цены, чтобы ключ сортировки различался только по pk
+        for name, price in [("A", 10), ("B", 5), ("B", 5), ("B", 7), ("C", 1), ("C", 1), ("D", 3)]:
+            Product.objects.create(name=name, price=price, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def collect_pages(self, url):
+        pks = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pks.extend(item["pk"] for item in data["results"])
+            url = data["next"]
+            pages += 1
+        return pks, pages
+
+    def test_walks_all_products_in_meta_ordering(self):
+        pks, pages = self.collect_pages(reverse("shopapp:product-list") + "?page_size=3")
+        expected = list(Product.objects.order_by("name", "price", "pk").values_list("pk", flat=True))
+        self.assertEqual(pks, expected)
+        self.assertEqual(pages, 3)
+
+    def test_respects_ordering_filter(self):
+        pks, _ = self.collect_pages(reverse("shopapp:product-list") + "?page_size=2&ordering=-price")
+        expected = list(Product.objects.order_by("-price", "pk").values_list("pk", flat=True))
+        self.assertEqual(pks, expected)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get(reverse("shopapp:product-list") + "?page_size=3").json()
+        second = self.client.get(first["next"]).json()
+        previous = self.client.get(second["previous"]).json()
+        self.assertEqual(previous["results"], first["results"])
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("shopapp:product-list") + "?page_size=3")
+        self.assertFalse(any("COUNT(" in query["sql"].upper() for query in context.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list") + "?cursor=garbage")
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderViewSetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        # Повторяющиеся промокоды и одинаковое время создания: порядок внутри группы задаёт только pk
+        for promocode in ["SALE", "", "SALE", "VIP", "", "SALE", "VIP"]:
+            Order.objects.create(user=cls.user, delivery_address="Main st", promocode=promocode)
+        Order.objects.update(created_at=timezone.now())
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def collect_pages(self, url):
+        pks = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pks.extend(item["pk"] for item in data["results"])
+            url = data["next"]
+        return pks
+
+    def test_walks_all_orders_in_default_ordering(self):
+        pks = self.collect_pages(reverse("shopapp:order-list") + "?page_size=2")
+        expected = list(Order.objects.order_by("-created_at", "-pk").values_list("pk", flat=True))
+        self.assertEqual(pks, expected)
+
+    def test_non_unique_ordering_field_is_broken_by_pk(self):
+        pks = self.collect_pages(reverse("shopapp:order-list") + "?page_size=2&ordering=-promocode")
+        expected = list(Order.objects.order_by("-promocode", "pk").values_list("pk", flat=True))
+        self.assertEqual(pks, expected)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductFullTextSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.laptop = Product.objects.create(
+            name="Laptop", description="Thin and light notebook", created_by=cls.user,
+        )
+        cls.phone = Product.objects.create(
+            name="Smartphone", description="Phone with a laptop-grade chip", created_by=cls.user,
+        )
+        cls.desk = Product.objects.create(name="Desk", description="Oak table", created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, term):
+        # QuerySet.update() в тесте не инвалидирует кеш list, а здесь проверяется сам индекс
+        cache.clear()
+        response = self.client.get(reverse("shopapp:product-list"), {"search": term})
+        self.assertEqual(response.status_code, 200)
+        return [item["pk"] for item in response.json()["results"]]
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search("laptop"), [self.laptop.pk, self.phone.pk])
+
+    def test_search_by_prefix(self):
+        self.assertEqual(self.search("note"), [self.laptop.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(pk=self.desk.pk).update(description="Standing desk with drawers")
+        self.assertEqual(self.search("drawers"), [self.desk.pk])
+        self.assertEqual(self.search("oak"), [])
+
+        self.desk.refresh_from_db()
+        self.desk.archived = True
+        self.desk.save()
+        self.assertEqual(self.search("drawers"), [self.desk.pk])
+
+        self.desk.delete()
+        self.assertEqual(self.search("drawers"), [])
+
+    def test_search_terms_are_escaped(self):
+        self.assertEqual(self.search('"laptop OR'), [])
+
+    def test_only_ranked_search_is_limited(self):
+        # Админка и выгрузки ищут без ранжирования и получают все совпадения
+        with mock.patch("shopapp.search.SEARCH_MAX_RESULTS", 1):
+            self.assertEqual(len(search_products(Product.objects.all(), ["laptop"])), 1)
+            self.assertEqual(len(search_products(Product.objects.all(), ["laptop"], ranked=False)), 2)
+        self.assertEqual(len(search_products(Product.objects.all(), [" "], ranked=False)), 0)
+
+    def test_download_csv_exports_every_match(self):
+        with mock.patch("shopapp.search.SEARCH_MAX_RESULTS", 1):
+            response = self.client.get(reverse("shopapp:product-download-csv"), {"search": "laptop"})
+
+        rows = list(csv.reader(b"".join(response.streaming_content).decode("utf-8").splitlines()))
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ["Laptop", "Smartphone"])
+
+
+class ProductDownloadCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        Product.objects.create(name="Laptop", description="Notebook", price="999.90", created_by=cls.user)
+        Product.objects.create(name="Desk", description="Oak, 2m", price="150", discount=5, created_by=cls.user)
+
+    def expected_rows(self):
+        return [
+            ["name", "description", "price", "discount", "created_by"],
+            ["Desk", "Oak, 2m", "150.00", "5", str(self.user.pk)],
+            ["Laptop", "Notebook", "999.90", "0", str(self.user.pk)],
+        ]
+
+    def test_download_csv_is_streamed(self):
+        response = self.client.get(reverse("shopapp:product-download-csv"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertEqual(list(csv.reader(content.splitlines())), self.expected_rows())
+
+    def test_download_csv_gzip(self):
+        response = self.client.get(reverse("shopapp:product-download-csv"), {"compress": "gzip"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn("products-export.csv.gz", response["Content-Disposition"])
+
+        content = gzip.decompress(b"".join(response.streaming_content)).decode("utf-8")
+        self.assertEqual(list(csv.reader(content.splitlines())), self.expected_rows())
+
+
+class SaveCSVProductsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+
+    def make_csv(self, rows):
+        lines = ["name,description,price,discount,created_by"] + rows
+        return BytesIO("\n".join(lines).encode("utf-8"))
+
+    def test_imports_valid_rows_and_reports_invalid(self):
+        file = self.make_csv([
+            f"Laptop,Notebook,999.90,10,{self.user.pk}",
+            f"Broken price,,abc,0,{self.user.pk}",
+            "No user,,10,0,999",
+            f"Too much discount,,10,150,{self.user.pk}",
+            f"Desk,Oak,150,0,{self.user.pk}",
+        ])
+
+        result = save_csv_products(file=file, encoding="utf-8", chunk_size=2)
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.failed, 3)
+        self.assertEqual([error["line"] for error in result.errors], [3, 4, 5])
+        self.assertIn("price", result.errors[0]["errors"])
+        self.assertIn("created_by", result.errors[1]["errors"])
+        self.assertIn("discount", result.errors[2]["errors"])
+        self.assertQuerySetEqual(
+            Product.objects.order_by("name"),
+            ["Desk", "Laptop"],
+            transform=lambda product: product.name,
+        )
+
+    def test_queries_per_chunk_do_not_depend_on_rows(self):
+        rows = [f"Product {i},,{i},0,{self.user.pk}" for i in range(50)]
+
+        with CaptureQueriesContext(connection) as context:
+            save_csv_products(file=self.make_csv(rows), encoding="utf-8", chunk_size=100, batch_size=100)
+
+        # in_bulk, INSERT, savepoint/release транзакции чанка и 4 запроса отложенной индексации FTS
+        self.assertLessEqual(len(context.captured_queries), 8)
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(len(search_product_ids(["product"])), 50)
+
+    def test_search_index_is_restored_after_error(self):
+        with transaction.atomic():
+            with self.assertRaises(ValueError):
+                with deferred_search_index():
+                    lamp = Product.objects.create(name="Lamp", created_by=self.user)
+                    raise ValueError
+            chair = Product.objects.create(name="Chair", created_by=self.user)
+
+        self.assertEqual(search_product_ids(["lamp"]), [lamp.pk])
+        self.assertEqual(search_product_ids(["chair"]), [chair.pk])
+
+
+class SaveCSVOrdersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.products = [
+            Product.objects.create(name=f"Product {i}", price=10 * i, created_by=cls.user)
+            for i in range(1, 4)
+        ]
+
+    def make_csv(self, rows):
+        lines = ["delivery_address,promocode,user,product"] + rows
+        return BytesIO("\n".join(lines).encode("utf-8"))
+
+    def test_imports_orders_with_products(self):
+        first, second, third = (product.pk for product in self.products)
+        file = self.make_csv([
+            f'123 Main st,SALE,{self.user.pk},"{first},{second}"',
+            f"456 Side st,,{self.user.pk},{third}",
+            f'No user,,999,"{first}"',
+            f'Missing product,,{self.user.pk},"{first},99999"',
+            f"No products,,{self.user.pk},",
+        ])
+
+        result = save_csv_orders(file=file, encoding="utf-8", chunk_size=2)
+
+        self.assertEqual(result.created, 3)
+        self.assertEqual(result.failed, 2)
+        self.assertEqual([error["line"] for error in result.errors], [4, 5])
+
+        orders = Order.objects.order_by("pk").prefetch_related("products")
+        self.assertEqual(
+            [(order.delivery_address, sorted(p.pk for p in order.products.all())) for order in orders],
+            [("123 Main st", [first, second]), ("456 Side st", [third]), ("No products", [])],
+        )
+        self.assertEqual(
+            [(order.total_price, order.products_count) for order in orders],
+            [(Decimal("30.00"), 2), (Decimal("30.00"), 1), (Decimal("0.00"), 0)],
+        )
+
+    def test_queries_per_chunk_do_not_depend_on_rows(self):
+        product_ids = ",".join(str(product.pk) for product in self.products)
+        rows = [f'Address {i},,{self.user.pk},"{product_ids}"' for i in range(40)]
+
+        with CaptureQueriesContext(connection) as context:
+            result = save_csv_orders(file=self.make_csv(rows), encoding="utf-8", chunk_size=100, batch_size=200)
+
+        self.assertEqual(result.created, 40)
+        self.assertEqual(Order.products.through.objects.count(), 120)
+        # users, products, savepoint, INSERT заказов, INSERT промежуточной таблицы,
+        # по два запроса на каждую из четырёх таблиц итогов продаж (с savepoint),
+        # два запроса на пары товаров (с savepoint), release
+        self.assertLessEqual(len(context.captured_queries), 20)
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10, created_by=cls.user)
+        cls.mouse = Product.objects.create(name="Mouse", price="19.99", discount=15, created_by=cls.user)
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user, delivery_address="123 Main st")
+
+    def assertTotals(self, order, total_price, discounted_total, products_count):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.total_price, order.discounted_total, order.products_count),
+            (Decimal(total_price), Decimal(discounted_total), products_count),
+        )
+        # Совпадает с тем, что раньше считалось через join
+        expected = Order.objects.filter(pk=order.pk).aggregate(total=Sum("products__price", default=0))["total"]
+        self.assertEqual(order.total_price, expected)
+
+    def test_forward_changes(self):
+        self.order.products.add(self.laptop, self.mouse)
+        self.assertTotals(self.order, "1019.99", "916.99", 2)
+
+        self.order.products.add(self.mouse)
+        self.order.products.remove(self.laptop, self.laptop)
+        self.assertTotals(self.order, "19.99", "16.99", 1)
+
+        self.order.products.set([self.laptop])
+        self.assertTotals(self.order, "1000.00", "900.00", 1)
+
+        # save() с прочитанными раньше итогами их не затирает
+        stale = Order.objects.get(pk=self.order.pk)
+        self.order.products.add(self.mouse)
+        stale.promocode = "SALE"
+        stale.save()
+        self.assertTotals(self.order, "1019.99", "916.99", 2)
+        self.order.products.remove(self.mouse)
+
+        self.order.products.clear()
+        self.assertTotals(self.order, "0.00", "0.00", 0)
+
+    def test_reverse_changes(self):
+        other = Order.objects.create(user=self.user)
+
+        self.laptop.orders.add(self.order, other)
+        self.assertTotals(other, "1000.00", "900.00", 1)
+
+        self.laptop.orders.remove(other)
+        self.assertTotals(other, "0.00", "0.00", 0)
+        self.assertTotals(self.order, "1000.00", "900.00", 1)
+
+        self.laptop.orders.clear()
+        self.assertTotals(self.order, "0.00", "0.00", 0)
+
+    def test_product_price_change_and_delete(self):
+        self.order.products.add(self.laptop, self.mouse)
+
+        self.mouse.price = Decimal("29.99")
+        self.mouse.discount = 0
+        self.mouse.save()
+        self.assertTotals(self.order, "1029.99", "929.99", 2)
+
+        self.mouse.delete()
+        self.assertTotals(self.order, "1000.00", "900.00", 1)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_admin_changes_update_totals_and_pairs(self):
+        admin = User.objects.create_superuser(username="admin", password="Qwerty123!")
+        self.client.force_login(admin)
+
+        response = self.client.post(
+            reverse("admin:shopapp_order_change", args=[self.order.pk]),
+            {
+                "delivery_address": "123 Main st", "user": self.user.pk, "products": [self.laptop.pk, self.mouse.pk],
+                "receipt": SimpleUploadedFile("receipt.txt", b"receipt"),
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTotals(self.order, "1019.99", "916.99", 2)
+        self.assertEqual(ProductPair.objects.get(product=self.laptop, related=self.mouse).count, 1)
+
+        response = self.client.post(
+            reverse("admin:shopapp_product_change", args=[self.laptop.pk]),
+            {
+                "name": "Laptop", "description": "", "created_by": self.user.pk, "price": "1000.00", "discount": 10,
+                "images-TOTAL_FORMS": 0, "images-INITIAL_FORMS": 0,
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTotals(self.order, "19.99", "16.99", 1)
+        self.assertFalse(ProductPair.objects.exists())
+
+    def test_save_does_not_resurrect_deleted_order(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        stale.products.add(self.laptop)
+        Order.objects.filter(pk=stale.pk).delete()
+
+        with self.assertRaises(DatabaseError):
+            stale.save()
+
+    def test_rebuild_command(self):
+        self.order.products.add(self.laptop, self.mouse)
+        Order.objects.update(total_price=0, discounted_total=0, products_count=0)
+
+        call_command("rebuild_order_totals", batch_size=1, stdout=StringIO())
+
+        self.assertTotals(self.order, "1019.99", "916.99", 2)
+
+    def test_orders_list_total_filters(self):
+        cheap = Order.objects.create(user=self.user)
+        cheap.products.add(self.mouse)
+        self.order.products.add(self.laptop)
+        self.client.force_login(self.user)
+        url = reverse("shopapp:orders_list")
+
+        response = self.client.get(url, {"min_total": "100"})
+        self.assertEqual(list(response.context["object_list"]), [self.order])
+
+        # Некорректные значения фильтра игнорируются, а не дают 500
+        for value in ("NaN", "-Infinity", "sNaN", "1e20", "abc"):
+            response = self.client.get(url, {"min_total": value, "max_total": value})
+            self.assertEqual(response.status_code, 200)
+            self.assertCountEqual(response.context["object_list"], [self.order, cheap])
+
+    def test_api_orders_by_total_without_join(self):
+        cheap = Order.objects.create(user=self.user)
+        cheap.products.add(self.mouse)
+        self.order.products.add(self.laptop)
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("shopapp:order-list"), {"ordering": "-total_price", "total_price__gte": "10"})
+
+        self.assertEqual([order["pk"] for order in response.json()["results"]], [self.order.pk, cheap.pk])
+        self.assertEqual(response.json()["results"][0]["total_price"], "1000.00")
+        orders_query = next(query["sql"] for query in context.captured_queries if 'FROM "shopapp_order"' in query["sql"])
+        self.assertNotIn("shopapp_order_products", orders_query)
+
+
+class SalesRollupTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!", is_staff=True)
+        cls.buyer = User.objects.create_user(username="buyer", password="Qwerty123!")
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10, created_by=cls.user)
+        cls.mouse = Product.objects.create(name="Mouse", price="20.00", created_by=cls.user)
+
+    def snapshot(self):
+        rows = {}
+        for model in (DailySales, ProductDailySales, UserDailySales, PromocodeDailySales):
+            rows[model.__name__] = sorted(
+                (
+                    tuple(row)
+                    for row in model.objects.exclude(orders_count=0, units=0).values_list(
+                        *[field.attname for field in model._meta.concrete_fields if field.name != "id"]
+                    )
+                ),
+                key=str,
+            )
+        return rows
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        rebuild_sales_rollups()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_order_changes_are_rolled_up(self):
+        order = Order.objects.create(user=self.buyer, promocode="SALE")
+        order.products.add(self.laptop, self.mouse)
+
+        day = DailySales.objects.get()
+        self.assertEqual(
+            (day.orders_count, day.units, day.revenue, day.gross_revenue),
+            (1, 2, Decimal("920.00"), Decimal("1020.00")),
+        )
+        self.assertEqual(PromocodeDailySales.objects.get(promocode="SALE").units, 2)
+        self.assertMatchesRebuild()
+
+        order.products.remove(self.mouse)
+        self.mouse.orders.add(order)
+        self.laptop.orders.clear()
+        self.assertMatchesRebuild()
+
+    def test_order_identity_price_change_and_deletes(self):
+        order = Order.objects.create(user=self.buyer, promocode="SALE")
+        order.products.set([self.laptop, self.mouse])
+        other = Order.objects.create(user=self.user)
+        other.products.add(self.mouse)
+
+        order.promocode = "BLACKFRIDAY"
+        order.user = self.user
+        order.save()
+        self.assertMatchesRebuild()
+
+        self.mouse.price = Decimal("25.00")
+        self.mouse.save()
+        self.assertMatchesRebuild()
+
+        self.laptop.delete()
+        other.delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(DailySales.objects.get().orders_count, 1)
+
+    def test_csv_import_updates_rollups(self):
+        file = BytesIO(
+            f"delivery_address,promocode,user,product\n"
+            f'123 Main st,SALE,{self.buyer.pk},"{self.laptop.pk},{self.mouse.pk}"\n'.encode("utf-8")
+        )
+        save_csv_orders(file=file, encoding="utf-8")
+
+        self.assertEqual(UserDailySales.objects.get(user=self.buyer).revenue, Decimal("920.00"))
+        self.assertMatchesRebuild()
+
+    def test_reports_api(self):
+        order = Order.objects.create(user=self.buyer, promocode="SALE")
+        order.products.add(self.laptop, self.mouse)
+        today = timezone.localdate().isoformat()
+        url = reverse("shopapp:reports-list")
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url, {"date_from": today, "date_to": today})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["totals"]["revenue"], "920.00")
+        self.assertEqual(response.json()["days"][0]["day"], today)
+
+        response = self.client.get(reverse("shopapp:reports-products"), {"ordering": "units", "limit": 1})
+        self.assertEqual(len(response.json()), 1)
+
+        response = self.client.get(reverse("shopapp:reports-products"))
+        self.assertEqual([row["name"] for row in response.json()], ["Laptop", "Mouse"])
+
+        response = self.client.get(reverse("shopapp:reports-promocodes"))
+        self.assertEqual(response.json()[0]["promocode"], "SALE")
+
+        response = self.client.get(reverse("shopapp:reports-users"), {"date_from": today, "date_to": "2000-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductPairTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.laptop, cls.mouse, cls.bag = (
+            Product.objects.create(name=name, price=price, created_by=cls.user)
+            for name, price in (("Laptop", "1000.00"), ("Mouse", "20.00"), ("Bag", "50.00"))
+        )
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def pairs(self):
+        return sorted(ProductPair.objects.values_list("product_id", "related_id", "count"))
+
+    def assertMatchesBuild(self):
+        incremental = self.pairs()
+        build_product_pairs()
+        self.assertEqual(incremental, self.pairs())
+
+    def test_order_changes_update_pairs(self):
+        first = Order.objects.create(user=self.user)
+        first.products.add(self.laptop, self.mouse)
+        second = Order.objects.create(user=self.user)
+        second.products.add(self.laptop)
+        second.products.add(self.mouse, self.bag)
+        self.assertEqual(ProductPair.objects.get(product=self.laptop, related=self.mouse).count, 2)
+        self.assertMatchesBuild()
+
+        second.products.remove(self.laptop)
+        self.bag.orders.add(first)
+        self.assertMatchesBuild()
+
+        self.mouse.orders.clear()
+        self.assertMatchesBuild()
+
+        first.delete()
+        self.assertMatchesBuild()
+        self.assertFalse(ProductPair.objects.exists())
+
+    def test_csv_import_updates_pairs(self):
+        file = BytesIO(
+            f"delivery_address,promocode,user,product\n"
+            f'123 Main st,,{self.user.pk},"{self.laptop.pk},{self.mouse.pk},{self.bag.pk}"\n'
+            f'456 Side st,,{self.user.pk},"{self.laptop.pk},{self.bag.pk}"\n'.encode("utf-8")
+        )
+        save_csv_orders(file=file, encoding="utf-8")
+
+        self.assertEqual(ProductPair.objects.get(product=self.bag, related=self.laptop).count, 2)
+        self.assertMatchesBuild()
+
+    def test_related_products_are_cached_until_pairs_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+            order.products.add(self.laptop, self.mouse)
+
+        self.assertEqual([row["name"] for row in related_products(self.laptop.pk)], ["Mouse"])
+        with self.assertNumQueries(0):
+            related_products(self.laptop.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.add(self.bag)
+        self.assertEqual([row["name"] for row in related_products(self.laptop.pk)], ["Mouse", "Bag"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bag.archived = True
+            self.bag.save()
+        self.assertEqual([row["name"] for row in related_products(self.laptop.pk)], ["Mouse"])
+
+    def test_detail_page_and_api(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+            order.products.add(self.laptop, self.mouse)
+
+        url = reverse("shopapp:product_details", kwargs={"pk": self.laptop.pk})
+        response = self.client.get(url)
+        self.assertContains(response, "Frequently bought together")
+        self.assertContains(response, reverse("shopapp:product_details", kwargs={"pk": self.mouse.pk}))
+
+        # Повторный запрос: товар и изображения, рекомендации из кеша
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+        response = self.client.get(reverse("shopapp:product-related", kwargs={"pk": self.laptop.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"pk": self.mouse.pk, "name": "Mouse", "price": "20.00", "count": 1}])
+
+
+@override_settings(
+    METRICS_DIR=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "mysite.cache_backends.TieredSQLiteCache", "LOCATION": os.path.join(tempfile.mkdtemp(), "cache.sqlite3")}},
+)
+class MetricsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!", is_staff=True)
+        cls.product = Product.objects.create(name="Laptop", price="1000.00", created_by=cls.user)
+
+    def product_details_metric(self):
+        return metrics.collect().get(("shopapp:product_details", "GET"), metrics._empty_record())
+
+    def test_records_requests_queries_and_cache(self):
+        url = reverse("shopapp:product_details", kwargs={"pk": self.product.pk})
+        before = self.product_details_metric()
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        self.client.get(url)
+
+        after = self.product_details_metric()
+        self.assertEqual(after["requests"] - before["requests"], 2)
+        self.assertEqual(after["statuses"]["2xx"] - before["statuses"].get("2xx", 0), 2)
+        self.assertEqual(sum(after["buckets"]) - sum(before["buckets"]), 2)
+        self.assertGreaterEqual(after["db_queries"] - before["db_queries"], len(context.captured_queries))
+        self.assertGreater(after["db_seconds"], before["db_seconds"])
+        # Первый запрос кладёт рекомендации в кеш, второй их читает
+        self.assertGreaterEqual(after["cache_hits"] - before["cache_hits"], 1)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.get(reverse("shopapp:products_list"))
+        self.client.get("/shop/no-such-page/")
+
+        self.assertNotEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+        body = response.content.decode()
+        self.assertIn("# TYPE django_http_request_duration_seconds histogram", body)
+        self.assertIn('django_http_requests_total{view="shopapp:products_list",method="GET",status="2xx"}', body)
+        self.assertIn('django_http_requests_total{view="<unresolved>",method="GET",status="4xx"}', body)
+        self.assertIn('django_http_request_duration_seconds_bucket{view="shopapp:products_list",method="GET",le="+Inf"}', body)
+
+    def test_workers_are_summed(self):
+        with open(os.path.join(settings.METRICS_DIR, "metrics-1-1.json"), "w") as f:
+            json.dump({"shopapp:orders_export\tGET": dict(metrics._empty_record(), requests=3, db_queries=7)}, f)
+
+        metric = metrics.collect()[("shopapp:orders_export", "GET")]
+        self.assertGreaterEqual(metric["requests"], 3)
+        self.assertGreaterEqual(metric["db_queries"], 7)
+
+    def test_files_of_finished_workers_are_retired(self):
+        worker = multiprocessing.Process(target=int)
+        worker.start()
+        worker.join()
+        name = f"metrics-{worker.pid}-1.json"
+        with open(os.path.join(settings.METRICS_DIR, name), "w") as f:
+            json.dump({"test:retired\tGET": dict(metrics._empty_record(), requests=3)}, f)
+
+        self.assertEqual(metrics.collect()[("test:retired", "GET")]["requests"], 3)
+        self.assertNotIn(name, os.listdir(settings.METRICS_DIR))
+        self.assertIn(metrics.RETIRED_FILENAME, os.listdir(settings.METRICS_DIR))
+        self.assertEqual(metrics.collect()[("test:retired", "GET")]["requests"], 3)
+
+    def test_cache_counters_are_per_request(self):
+        cache.set("key", 1)
+
+        with track_request_stats() as stats:
+            # Обращения другого потока (параллельного запроса) не учитываются
+            other = threading.Thread(target=lambda: [cache.get("key") for _ in range(5)])
+            other.start()
+            other.join()
+            cache.get("key")
+            cache.get("missing")
+
+        self.assertEqual(stats["l1_hits"] + stats["l2_hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class QueryBudgetTestCase(TestCase):
+    """
+    Число запросов каждого маршрута shopapp.urls и myauth.urls (включая роутер DRF)
+    не должно зависеть от объёма данных и превышать бюджет.
+
+    Каждый маршрут запрашивается дважды: на маленьком наборе данных и после
+    добавления ещё SEED_EXTRA заказов, товаров и пользователей; кеш перед каждым
+    запросом очищается, чтобы мерить холодный путь.
+    """
+
+    SEED_EXTRA = 10
+
+    # URL name -> (метод, аргументы маршрута, бюджет запросов)
+    BUDGETS = {
+        "shopapp:index": ("get", None, 0),
+        "shopapp:api-root": ("get", None, 2),
+        "shopapp:order-list": ("get", None, 4),
+        "shopapp:order-detail": ("get", "order", 4),
+        "shopapp:product-list": ("get", None, 3),
+        "shopapp:product-detail": ("get", "product", 3),
+        "shopapp:product-related": ("get", "product", 4),
+        "shopapp:product-download-csv": ("get", None, 3),
+        "shopapp:product-export-csv": ("post", None, 3),
+        "shopapp:product-upload-csv": ("post", None, 3),
+        "shopapp:backgroundjob-list": ("get", None, 3),
+        "shopapp:backgroundjob-detail": ("get", "job", 3),
+        "shopapp:reports-list": ("get", None, 4),
+        "shopapp:reports-products": ("get", None, 3),
+        "shopapp:reports-users": ("get", None, 3),
+        "shopapp:reports-promocodes": ("get", None, 3),
+        "shopapp:async_orders_export": ("get", None, 4),
+        "shopapp:async_products_list": ("get", None, 1),
+        "shopapp:async_products_export": ("get", None, 1),
+        "shopapp:async_product_details": ("get", "product", 1),
+        "shopapp:async_products_feed": ("get", None, 1),
+        "shopapp:cache_stats": ("get", None, 2),
+        "shopapp:orders_list": ("get", None, 4),
+        "shopapp:order_create": ("get", None, 2),
+        "shopapp:orders_export": ("get", None, 4),
+        "shopapp:order_details": ("get", "order", 4),
+        "shopapp:order_update": ("get", "order", 4),
+        "shopapp:order_delete": ("get", "order", 1),
+        "shopapp:products_list": ("get", None, 3),
+        "shopapp:product_create": ("get", None, 2),
+        "shopapp:products_export": ("get", None, 1),
+        "shopapp:product_details": ("get", "product", 3),
+        "shopapp:product_update": ("get", "product", 3),
+        "shopapp:product_archive": ("get", "product", 1),
+        "shopapp:products_feed": ("get", None, 1),
+        "shopapp:product_thumbnail": ("get", None, 0),
+        "shopapp:user_orders": ("get", "user", 5),
+        "shopapp:user_orders_export": ("get", "user", 5),
+        "myauth:about-me": ("get", None, 3),
+        "myauth:avatar-update": ("get", None, 3),
+        "myauth:login": ("get", None, 2),
+        "myauth:logout": ("get", None, 4),
+        "myauth:register": ("get", None, 0),
+        "myauth:cookie-get": ("get", None, 0),
+        "myauth:cookie-set": ("get", None, 0),
+        "myauth:session-get": ("get", None, 2),
+        "myauth:session-set": ("get", None, 5),
+        "myauth:users-list": ("get", None, 1),
+        "myauth:user-profile": ("get", "user", 3),
+        "myauth:user-profile-update": ("get", "user", 4),
+    }
+
+    # Тела POST-запросов
+    REQUEST_DATA = {
+        "shopapp:product-upload-csv": lambda: {
+            "file": SimpleUploadedFile("products.csv", b"name,description,price,discount,created_by\n"),
+        },
+    }
+
+    # Аргументы маршрутов, которые не сводятся к pk объекта
+    ROUTE_KWARGS = {
+        "shopapp:product_thumbnail": {"width": 160, "name": "products/product_1/images/1.jpg"},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="nick_test", password="Qwerty123!")
+        Profile.objects.create(user=cls.admin)
+        cls.seed(3)
+        cls.user = User.objects.exclude(pk=cls.admin.pk).first()
+        cls.product = Product.objects.first()
+        cls.order = Order.objects.first()
+        cls.job = BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_EXPORT, created_by=cls.admin)
+
+    @classmethod
+    def seed(cls, count):
+        start = User.objects.count()
+        users = []
+        for index in range(start, start + count):
+            user = User.objects.create_user(username=f"buyer_{index}", password="Qwerty123!")
+            Profile.objects.create(user=user, bio="Buyer")
+            users.append(user)
+
+        products = []
+        for index in range(count * 2):
+            product = Product.objects.create(
+                name=f"Product {start}-{index}", price=10 + index, discount=index % 3 * 5, created_by=cls.admin,
+            )
+            ProductImage.objects.create(product=product, image=f"products/product_{product.pk}/images/1.jpg")
+            products.append(product)
+
+        for index, user in enumerate(users):
+            order = Order.objects.create(user=user, delivery_address=f"{index} Main st", promocode="SALE")
+            order.products.add(*products[index:index + 3])
+            cls.admin.order_set.create(delivery_address="Office").products.add(*products[:2])
+        BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_IMPORT, created_by=cls.admin)
+
+    @classmethod
+    def routes(cls):
+        """
+        Имена всех маршрутов приложений с пространствами имён.
+        """
+        def walk(patterns, namespaces):
+            for pattern in patterns:
+                if isinstance(pattern, URLResolver):
+                    yield from walk(pattern.url_patterns, namespaces + [pattern.namespace] if pattern.namespace else namespaces)
+                elif pattern.name and namespaces and namespaces[0] in ("shopapp", "myauth"):
+                    yield ":".join(namespaces + [pattern.name])
+
+        return set(walk(get_resolver().url_patterns, []))
+
+    def measure(self, name):
+        method, argument, _ = self.BUDGETS[name]
+        kwargs = {"pk": getattr(self, argument).pk} if argument else self.ROUTE_KWARGS.get(name)
+
+        self.client.force_login(self.admin)
+        self.client.cookies["fizz"] = "buzz"
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            data = self.REQUEST_DATA[name]() if name in self.REQUEST_DATA else None
+            response = getattr(self.client, method)(reverse(name, kwargs=kwargs), data)
+            if getattr(response, "streaming", False):
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 500, name)
+        return [query["sql"] for query in context.captured_queries]
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(self.routes(), set(self.BUDGETS))
+
+    def test_query_budgets(self):
+        small = {name: self.measure(name) for name in self.BUDGETS}
+        self.seed(self.SEED_EXTRA)
+        large = {name: self.measure(name) for name in self.BUDGETS}
+
+        report = []
+        for name, (_, _, budget) in self.BUDGETS.items():
+            problems = []
+            if len(large[name]) > budget:
+                problems.append(f"{len(large[name])} queries, budget {budget}")
+            if len(large[name]) != len(small[name]):
+                problems.append(f"{len(small[name])} -> {len(large[name])} queries after adding rows")
+            if problems:
+                report.append(f"{name}: {'; '.join(problems)}")
+                report.extend(f"  {index}. {sql}" for index, sql in enumerate(large[name], 1))
+
+        if report:
+            self.fail("Query budget exceeded:\n" + "\n".join(report))
+
+
+class GenerateShopDataTestCase(TestCase):
+    def generate(self, **options):
+        options = {"users": 5, "products": 30, "orders": 200, "seed": 3, "batch_size": 64, **options}
+        call_command("generate_shop_data", stdout=StringIO(), **options)
+
+    def test_generates_consistent_data(self):
+        self.generate()
+
+        self.assertEqual(User.objects.filter(username__startswith="gen3_").count(), 5)
+        self.assertEqual(Profile.objects.filter(user__username__startswith="gen3_").count(), 5)
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 200)
+
+        totals = list(Order.objects.order_by("pk").values_list("total_price", "discounted_total", "products_count"))
+        rebuild_order_totals()
+        self.assertEqual(totals, list(Order.objects.order_by("pk").values_list("total_price", "discounted_total", "products_count")))
+
+        rollups = list(ProductDailySales.objects.order_by("day", "product_id").values_list("product_id", "units", "revenue"))
+        rebuild_sales_rollups()
+        self.assertEqual(rollups, list(ProductDailySales.objects.order_by("day", "product_id").values_list("product_id", "units", "revenue")))
+
+        pairs = sorted(ProductPair.objects.values_list("product_id", "related_id", "count"))
+        build_product_pairs()
+        self.assertEqual(pairs, sorted(ProductPair.objects.values_list("product_id", "related_id", "count")))
+
+        # Популярные товары заметно чаще средних
+        popularity = sorted(Product.objects.annotate(orders_count=Count("orders")).values_list("orders_count", flat=True))
+        self.assertGreater(popularity[-1], 3 * sum(popularity) / len(popularity))
+
+        with self.assertRaises(CommandError):
+            self.generate()
+
+    def test_same_seed_generates_same_data(self):
+        def snapshot():
+            return (
+                list(Product.objects.order_by("pk").values_list("name", "price", "discount")),
+                list(Order.objects.order_by("pk").values_list("user__username", "products_count", "total_price")),
+            )
+
+        with transaction.atomic():
+            self.generate()
+            first = snapshot()
+            transaction.set_rollback(True)
+
+        self.generate()
+        self.assertEqual(first, snapshot())
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class HttpBenchmarksTestCase(TestCase):
+    def test_runs_every_scenario(self):
+        call_command("generate_shop_data", users=3, products=20, orders=30, stdout=StringIO())
+        user = User.objects.create_superuser(username="benchmark", password="benchmark")
+        self.client.force_login(user)
+
+        results = run_benchmarks(self.client, user.pk, requests=3, warmup=1)
+
+        self.assertEqual(set(results), {scenario.name for scenario in SCENARIOS})
+        for result in results.values():
+            self.assertEqual(result["requests"], 3)
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+        # Задачи upload_csv_enqueue и их файлы удаляются после каждого запроса
+        self.assertFalse(BackgroundJob.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, "jobs", "sources")), [])
+
+    def test_compare_with_baseline(self):
+        baseline = {
+            "fast": {"rps": 100.0, "p95_ms": 10.0},
+            "slow": {"rps": 100.0, "p95_ms": 10.0},
+            "removed": {"rps": 1.0, "p95_ms": 1.0},
+        }
+        results = {
+            "fast": {"rps": 90.0, "p95_ms": 11.0},
+            "slow": {"rps": 100.0, "p95_ms": 13.0},
+            "new": {"rps": 1.0, "p95_ms": 1.0},
+        }
+
+        rows = {row["name"]: row for row in compare(results, baseline, threshold=0.2)}
+
+        self.assertEqual(set(rows), {"fast", "slow"})
+        self.assertFalse(rows["fast"]["regression"])
+        self.assertTrue(rows["slow"]["regression"])
+        self.assertAlmostEqual(rows["slow"]["p95_change"], 0.3)
+
+    def test_server_load(self):
+        requests = []
+        connections_count = 0
+
+        async def handle(reader, writer):
+            nonlocal connections_count
+            connections_count += 1
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                # Медленный клиент отменён, не дослав запрос
+                writer.close()
+                return
+            requests.append(request)
+            status = b"500 Internal Server Error" if b"/error" in request else b"200 OK"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        async def load(path):
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await run_load("127.0.0.1", port, path, requests=20, concurrency=5, slow_clients=2, send_delay=0.05)
+
+        result = asyncio.run(load("/ok"))
+        self.assertEqual(result["requests"], 20)
+        self.assertEqual(result["errors"], 0)
+        # Медленные клиенты тоже подключались к серверу
+        self.assertGreater(connections_count, len(requests))
+        self.assertTrue(requests[0].startswith(b"GET /ok HTTP/1.1\r\n"))
+
+        result = asyncio.run(load("/error"))
+        self.assertEqual(result, {"requests": 0, "errors": 20})
+
+
+class SQLiteProfileTestCase(TestCase):
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            pragmas = {}
+            for name in ("synchronous", "busy_timeout", "temp_store"):
+                cursor.execute(f"PRAGMA {name}")
+                pragmas[name] = cursor.fetchone()[0]
+
+        # synchronous=NORMAL (1), temp_store=MEMORY (2)
+        self.assertEqual(pragmas, {"synchronous": 1, "busy_timeout": 5000, "temp_store": 2})
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+
+class WriteTransactionTestCase(TransactionTestCase):
+    def make_write(self, failures, error="database is locked"):
+        calls = []
+
+        @write_transaction(backoff=0)
+        def write(name):
+            calls.append(connection.in_atomic_block)
+            Product.objects.create(name=name, created_by=self.user)
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return name
+
+        return write, calls
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+
+    def test_retries_while_database_is_locked(self):
+        write, calls = self.make_write(failures=2)
+
+        self.assertEqual(write("Laptop"), "Laptop")
+        self.assertEqual(calls, [True, True, True])
+        # Неудачные попытки откатились целиком
+        self.assertEqual(Product.objects.filter(name="Laptop").count(), 1)
+
+    def test_gives_up_after_attempts(self):
+        write, calls = self.make_write(failures=WRITE_RETRY_ATTEMPTS)
+
+        with self.assertRaises(OperationalError):
+            write("Laptop")
+        self.assertEqual(len(calls), WRITE_RETRY_ATTEMPTS)
+        self.assertFalse(Product.objects.exists())
+
+    def test_other_errors_and_outer_transactions_are_not_retried(self):
+        write, calls = self.make_write(failures=1, error="no such table: shopapp_product")
+        with self.assertRaises(OperationalError):
+            write("Laptop")
+        self.assertEqual(len(calls), 1)
+
+        write, calls = self.make_write(failures=1)
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write("Laptop")
+        self.assertEqual(len(calls), 1)
+
+    def test_order_import_retry_does_not_reuse_rolled_back_pks(self):
+        product = Product.objects.create(name="Laptop", price="10.00", created_by=self.user)
+        orders = [Order(user=self.user, delivery_address="Main st"), Order(user=self.user, delivery_address="Side st")]
+        attempts = []
+        original_save = SalesDeltas.save
+
+        def flaky_save(deltas, *args, **kwargs):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise OperationalError("database is locked")
+            return original_save(deltas, *args, **kwargs)
+
+        with mock.patch.object(SalesDeltas, "save", flaky_save), mock.patch("mysite.db.time.sleep"):
+            insert_orders(orders, [[product.pk], [product.pk]], {product.pk: product}, batch_size=10)
+
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(Order.products.through.objects.count(), 2)
+        self.assertEqual(sorted(order.pk for order in orders), sorted(Order.objects.values_list("pk", flat=True)))
+
+
+class ReadReplicaTestCase(TestCase):
+    class AliasView(ReadReplicaMixin, View):
+        """
+        Отвечает базой, в которую роутер отправил бы чтение Product.
+        """
+
+        def get(self, request):
+            return HttpResponse(router.db_for_read(Product))
+
+        def post(self, request):
+            return HttpResponse(router.db_for_read(Product))
+
+    class StreamingAliasView(ReadReplicaMixin, View):
+        def get(self, request):
+            return StreamingHttpResponse(router.db_for_read(Product) for _ in range(1))
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        # Отдельной реплики в тестах нет (см. test_mirror_of_default_is_not_used), её роль играет псевдоним
+        self.enterContext(mock.patch("mysite.db.replica_database", return_value="replica"))
+
+    def call_pinned(self, request):
+        def get_response(request):
+            with read_from_replica():
+                return HttpResponse(router.db_for_read(Product))
+
+        return PrimaryPinMiddleware(get_response)(request)
+
+    def test_mirror_of_default_is_not_used(self):
+        # В тестах реплика - зеркало default, и настоящая функция от неё отказывается
+        self.assertEqual(connections["replica"].settings_dict["NAME"], connections["default"].settings_dict["NAME"])
+        self.assertIsNone(replica_database())
+
+    def test_router(self):
+        self.assertEqual(router.db_for_read(Product), "default")
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Product), "replica")
+            self.assertEqual(router.db_for_write(Product), "default")
+        self.assertEqual(router.db_for_read(Product), "default")
+        self.assertFalse(router.allow_migrate("replica", "shopapp"))
+
+    def test_safe_methods_read_from_replica(self):
+        view = self.AliasView.as_view()
+
+        self.assertEqual(view(self.factory.get("/")).content, b"replica")
+        self.assertEqual(view(self.factory.post("/")).content, b"default")
+
+    def test_streaming_response_reads_from_replica(self):
+        response = self.StreamingAliasView.as_view()(self.factory.get("/"))
+
+        self.assertEqual(b"".join(response.streaming_content), b"replica")
+
+    def test_write_pins_reads_to_primary(self):
+        response = self.call_pinned(self.factory.post("/"))
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        request = self.factory.get("/")
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.assertEqual(self.call_pinned(request).content, b"default")
+
+        # Срок привязки истёк
+        request = self.factory.get("/")
+        request.COOKIES[PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.call_pinned(request).content, b"replica")
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_cached_values_are_computed_on_primary(self):
+        async def compute():
+            return await sync_to_async(router.db_for_read)(Product)
+
+        with read_from_replica():
+            self.assertEqual(cached_compute("test:sync", lambda: router.db_for_read(Product)), "default")
+            self.assertEqual(async_to_sync(acached_compute)("test:async", compute), "default")
+            self.assertEqual(router.db_for_read(Product), "replica")
+
+    def test_failed_write_does_not_pin(self):
+        def get_response(request):
+            return HttpResponse(status=400)
+
+        response = PrimaryPinMiddleware(get_response)(self.factory.post("/"))
+
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AsyncCatalogTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="nick_staff", password="Qwerty123!", is_staff=True)
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.products = [
+            Product.objects.create(name=name, description=description, price=price, created_by=cls.staff)
+            for name, description, price in (
+                ("Wireless mouse", "Quiet wireless mouse", "25.00"),
+                ("Laptop", "Fast laptop", "1000.00"),
+                ("Wireless headphones", "Bluetooth", "150.00"),
+                ("Keyboard", "Mechanical", "80.00"),
+            )
+        ]
+        order = Order.objects.create(user=cls.user, delivery_address="Main st")
+        order.products.add(*cls.products[:2])
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def assertSameJson(self, sync_url, async_url):
+        sync_response = self.client.get(sync_url)
+        async_response = self.client.get(async_url)
+
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), sync_response.json())
+        return async_response.json()
+
+    def test_products_list_matches_api(self):
+        for query in ("", "?ordering=-price&page_size=2", "?search=wireless", "?search=wireless&ordering=price"):
+            with self.subTest(query=query):
+                sync_data = self.client.get(reverse("shopapp:product-list") + query).json()
+                async_data = self.client.get(reverse("shopapp:async_products_list") + query).json()
+
+                self.assertEqual(async_data["results"], sync_data["results"])
+                self.assertEqual(bool(async_data["next"]), bool(sync_data["next"]))
+
+    def test_products_list_cursor(self):
+        url = reverse("shopapp:async_products_list") + "?ordering=price&page_size=3"
+        first = self.client.get(url).json()
+        second = self.client.get(first["next"]).json()
+
+        pks = [product["pk"] for product in first["results"] + second["results"]]
+        self.assertEqual(pks, [product.pk for product in sorted(self.products, key=lambda product: Decimal(product.price))])
+        self.assertIsNone(second["next"])
+
+    def test_product_details(self):
+        product = self.products[0]
+        self.assertSameJson(
+            reverse("shopapp:product-detail", kwargs={"pk": product.pk}),
+            reverse("shopapp:async_product_details", kwargs={"pk": product.pk}),
+        )
+
+        response = self.client.get(reverse("shopapp:async_product_details", kwargs={"pk": 0}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_feed(self):
+        response = self.client.get(reverse("shopapp:async_products_feed"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], self.client.get(reverse("shopapp:products_feed"))["Content-Type"])
+        for product in self.products:
+            self.assertContains(response, product.name)
+
+    def test_products_export_shares_cache_with_sync_view(self):
+        self.client.get(reverse("shopapp:async_products_export"))
+
+        with CaptureQueriesContext(connection) as context:
+            data = self.assertSameJson(reverse("shopapp:products_export"), reverse("shopapp:async_products_export"))
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual([product["pk"] for product in data["products"]], [product.pk for product in self.products])
+
+    def test_orders_export_is_staff_only(self):
+        url = reverse("shopapp:async_orders_export")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.staff)
+        data = self.assertSameJson(reverse("shopapp:orders_export"), url)
+        self.assertEqual(sorted(data["orders"][0]["products"]), [product.pk for product in self.products[:2]])
+
+    async def test_async_client(self):
+        await self.async_client.aforce_login(self.staff)
+        before = metrics.collect().get(("shopapp:async_product_details", "GET"), metrics._empty_record())
+
+        response = await self.async_client.get(
+            reverse("shopapp:async_product_details", kwargs={"pk": self.products[1].pk})
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["name"], "Laptop")
+        # Обёртки MetricsMiddleware видят запросы async ORM
+        after = metrics.collect()[("shopapp:async_product_details", "GET")]
+        self.assertEqual(after["requests"] - before["requests"], 1)
+        self.assertGreaterEqual(after["db_queries"] - before["db_queries"], 1)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    async def test_metrics_are_flushed_outside_event_loop(self):
+        threads = []
+        original_flush = metrics.flush
+
+        def flush(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return original_flush(*args, **kwargs)
+
+        with mock.patch("mysite.metrics.flush", flush):
+            await self.async_client.get(reverse("shopapp:async_product_details", kwargs={"pk": self.products[1].pk}))
+
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_acached_compute_shares_entries(self):
+        async def compute():
+            return [product.pk async for product in Product.objects.order_by("pk")]
+
+        key = "async_products:v1"
+        value = async_to_sync(acached_compute)(key, compute)
+
+        self.assertEqual(value, [product.pk for product in self.products])
+        self.assertEqual(cached_compute(key, lambda: self.fail("recomputed")), value)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    THUMBNAIL_WIDTHS=(100, 200, 400),
+)
+class ThumbnailTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="nick_test", password="Qwerty123!")
+        cls.product = Product.objects.create(name="Camera", price=100, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def image_file(name="photo.jpg", size=(300, 150), color="red"):
+        buffer = BytesIO()
+        Image.new("RGB", size, color).save(buffer, format="JPEG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+    def save_image(self, **kwargs) -> ProductImage:
+        return ProductImage.objects.create(product=self.product, image=self.image_file(**kwargs))
+
+    def render_image(self, file) -> str:
+        template = Template("{% load thumbnails %}{% responsive_image file sizes='50vw' alt='Photo' %}")
+        return template.render(Context({"file": file}))
+
+    def test_generate_thumbnails(self):
+        name = self.save_image().image.name
+        variants = generate_thumbnails(name)
+
+        # 400 шире оригинала: вместо неё копия в ширину оригинала
+        self.assertEqual(list(variants), [100, 200, 300])
+        directory, filename = name.rsplit("/", 1)
+        for width, variant in variants.items():
+            self.assertTrue(variant.startswith(f"{directory}/thumbs/{filename.split('.')[0]}."))
+            with default_storage.open(variant) as file, Image.open(file) as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(image.size, (width, width // 2))
+
+        self.assertEqual(get_manifest(name), variants)
+        cache.clear()
+        self.assertEqual(generate_thumbnails(name), variants)
+
+    def test_new_content_gets_new_thumbnails(self):
+        name = self.save_image().image.name
+        variants = generate_thumbnails(name)
+
+        default_storage.delete(name)
+        self.assertEqual(default_storage.save(name, self.image_file(color="blue")), name)
+        new_variants = generate_thumbnails(name)
+
+        self.assertEqual(list(new_variants), list(variants))
+        self.assertFalse(set(new_variants.values()) & set(variants.values()))
+
+    def test_lazy_thumbnails(self):
+        image = self.save_image().image
+        lazy_url = reverse("shopapp:product_thumbnail", kwargs={"width": 200, "name": image.name})
+        self.assertIn(f"{lazy_url} 200w", self.render_image(image))
+
+        response = self.client.get(lazy_url)
+
+        variants = get_manifest(image.name)
+        self.assertRedirects(response, default_storage.url(variants[200]), fetch_redirect_response=False)
+        html = self.render_image(image)
+        self.assertIn(f'src="{default_storage.url(variants[300])}"', html)
+        self.assertIn(f"{default_storage.url(variants[100])} 100w", html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn('alt="Photo"', html)
+
+    def test_thumbnail_view_rejects_other_files(self):
+        name = self.save_image().image.name
+        default_storage.save("products/notes.jpg", SimpleUploadedFile("notes.jpg", b"not an image"))
+        default_storage.save("orders/receipts/receipt.jpg", self.image_file())
+
+        for width, path in [
+            (150, name),
+            (200, "orders/receipts/receipt.jpg"),
+            (200, f"products/product_{self.product.pk}/images/../images/photo.jpg"),
+            (200, f"products/product_{self.product.pk}/images/thumbs/photo.jpg"),
+            (200, "products/missing.jpg"),
+            (200, "products/notes.jpg"),
+        ]:
+            with self.subTest(path=path, width=width):
+                response = self.client.get(reverse("shopapp:product_thumbnail", kwargs={"width": width, "name": path}))
+                self.assertEqual(response.status_code, 404)
+
+    def test_upload_generates_thumbnails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("shopapp:product_update", kwargs={"pk": self.product.pk}),
+                {
+                    "name": "Camera",
+                    "price": "100",
+                    "description": "",
+                    "discount": "0",
+                    "preview": self.image_file("preview.jpg"),
+                    "images": [self.image_file("front.jpg"), self.image_file("back.jpg")],
+                },
+            )
+        self.assertEqual(response.status_code, 302)
+
+        self.product.refresh_from_db()
+        names = [self.product.preview.name, *(image.image.name for image in self.product.images.all())]
+        self.assertEqual(len(names), 3)
+        for name in names:
+            self.assertIsNotNone(get_manifest(name), name)
+
+        response = self.client.get(reverse("shopapp:product_details", kwargs={"pk": self.product.pk}))
+        self.assertContains(response, default_storage.url(get_manifest(names[1])[100]))
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ProductImageIngestTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="nick_test", password="Qwerty123!")
+        cls.product = Product.objects.create(name="Camera", price=100, created_by=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def image_file(name="photo.jpg", image_format="JPEG", color="red", **options):
+        buffer = BytesIO()
+        Image.new("RGB", (300, 150), color).save(buffer, format=image_format, **options)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def upload(self, *images):
+        return self.client.post(
+            reverse("shopapp:product_update", kwargs={"pk": self.product.pk}),
+            {"name": "Camera", "price": "100", "description": "", "discount": "0", "images": list(images)},
+        )
+
+    def test_exif_is_applied_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90°
+        exif[0x010F] = "PhoneMaker"  # Make
+
+        file = normalize_image(self.image_file("photo.jpeg", exif=exif.tobytes()))
+
+        self.assertEqual(file.name, "photo.jpg")
+        with Image.open(file) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (150, 300))
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_upload_creates_images_with_one_insert(self):
+        uploads = [self.image_file(f"photo-{index}.png", "PNG", color=(index, 0, 0)) for index in range(5)]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.upload(*uploads)
+
+        self.assertEqual(response.status_code, 302)
+        inserts = [query["sql"] for query in context.captured_queries if 'INSERT INTO "shopapp_productimage"' in query["sql"]]
+        self.assertEqual(len(inserts), 1)
+        names = set(self.product.images.values_list("image", flat=True))
+        self.assertEqual(len(names), 5)
+        for name in names:
+            self.assertRegex(name, r"^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+            self.assertTrue(default_storage.exists(name))
+        self.assertEqual(dict(MediaBlob.objects.values_list("name", "references")), dict.fromkeys(names, 1))
+
+    def test_invalid_files_are_rejected(self):
+        response = self.upload(
+            self.image_file("good.jpg"),
+            SimpleUploadedFile("notes.jpg", b"not an image"),
+            self.image_file("animation.gif", "GIF"),
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "notes.jpg: upload a valid JPEG, PNG or WebP image.")
+        self.assertContains(response, "animation.gif: upload a valid JPEG, PNG or WebP image.")
+        self.assertFalse(self.product.images.exists())
+
+    def test_files_are_processed_in_parallel(self):
+        # Без пула потоков первый вызов ждал бы остальных до таймаута барьера
+        barrier = threading.Barrier(3, timeout=5)
+
+        def wait(item):
+            barrier.wait()
+            return item
+
+        self.assertEqual(map_in_threads(wait, [1, 2, 3]), [1, 2, 3])
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ContentAddressedStorageTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.product = Product.objects.create(name="Camera", price=100, created_by=cls.user)
+        cls.other = Product.objects.create(name="Lens", price=50, created_by=cls.user)
+
+    @staticmethod
+    def image_file(name="photo.jpg", color="red"):
+        buffer = BytesIO()
+        Image.new("RGB", (300, 150), color).save(buffer, format="JPEG")
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def references(self, file) -> int:
+        return MediaBlob.objects.get(name=file.name).references
+
+    def test_identical_files_share_one_blob(self):
+        first = ProductImage.objects.create(product=self.product, image=self.image_file("front.jpg"))
+        second = ProductImage.objects.create(product=self.other, image=self.image_file("copy.JPG"))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r"^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(first.image.url, f"/media/{first.image.name}")
+        self.assertEqual(self.references(first.image), 2)
+        self.assertEqual(os.listdir(os.path.dirname(first.image.path)), [os.path.basename(first.image.path)])
+
+    def test_references_follow_rows(self):
+        image = ProductImage.objects.create(product=self.product, image=self.image_file(color="red"))
+        self.product.preview = self.image_file("preview.jpg", color="red")
+        self.product.save()
+        red = image.image
+        self.assertEqual(self.references(red), 2)
+
+        self.product.preview = self.image_file("preview.jpg", color="blue")
+        self.product.save()
+        blue = self.product.preview
+        self.assertEqual((self.references(red), self.references(blue)), (1, 1))
+
+        image.delete()
+        ProductImage.objects.create(product=self.other, image=self.image_file(color="blue"))
+        self.assertEqual((self.references(red), self.references(blue)), (0, 2))
+
+        # Каскадное удаление тоже уменьшает счётчик, а файл остаётся до gc_media
+        self.other.delete()
+        self.assertEqual(self.references(blue), 1)
+        self.assertTrue(os.path.exists(red.path))
+
+    def test_gc_media(self):
+        kept = ProductImage.objects.create(product=self.product, image=self.image_file(color="red")).image
+        orphan_image = ProductImage.objects.create(product=self.product, image=self.image_file(color="blue"))
+        orphan = orphan_image.image
+        thumbnails = list(generate_thumbnails(orphan.name).values())
+        orphan_image.delete()
+        recent_image = ProductImage.objects.create(product=self.product, image=self.image_file(color="green"))
+        recent = recent_image.image
+        recent_image.delete()
+
+        # Давно не менявшиеся файлы; счётчик kept испорчен (как после update() в обход сигналов)
+        old = timezone.now() - timedelta(days=2)
+        for file in (kept, orphan):
+            os.utime(file.path, (old.timestamp(), old.timestamp()))
+        MediaBlob.objects.filter(name__in=[kept.name, orphan.name]).update(updated_at=old)
+        MediaBlob.objects.filter(name=kept.name).update(references=0)
+
+        out = StringIO()
+        call_command("gc_media", "--dry-run", stdout=out)
+        self.assertIn("Would delete 1 unreferenced blob(s)", out.getvalue())
+        self.assertTrue(os.path.exists(orphan.path))
+
+        call_command("gc_media", stdout=StringIO())
+
+        self.assertFalse(os.path.exists(orphan.path))
+        for name in thumbnails:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=orphan.name).exists())
+        self.assertTrue(os.path.exists(kept.path))
+        self.assertEqual(self.references(kept), 1)
+        self.assertTrue(os.path.exists(recent.path))
+
+    def test_blob_view(self):
+        image = ProductImage.objects.create(product=self.product, image=self.image_file()).image
+
+        response = self.client.get(image.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        with image.open("rb") as file:
+            self.assertEqual(b"".join(response.streaming_content), file.read())
+        response.close()
+
+        for url in ("/media/blobs/tmp/upload", "/media/blobs/00/missing.jpg"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    AVATAR_SIZES=(32, 64),
+)
+class AvatarProcessingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.profile = Profile.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def image_file(color="red"):
+        buffer = BytesIO()
+        Image.new("RGB", (300, 200), color).save(buffer, format="JPEG")
+        return SimpleUploadedFile("avatar.jpg", buffer.getvalue())
+
+    def upload(self, avatar):
+        return self.client.post(reverse("myauth:avatar-update"), {"avatar": avatar})
+
+    def last_job(self) -> BackgroundJob:
+        return BackgroundJob.objects.filter(kind=BackgroundJob.Kind.AVATAR_PROCESS).latest("pk")
+
+    def test_upload_is_processed_in_background(self):
+        response = self.upload(self.image_file())
+
+        self.assertRedirects(response, reverse("myauth:about-me"), fetch_redirect_response=False)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_variants, {})
+        job = self.last_job()
+        self.assertEqual(job.params, {"profile": self.profile.pk, "avatar": self.profile.avatar.name})
+
+        self.assertEqual(run_job(job.pk), BackgroundJob.Status.DONE)
+
+        self.profile.refresh_from_db()
+        variants = self.profile.avatar_variants
+        self.assertEqual(sorted(variants), ["32", "64"])
+        for size, name in variants.items():
+            with default_storage.open(name) as file, Image.open(file) as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(image.size, (int(size), int(size)))
+            self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+        self.assertTrue(set(variants.values()) <= set(count_references()))
+
+        response = self.client.get(reverse("myauth:user-profile", kwargs={"pk": self.user.pk}))
+        self.assertContains(response, f'src="{default_storage.url(variants["64"])}"')
+        self.assertNotContains(response, self.profile.avatar.url)
+
+    def test_new_upload_replaces_variants(self):
+        self.upload(self.image_file("red"))
+        run_job(self.last_job().pk)
+        self.profile.refresh_from_db()
+        old_variants = self.profile.avatar_variants
+
+        self.upload(self.image_file("blue"))
+        superseded = self.last_job()
+        self.upload(self.image_file("green"))
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_variants, {})
+        for name in old_variants.values():
+            self.assertEqual(MediaBlob.objects.get(name=name).references, 0)
+
+        run_job(superseded.pk)
+        superseded.refresh_from_db()
+        self.assertTrue(superseded.result["superseded"])
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_variants, {})
+
+        run_job(self.last_job().pk)
+        self.profile.refresh_from_db()
+        self.assertEqual(sorted(self.profile.avatar_variants), ["32", "64"])
+
+    def test_commit_false_defers_side_effects(self):
+        self.upload(self.image_file("red"))
+        run_job(self.last_job().pk)
+        self.profile.refresh_from_db()
+        old_variants = self.profile.avatar_variants
+        jobs = BackgroundJob.objects.count()
+
+        form = ProfileAvatarForm(instance=self.profile, files={"avatar": self.image_file("blue")})
+        self.assertTrue(form.is_valid())
+        profile = form.save(commit=False)
+
+        self.assertEqual(BackgroundJob.objects.count(), jobs)
+        for name in old_variants.values():
+            self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+
+        profile.save()
+        form.save_m2m()
+
+        self.assertEqual(BackgroundJob.objects.count(), jobs + 1)
+        self.assertEqual(self.last_job().params["avatar"], profile.avatar.name)
+        for name in old_variants.values():
+            self.assertEqual(MediaBlob.objects.get(name=name).references, 0)
+
+    @override_settings(AVATAR_MAX_UPLOAD_SIZE=100)
+    def test_large_upload_is_rejected(self):
+        response = self.upload(self.image_file())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "The avatar must be at most")
+        self.assertFalse(BackgroundJob.objects.filter(kind=BackgroundJob.Kind.AVATAR_PROCESS).exists())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CardFragmentCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="nick_test", password="Qwerty123!")
+        cls.products = [
+            Product.objects.create(name=f"Product {index}", price=10 + index, created_by=cls.user)
+            for index in range(3)
+        ]
+        cls.order = Order.objects.create(user=cls.user, delivery_address="Main st")
+        cls.order.products.add(*cls.products[:2])
+
+    def setUp(self):
+        cache.clear()
+        CACHE_STATS.clear()
+        self.client.force_login(self.user)
+
+    def get(self, name):
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_second_request_renders_no_cards(self):
+        self.get("shopapp:products_list")
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 3})
+
+        with self.assertNumQueries(3):
+            response = self.get("shopapp:products_list")
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 3, "hit": 3})
+        for product in self.products:
+            self.assertContains(response, product.name)
+
+    def test_cached_order_cards_skip_products_prefetch(self):
+        first = self.get("shopapp:orders_list")
+        with self.assertNumQueries(3):
+            second = self.get("shopapp:orders_list")
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, "Product 1 for $11")
+
+    def test_save_invalidates_only_saved_product(self):
+        self.get("shopapp:products_list")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].name = "Renamed"
+            self.products[0].save()
+
+        response = self.get("shopapp:products_list")
+        self.assertContains(response, "Renamed")
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 4, "hit": 2})
+
+    def test_products_change_invalidates_order_card(self):
+        self.get("shopapp:orders_list")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.products.add(self.products[2])
+
+        response = self.get("shopapp:orders_list")
+        self.assertContains(response, "Product 2 for $12")
+        self.assertEqual(get_cache_stats()["order_card"], {"miss": 2})
+
+    def test_product_changes_invalidate_only_its_orders(self):
+        other = Order.objects.create(user=self.user, delivery_address="Side st")
+        other.products.add(self.products[2])
+        self.get("shopapp:orders_list")
+
+        def change(action, order_card_stats, text=None):
+            with self.captureOnCommitCallbacks(execute=True):
+                action()
+            response = self.get("shopapp:orders_list")
+            self.assertEqual(get_cache_stats()["order_card"], order_card_stats)
+            if text is not None:
+                self.assertContains(response, text)
+
+        def rename():
+            self.products[0].name = "Renamed"
+            self.products[0].save()
+
+        def reprice():
+            self.products[2].price = 20
+            self.products[2].save()
+
+        change(rename, {"miss": 3, "hit": 1}, "Renamed for $10")
+        change(reprice, {"miss": 4, "hit": 2}, "Product 2 for $20")
+        change(self.products[1].orders.clear, {"miss": 5, "hit": 3})
+        change(self.products[2].delete, {"miss": 6, "hit": 4})
+        change(lambda: call_command("rebuild_order_totals", stdout=StringIO()), {"miss": 8, "hit": 4})
+
+    def test_admin_archive_invalidates_product_card(self):
+        self.get("shopapp:products_list")
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.filter(pk=self.products[0].pk))
+            Product.objects.filter(pk=self.products[0].pk).update(archived=False)
+
+        self.get("shopapp:products_list")
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 4, "hit": 2})
+
+    def test_missed_cards_are_rendered_from_primary(self):
+        # Реплика отстаёт: объект из неё прочитан до переименования
+        stale = Product.objects.get(pk=self.products[0].pk)
+        stale._state.db = "replica"
+        Product.objects.filter(pk=stale.pk).update(name="Renamed")
+
+        with self.assertNumQueries(1):
+            card = render_product_cards([stale])[0]
+        self.assertIn("Renamed", card)
+        self.assertEqual(render_product_cards([self.products[0]]), [card])
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 1, "hit": 1})
+
+    def test_card_of_object_deleted_on_primary_is_not_cached(self):
+        stale = Product.objects.get(pk=self.products[0].pk)
+        stale._state.db = "replica"
+        Product.objects.filter(pk=stale.pk).delete()
+
+        self.assertIn(stale.name, render_product_cards([stale])[0])
+        render_product_cards([stale])
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 2})
+
+    def test_card_without_thumbnails_is_not_cached(self):
+        Product.objects.filter(pk=self.products[0].pk).update(preview="blobs/ab/missing.jpg")
+        self.get("shopapp:products_list")
+        self.get("shopapp:products_list")
+        self.assertEqual(get_cache_stats()["product_card"], {"miss": 4, "hit": 2})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BackgroundJobTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.other = User.objects.create_user(username="other_test", password="Qwerty123!")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_upload_csv_is_queued_and_processed(self):
+        file = BytesIO(
+            f"name,description,price,discount,created_by\n"
+            f"Laptop,Notebook,999.90,10,{self.user.pk}\n"
+            f"Bad,,1,0,\n".encode("utf-8")
+        )
+        file.name = "products.csv"
+
+        response = self.client.post(reverse("shopapp:product-upload-csv"), {"file": file})
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["pk"]
+        self.assertTrue(response["Location"].endswith(reverse("shopapp:backgroundjob-detail", kwargs={"pk": job_id})))
+        self.assertEqual(response.json()["status"], BackgroundJob.Status.PENDING)
+        self.assertFalse(Product.objects.exists())
+
+        self.assertEqual(claim_next_job(), job_id)
+        self.assertEqual(run_job(job_id), BackgroundJob.Status.DONE)
+
+        status = self.client.get(reverse("shopapp:backgroundjob-detail", kwargs={"pk": job_id})).json()
+        self.assertEqual(status["rows_processed"], 2)
+        self.assertEqual(status["result"], {"created": 1, "failed": 1})
+        self.assertEqual(status["errors"][0]["line"], 3)
+        self.assertEqual(Product.objects.get().name, "Laptop")
+
+        # Загруженный файл удаляется, как только задача выполнена
+        job = BackgroundJob.objects.get(pk=job_id)
+        self.assertFalse(job.source_file)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, "jobs", "sources")), [])
+
+    def test_anonymous_cannot_enqueue_jobs(self):
+        self.client.logout()
+        file = SimpleUploadedFile("products.csv", b"name,description,price,discount,created_by\n")
+
+        self.assertEqual(self.client.post(reverse("shopapp:product-upload-csv"), {"file": file}).status_code, 403)
+        self.assertEqual(self.client.post(reverse("shopapp:product-export-csv")).status_code, 403)
+        self.assertFalse(BackgroundJob.objects.exists())
+
+    def test_stale_import_is_failed_not_requeued(self):
+        job_import = enqueue_job(
+            BackgroundJob.Kind.PRODUCTS_IMPORT,
+            user=self.user,
+            source_file=SimpleUploadedFile("products.csv", b"name,description,price,discount,created_by\n"),
+        )
+        job_export = BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_EXPORT, created_by=self.user)
+        BackgroundJob.objects.update(
+            status=BackgroundJob.Status.RUNNING,
+            rows_processed=500,
+            updated_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(fail_stale_imports(), 1)
+
+        job_export.refresh_from_db()
+        self.assertEqual(job_export.status, BackgroundJob.Status.PENDING)
+        # Импорт не перезапускается с первой строки: уже сохранённые 500 строк задвоились бы
+        job_import.refresh_from_db()
+        self.assertEqual(job_import.status, BackgroundJob.Status.FAILED)
+        self.assertIn("500 row(s)", job_import.errors[-1]["error"])
+        self.assertIsNotNone(job_import.finished_at)
+        self.assertFalse(job_import.source_file)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, "jobs", "sources")), [])
+        self.assertEqual(claim_next_job(), job_export.pk)
+        self.assertIsNone(claim_next_job())
+
+    def test_expired_job_files_are_deleted(self):
+        Product.objects.create(name="Laptop", price=10, created_by=self.user)
+        old, recent = [
+            BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_EXPORT, created_by=self.user)
+            for _ in range(2)
+        ]
+        for job in (old, recent):
+            run_job(job.pk)
+        BackgroundJob.objects.filter(pk=old.pk).update(finished_at=timezone.now() - timedelta(days=8))
+        old_path = BackgroundJob.objects.get(pk=old.pk).result_file.path
+
+        self.assertEqual(delete_expired_job_files(), 1)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(BackgroundJob.objects.get(pk=old.pk).result_file)
+        self.assertTrue(BackgroundJob.objects.get(pk=recent.pk).result_file)
+        self.assertEqual(delete_expired_job_files(), 0)
+
+    def test_export_csv_writes_result_file(self):
+        Product.objects.create(name="Laptop", price=10, created_by=self.user)
+
+        response = self.client.post(reverse("shopapp:product-export-csv"))
+        self.assertEqual(response.status_code, 202)
+
+        job_id = claim_next_job()
+        run_job(job_id)
+
+        job = BackgroundJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, BackgroundJob.Status.DONE)
+        with job.result_file.open("rb") as result_file:
+            content = gzip.decompress(result_file.read()).decode("utf-8")
+        self.assertEqual(content.splitlines()[1], f"Laptop,,10.00,0,{self.user.pk}")
+
+    def test_failed_job_keeps_error(self):
+        job = BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_IMPORT, created_by=self.user)
+
+        self.assertEqual(run_job(job.pk), BackgroundJob.Status.FAILED)
+        job.refresh_from_db()
+        self.assertTrue(job.errors)
+
+    def test_jobs_of_other_users_are_hidden(self):
+        job = BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_EXPORT, created_by=self.other)
+
+        response = self.client.get(reverse("shopapp:backgroundjob-detail", kwargs={"pk": job.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        BackgroundJob.objects.create(kind=BackgroundJob.Kind.PRODUCTS_EXPORT)
+
+        self.assertIsNotNone(claim_next_job())
+        self.assertIsNone(claim_next_job())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class VersionedExportCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        cls.product = Product.objects.create(name="Laptop", price=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get_export_names(self):
+        response = self.client.get(reverse("shopapp:products_export"))
+        return [product["name"] for product in response.json()["products"]]
+
+    def test_products_export_follows_saves(self):
+        self.assertEqual(self.get_export_names(), ["Laptop"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Desk", created_by=self.user)
+
+        self.assertEqual(self.get_export_names(), ["Laptop", "Desk"])
+
+    def test_products_export_is_served_from_cache(self):
+        self.get_export_names()
+        with self.assertNumQueries(0):
+            self.client.get(reverse("shopapp:products_export"))
+
+    def test_admin_archive_action_invalidates_export(self):
+        self.get_export_names()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.all())
+
+        response = self.client.get(reverse("shopapp:products_export"))
+        self.assertTrue(response.json()["products"][0]["archived"])
+
+    def test_user_orders_export_follows_m2m_changes(self):
+        url = reverse("shopapp:user_orders_export", kwargs={"pk": self.user.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user, delivery_address="123 Main st")
+        self.assertEqual(self.client.get(url).json()["orders"][0]["products"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.add(self.product)
+        self.assertEqual(self.client.get(url).json()["orders"][0]["products"], [self.product.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.orders.remove(order)
+        self.assertEqual(self.client.get(url).json()["orders"][0]["products"], [])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CachedComputeTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        CACHE_STATS.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_computed_once(self):
+        self.assertEqual(cached_compute("test:key", self.compute), 1)
+        self.assertEqual(cached_compute("test:key", self.compute), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(get_cache_stats()["test"], {"miss": 1, "recompute": 1, "hit": 1})
+
+    def test_expired_value_is_served_while_other_worker_recomputes(self):
+        cache.set("test:key", ("old", 0.1, time.time() - 1), 60)
+        cache.add("test:key:lock", 12345, 30)
+
+        self.assertEqual(cached_compute("test:key", self.compute), "old")
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(get_cache_stats()["test"], {"stale": 1})
+
+    def test_expired_value_is_recomputed_by_lock_holder(self):
+        cache.set("test:key", ("old", 0.1, time.time() - 1), 60)
+
+        self.assertEqual(cached_compute("test:key", self.compute), 1)
+        self.assertIsNone(cache.get("test:key:lock"))
+        self.assertEqual(get_cache_stats()["test"], {"early_recompute": 1, "recompute": 1})
+
+    def test_lock_is_released_when_compute_fails(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            cached_compute("test:key", fail)
+        self.assertIsNone(cache.get("test:key:lock"))
+
+    def test_lock_taken_by_other_worker_after_timeout_is_kept(self):
+        def slow_compute():
+            # Пересчёт пережил RECOMPUTE_LOCK_TIMEOUT, и блокировку взял другой воркер
+            cache.set("test:key:lock", 12345, 30)
+            return "value"
+
+        self.assertEqual(cached_compute("test:key", slow_compute), "value")
+        self.assertEqual(cache.get("test:key:lock"), 12345)
+
+    @mock.patch("shopapp.caching.RECOMPUTE_WAIT_TIMEOUT", 0)
+    def test_lock_of_other_worker_is_kept_when_wait_times_out(self):
+        cache.add("test:key:lock", 12345, 30)
+
+        self.assertEqual(cached_compute("test:key", self.compute), 1)
+        self.assertEqual(cache.get("test:key:lock"), 12345)
+        self.assertIsNone(cache.get("test:key"))
+        self.assertEqual(get_cache_stats()["test"], {"miss": 1, "unlocked_compute": 1})
+
+    @override_settings(ALLOWED_HOSTS=["shop.example.com", "api.example.com"])
+    def test_products_api_list_is_cached_per_host(self):
+        user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        for index in range(2):
+            Product.objects.create(name=f"Product {index}", created_by=user)
+        url = reverse("shopapp:product-list") + "?page_size=1"
+
+        first = self.client.get(url, HTTP_HOST="shop.example.com").json()
+        second = self.client.get(url, HTTP_HOST="api.example.com", secure=True).json()
+
+        self.assertTrue(first["next"].startswith("http://shop.example.com/"))
+        self.assertTrue(second["next"].startswith("https://api.example.com/"))
+
+    def test_products_api_list_is_cached_until_products_change(self):
+        user = User.objects.create_user(username="nick_test", password="Qwerty123!")
+        url = reverse("shopapp:product-list")
+
+        self.assertEqual(self.client.get(url).json()["results"], [])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Laptop", created_by=user)
+        self.assertEqual(len(self.client.get(url).json()["results"]), 1)
+
+
+def _set_in_other_process(backend_class, location, key, value):
+    backend_class(location, {}).set(key, value)
+
+
+class SQLiteCacheTestCase(TestCase):
+    def setUp(self):
+        self.location = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        self.cache = SQLiteCache(self.location, {"OPTIONS": {"MAX_ENTRIES": 10, "CULL_FREQUENCY": 2}})
+
+    def test_get_many_and_set_many(self):
+        self.cache.set_many({"first": 1, "second": [2]})
+
+        self.assertEqual(self.cache.get_many(["first", "second", "missing"]), {"first": 1, "second": [2]})
+        self.assertEqual(self.cache.get("missing", "default"), "default")
+
+    def test_expired_entry_is_not_returned(self):
+        self.cache.set("key", "value", timeout=-1)
+
+        self.assertIsNone(self.cache.get("key"))
+        self.assertFalse(self.cache.has_key("key"))
+        self.assertTrue(self.cache.add("key", "new"))
+        self.assertEqual(self.cache.get("key"), "new")
+
+    def test_add_does_not_overwrite_live_entry(self):
+        self.assertTrue(self.cache.add("lock", 1))
+        self.assertFalse(self.cache.add("lock", 2))
+        self.assertEqual(self.cache.get("lock"), 1)
+
+    def test_incr_touch_delete_clear(self):
+        self.cache.set("counter", 1)
+        self.assertEqual(self.cache.incr("counter", 2), 3)
+        self.assertTrue(self.cache.touch("counter", None))
+        self.assertTrue(self.cache.delete("counter"))
+        self.assertFalse(self.cache.delete("counter"))
+        with self.assertRaises(ValueError):
+            self.cache.incr("counter")
+
+        self.cache.set("key", "value")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_least_recently_used_entries_are_culled(self):
+        for index in range(10):
+            self.cache.set(f"key-{index}", index)
+        connection = self.cache._connection()
+        connection.execute("UPDATE cache_entries SET accessed = accessed - 1000")
+        connection.execute("UPDATE cache_entries SET accessed = ? WHERE key LIKE '%key-0'", [time.time()])
+
+        self.cache.set("key-10", 10)
+
+        self.assertEqual(self.cache.get("key-0"), 0)
+        self.assertEqual(self.cache.get("key-10"), 10)
+        self.assertLessEqual(connection.execute("SELECT entries FROM cache_size").fetchone()[0], 10)
+        self.assertEqual(
+            connection.execute("SELECT entries FROM cache_size").fetchone()[0],
+            connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0],
+        )
+
+
+class TieredCacheTestMixin:
+    backend_class = None
+
+    def get_location(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.location = self.get_location()
+        self.cache = self.backend_class(self.location, {"OPTIONS": {"L1_MAX_BYTES": 4096}})
+
+    def test_second_read_is_served_from_memory(self):
+        self.cache.set("key", {"value": 1})
+        self.cache._l1.clear()
+
+        self.assertEqual(self.cache.get("key"), {"value": 1})
+        self.assertEqual(self.cache.get("key"), {"value": 1})
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["l2_hits"], stats["l1_hits"]), (1, 1))
+
+    def test_returned_value_is_a_copy(self):
+        self.cache.set("key", [1])
+        self.cache.get("key").append(2)
+        self.assertEqual(self.cache.get("key"), [1])
+
+    def test_write_from_other_process_invalidates_memory(self):
+        self.cache.set("key", "old")
+        self.assertEqual(self.cache.get("key"), "old")
+
+        process = multiprocessing.get_context("fork").Process(
+            target=_set_in_other_process, args=(self.backend_class, self.location, "key", "new"),
+        )
+        process.start()
+        process.join()
+
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.cache.get("key"), "new")
+        self.assertEqual(self.cache.get_many(["key"]), {"key": "new"})
+
+    def test_delete_and_clear_invalidate_memory(self):
+        self.cache.set("first", 1)
+        self.cache.set("second", 2)
+
+        self.cache.delete("first")
+        self.assertIsNone(self.cache.get("first"))
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("second"))
+
+    def test_incr_and_add(self):
+        self.cache.set("counter", 1)
+        self.assertEqual(self.cache.incr("counter"), 2)
+        self.assertEqual(self.cache.get("counter"), 2)
+
+        self.assertTrue(self.cache.add("lock", 1))
+        self.assertFalse(self.cache.add("lock", 2))
+        self.assertEqual(self.cache.get("lock"), 1)
+
+    def test_memory_tier_is_bounded_by_size(self):
+        for index in range(10):
+            self.cache.set(f"key-{index}", "x" * 500)
+
+        self.assertLessEqual(self.cache.get_stats()["l1_bytes"], 4096)
+        self.assertEqual(self.cache.get("key-0"), "x" * 500)
+
+
+class TieredSQLiteCacheTestCase(TieredCacheTestMixin, TestCase):
+    backend_class = TieredSQLiteCache
+
+    def get_location(self):
+        return os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+
+
+class TieredFileBasedCacheTestCase(TieredCacheTestMixin, TestCase):
+    backend_class = TieredFileBasedCache
+
+    def get_location(self):
+        return tempfile.mkdtemp()
@@ -0,0 +1,172 @@
+"""
+Уменьшенные копии изображений товаров для srcset.
+
+Для каждого исходного файла (Product.preview, ProductImage.image) создаются копии
+шириной из settings.THUMBNAIL_WIDTHS в WebP (или JPEG, если Pillow собран без WebP).
+Копии лежат рядом с оригиналом в подкаталоге thumbs/, в их имени есть хеш содержимого
+оригинала: другой файл под тем же именем получит новые URL, и браузер не покажет
+старую копию из своего кеша.
+
+Копии создаются сразу после загрузки через форму товара или при первом запросе
+через ThumbnailView. Список готовых копий (manifest) хранится в кеше, и тег
+{% responsive_image %} строит по нему srcset, не обращаясь к файлам.
+"""
+
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
+from PIL import Image, ImageOps, features
+
+from .images import map_in_threads
+from .storage import THUMBNAILS_DIR, is_blob_name
+
+log = logging.getLogger(__name__)
+
+# Каталог загрузок по старым именам (до ContentAddressedStorage), копии которого можно запрашивать через ThumbnailView
+THUMBNAIL_SOURCES_DIR = "products"
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def thumbnail_widths() -> list[int]:
+    return sorted(settings.THUMBNAIL_WIDTHS)
+
+
+def thumbnail_format() -> tuple[str, str]:
+    """
+    Формат Pillow и расширение файла копий.
+    """
+    if features.check("webp"):
+        return "WEBP", "webp"
+    return "JPEG", "jpg"
+
+
+def is_thumbnail_source(name: str) -> bool:
+    parts = name.split("/")
+    return (
+        len(parts) > 1
+        and (parts[0] == THUMBNAIL_SOURCES_DIR or is_blob_name(name))
+        and THUMBNAILS_DIR not in parts
+        and not {"", ".", ".."} & set(parts)
+    )
+
+
+def thumbnail_name(name: str, digest: str, width: int, extension: str) -> str:
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, THUMBNAILS_DIR, f"{stem}.{digest}.{width}w.{extension}")
+
+
+def _manifest_key(name: str) -> str:
+    # Имя файла может содержать пробелы и не-ASCII символы, недопустимые в ключах кеша
+    return f"thumbnails:{hashlib.md5(name.encode('utf-8')).hexdigest()}"
+
+
+def get_manifest(name: str) -> dict | None:
+    """
+    Копии файла {ширина: имя} или None, если их ещё нет.
+    """
+    return cache.get(_manifest_key(name))
+
+
+def content_hash(file) -> str:
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    return sha256.hexdigest()[:16]
+
+
+def resize(image: Image.Image, width: int, image_format: str) -> bytes:
+    height = max(1, round(image.height * width / image.width))
+    resized = image.resize((width, height), Image.Resampling.LANCZOS) if width != image.width else image
+
+    has_alpha = resized.mode in ("RGBA", "LA", "PA") or "transparency" in resized.info
+    mode = "RGBA" if has_alpha and image_format != "JPEG" else "RGB"
+    if resized.mode != mode:
+        resized = resized.convert(mode)
+
+    buffer = BytesIO()
+    resized.save(buffer, format=image_format, quality=settings.THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def generate_thumbnails(name: str) -> dict:
+    """
+    Создаёт недостающие копии файла name, запоминает и возвращает их список, как get_manifest.
+
+    Копии не бывают шире оригинала: ширины больше него дают одну копию в ширину оригинала.
+    """
+    image_format, extension = thumbnail_format()
+
+    with default_storage.open(name, "rb") as source:
+        digest = content_hash(source)
+        source.seek(0)
+        with Image.open(source) as original:
+            # JPEG можно сразу декодировать в уменьшенном масштабе, но не меньше самой широкой копии
+            largest = thumbnail_widths()[-1]
+            if min(original.size) > largest:
+                original.draft(None, (largest, largest))
+            # Телефоны сохраняют снимок повёрнутым и указывают поворот в EXIF
+            image = ImageOps.exif_transpose(original)
+
+    variants = {}
+    for width in sorted({min(width, image.width) for width in thumbnail_widths()}):
+        variant = thumbnail_name(name, digest, width, extension)
+        if not default_storage.exists(variant):
+            # Если копию одновременно создаёт другой процесс, хранилище выберет свободное имя
+            variant = default_storage.save(variant, ContentFile(resize(image, width, image_format)))
+        variants[width] = variant
+
+    cache.set(_manifest_key(name), variants, timeout=None)
+    return variants
+
+
+def generate_thumbnails_on_commit(*names: str):
+    """
+    Создаёт копии только что загруженных файлов после фиксации транзакции, параллельно.
+
+    Ошибка не отменяет загрузку: копии будут созданы при первом запросе.
+    """
+    if not names:
+        return
+
+    def generate(name):
+        try:
+            generate_thumbnails(name)
+        except Exception:
+            log.exception("Failed to generate thumbnails for %s", name)
+
+    transaction.on_commit(lambda: map_in_threads(generate, names))
+
+
+def variant_for(variants: dict, width: int) -> str:
+    """
+    Копия для запрошенной ширины: самая узкая не уже её или самая широкая из имеющихся.
+    """
+    return variants[min((w for w in variants if w >= width), default=max(variants))]
+
+
+def thumbnail_srcset(name: str) -> tuple[str, str]:
+    """
+    src (самая широкая копия) и srcset изображения.
+
+    Пока копий нет, адреса ведут в ThumbnailView, который создаст их при первом запросе.
+    """
+    variants = get_manifest(name)
+    if variants is None:
+        urls = [
+            (width, reverse("shopapp:product_thumbnail", kwargs={"width": width, "name": name}))
+            for width in thumbnail_widths()
+        ]
+    else:
+        urls = [(width, default_storage.url(variant)) for width, variant in sorted(variants.items())]
+
+    return urls[-1][1], ", ".join(f"{url} {width}w" for width, url in urls)
@@ -0,0 +1,130 @@
+"""
+Материализованные итоги заказа: total_price, discounted_total и products_count.
+
+Раньше сумма заказа считалась на каждом чтении через
+annotate(Sum("products__price")), то есть join с промежуточной таблицей.
+Теперь итоги хранятся в самой строке Order и меняются на разницу при каждом
+изменении Order.products (сигналы в shopapp.signals) одним UPDATE с F().
+Импорт CSV заполняет их сразу, а команда rebuild_order_totals пересчитывает
+всё заново после правок в обход ORM.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db.models import F
+
+from .models import Order, Product, discounted_price
+
+REBUILD_BATCH_SIZE = 1000
+
+
+@dataclass
+class Totals:
+    total_price: Decimal = Decimal("0.00")
+    discounted_total: Decimal = Decimal("0.00")
+    products_count: int = 0
+
+    def add(self, price, discount):
+        self.total_price += Decimal(price)
+        self.discounted_total += discounted_price(price, discount)
+        self.products_count += 1
+
+    def __neg__(self):
+        return Totals(-self.total_price, -self.discounted_total, -self.products_count)
+
+    def as_update(self) -> dict:
+        """
+        Аргументы для QuerySet.update(), прибавляющие итоги к текущим значениям.
+        """
+        return {
+            "total_price": F("total_price") + self.total_price,
+            "discounted_total": F("discounted_total") + self.discounted_total,
+            "products_count": F("products_count") + self.products_count,
+        }
+
+    def apply_to(self, order):
+        order.total_price = self.total_price
+        order.discounted_total = self.discounted_total
+        order.products_count = self.products_count
+
+
+def totals_for_products(products) -> Totals:
+    totals = Totals()
+    for product in products:
+        totals.add(product.price, product.discount)
+    return totals
+
+
+def add_to_orders(order_ids, totals: Totals) -> int:
+    if not totals.products_count:
+        return 0
+    return Order.objects.filter(pk__in=order_ids).update(**totals.as_update())
+
+
+def products_added(order_id, product_ids):
+    products = Product.objects.filter(pk__in=product_ids).only("price", "discount")
+    add_to_orders([order_id], totals_for_products(products))
+
+
+def products_removed(order_id, product_ids):
+    products = Product.objects.filter(pk__in=product_ids).only("price", "discount")
+    add_to_orders([order_id], -totals_for_products(products))
+
+
+def product_price_changed(product_id, old_price, old_discount, new_price, new_discount) -> int:
+    """
+    Переносит новую цену товара во все заказы, где он есть.
+    """
+    delta = Totals(
+        Decimal(new_price) - Decimal(old_price),
+        discounted_price(new_price, new_discount) - discounted_price(old_price, old_discount),
+        0,
+    )
+    if not delta.total_price and not delta.discounted_total:
+        return 0
+
+    order_ids = Order.products.through.objects.filter(product_id=product_id).values("order_id")
+    return Order.objects.filter(pk__in=order_ids).update(**delta.as_update())
+
+
+def rebuild_order_totals(orders=None, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """
+    Пересчитывает итоги заказов по промежуточной таблице пачками по batch_size.
+
+    Принимает и QuerySet исторической модели, поэтому используется в миграции.
+    Возвращает число обработанных заказов.
+    """
+    if orders is None:
+        orders = Order.objects.all()
+
+    through = orders.model.products.through
+    processed = 0
+    last_pk = 0
+
+    while True:
+        batch = list(
+            orders.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "total_price", "discounted_total", "products_count")[:batch_size]
+        )
+        if not batch:
+            return processed
+
+        totals = defaultdict(Totals)
+        rows = (
+            through.objects
+            .using(orders.db)
+            .filter(order_id__in=[order.pk for order in batch])
+            .values_list("order_id", "product__price", "product__discount")
+        )
+        for order_id, price, discount in rows:
+            totals[order_id].add(price, discount)
+
+        for order in batch:
+            totals[order.pk].apply_to(order)
+
+        orders.model.objects.db_manager(orders.db).bulk_update(batch, ["total_price", "discounted_total", "products_count"])
+        processed += len(batch)
+        last_pk = batch[-1].pk
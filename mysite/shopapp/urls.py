@@ -1,7 +1,16 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import (
+    AsyncLatestProductsFeedView,
+    AsyncOrdersDataExportView,
+    AsyncProductDetailsView,
+    AsyncProductListView,
+    AsyncProductsDataExportView,
+)
 from .views import (
+    BackgroundJobViewSet,
+    CacheStatsView,
     LatestProductsFeed,
     OrderCreateView,
     OrdersDataExportView,
@@ -17,7 +26,9 @@ from .views import (
     ProductListView,
     ProductUpdateView,
     ProductViewSet,
+    SalesReportViewSet,
     ShopIndexView,
+    ThumbnailView,
     UserOrdersListView,
     UserOrdersDataExportView,
 )
@@ -27,10 +38,18 @@ app_name = "shopapp"
 router = DefaultRouter()
 router.register("orders", OrderViewSet)
 router.register("products", ProductViewSet)
+router.register("jobs", BackgroundJobViewSet, basename="backgroundjob")
+router.register("reports", SalesReportViewSet, basename="reports")
 
 urlpatterns = [
     path("", ShopIndexView.as_view(), name="index"),
     path("api/", include(router.urls)),
+    path("async/orders/export/", AsyncOrdersDataExportView.as_view(), name="async_orders_export"),
+    path("async/products/", AsyncProductListView.as_view(), name="async_products_list"),
+    path("async/products/export/", AsyncProductsDataExportView.as_view(), name="async_products_export"),
+    path("async/products/<int:pk>/", AsyncProductDetailsView.as_view(), name="async_product_details"),
+    path("async/products/latest/feed/", AsyncLatestProductsFeedView.as_view(), name="async_products_feed"),
+    path("cache/stats/", CacheStatsView.as_view(), name="cache_stats"),
     path("orders/", OrdersListView.as_view(), name="orders_list"),
     path("orders/create/", OrderCreateView.as_view(), name="order_create"),
     path("orders/export/", OrdersDataExportView.as_view(), name="orders_export"),
@@ -44,6 +63,7 @@ urlpatterns = [
     path("products/<int:pk>/update/", ProductUpdateView.as_view(), name="product_update"),
     path("products/<int:pk>/confirm-archive/", ProductArchiveView.as_view(), name="product_archive"),
     path("products/latest/feed/", LatestProductsFeed(), name="products_feed"),
+    path("products/thumbnails/<int:width>/<path:name>", ThumbnailView.as_view(), name="product_thumbnail"),
     path("users/<int:pk>/orders/", UserOrdersListView.as_view(), name="user_orders"),
     path("users/<int:pk>/orders/export", UserOrdersDataExportView.as_view(), name="user_orders_export"),
 ]
@@ -5,19 +5,24 @@
 """
 
 import logging
-from csv import DictWriter
+import os
+from hashlib import md5
 
 # Django
+from django import forms
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.contrib.syndication.views import Feed
 from django.core.cache import cache
-from django.http import HttpResponse, HttpResponseRedirect, HttpRequest, JsonResponse
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch, Sum, prefetch_related_objects
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, reverse
 from django.urls import reverse_lazy
-from django.utils.decorators import method_decorator
+from django.utils.cache import patch_cache_control
 from django.views import View
-from django.views.decorators.cache import cache_page
+from django.views.static import serve
 from django.views.generic import (
     CreateView,
     DeleteView,
@@ -27,25 +32,74 @@ from django.views.generic import (
 )
 
 # DRF
+from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
 
 # filters & ordering
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
+# images
+from PIL import Image
+
+# project
+from mysite.db import ReadReplicaMixin, WriteTransactionMixin, read_from_replica
+
 # app
-from .common import save_csv_products
+from .caching import ORDERS, PRODUCTS, cached_compute, get_cache_stats, user_orders_namespace, versioned_key
+from .common import gzip_stream, stream_csv
+from .filters import ProductFullTextSearchFilter
+from .fragments import render_order_cards, render_product_cards
 from .forms import OrderForm, ProductForm
-from .models import Order, Product, ProductImage
-from .serializers import OrderSerializer, ProductSerializer
+from .images import save_product_images
+from .jobs import enqueue_job
+from .models import (
+    BackgroundJob,
+    DailySales,
+    Order,
+    Product,
+    ProductDailySales,
+    PromocodeDailySales,
+    UserDailySales,
+)
+from .pagination import OrderCursorPagination, ProductCursorPagination
+from .recommendations import related_products
+from .serializers import (
+    BackgroundJobSerializer,
+    DailySalesSerializer,
+    OrderSerializer,
+    ProductSalesSerializer,
+    ProductSerializer,
+    PromocodeSalesSerializer,
+    RelatedProductSerializer,
+    SalesMetricsSerializer,
+    SalesReportQuerySerializer,
+    UserSalesSerializer,
+)
+from .storage import BLOBS_DIR, BLOBS_TMP_DIR, blob_storage
+from .thumbnails import (
+    generate_thumbnails,
+    generate_thumbnails_on_commit,
+    get_manifest,
+    is_thumbnail_source,
+    thumbnail_widths,
+    variant_for,
+)
 
 log = logging.getLogger(__name__)
 
+# Год - максимум, который учитывают браузеры и CDN
+BLOB_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Сколько строк за раз читается из курсора при потоковой выгрузке CSV
+CSV_EXPORT_CHUNK_SIZE = 2000
+
 
 # *** ShopIndex ***
 
@@ -68,7 +122,7 @@ class ShopIndexView(View):
 
 # *** DRF ModelViewSet ***
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ReadReplicaMixin, ModelViewSet):
     """
     Набор представлений для действий над Product.
     Полный CRUD для сущностей товара.
@@ -80,16 +134,25 @@ class ProductViewSet(ModelViewSet):
         .all()
     )
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     filter_backends = [
-        SearchFilter,
+        ProductFullTextSearchFilter,
         OrderingFilter,
     ]
     search_fields = ["name", "description"]
     ordering_fields = ["name", "price", "discount"]
 
-    @method_decorator(cache_page(60 * 2))  # Кеширование на 2 минуты
-    def list(self, *args, **kwargs):
-        return super().list(*args, **kwargs)
+    def list(self, request: Request, *args, **kwargs):
+        # Кешируются данные ответа (не отрендеренный ответ) до изменения товаров;
+        # ссылки next/previous абсолютные, поэтому в ключе схема и хост запроса
+        path_hash = md5(request.build_absolute_uri().encode("utf-8")).hexdigest()
+        cache_key = versioned_key(f"products_api_list:{path_hash}", PRODUCTS)
+        data = cached_compute(
+            cache_key,
+            lambda: super(ProductViewSet, self).list(request, *args, **kwargs).data,
+            name="products_api_list",
+        )
+        return Response(data)
 
     @extend_schema(
         summary="Get one product by ID",
@@ -102,38 +165,169 @@ class ProductViewSet(ModelViewSet):
     def retrieve(self, *args, **kwargs):
         return super().retrieve(*args, **kwargs)
 
+    @extend_schema(responses=RelatedProductSerializer(many=True))
+    @action(methods=["get"], detail=True)
+    def related(self, request: Request, pk=None):
+        """
+        Товары, которые чаще всего заказывают вместе с этим.
+        """
+        product = self.get_object()
+        serializer = RelatedProductSerializer(related_products(product.pk), many=True)
+        return Response(serializer.data)
+
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "products-export.csv"
-        response["Content-Disposition"] = f'attachment; filename={filename}'
-
+        """
+        Потоковая выгрузка товаров в CSV; ?compress=gzip сжимает выгрузку на лету.
+        """
+        # Как в export_products: в выгрузку попадают все найденные товары
+        self.search_ranked = False
         queryset = self.filter_queryset(self.get_queryset())
         fields = ["name", "description", "price", "discount", "created_by"]
-        queryset = queryset.only(*fields)
+        rows = (
+            queryset
+            .values_list("name", "description", "price", "discount", "created_by_id")
+            .iterator(chunk_size=CSV_EXPORT_CHUNK_SIZE)
+        )
 
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
+        content = stream_csv(header=fields, rows=rows)
+        content_type = "text/csv"
+        filename = "products-export.csv"
 
-        for product in queryset:
-            writer.writerow(
-                {field: getattr(product, field) for field in fields}
-            )
+        if request.query_params.get("compress") == "gzip":
+            content = gzip_stream(content)
+            content_type = "application/gzip"
+            filename += ".gz"
 
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename={filename}'
         return response
 
-    @action(methods=["post"], detail=False, parser_classes=[MultiPartParser])
+    @action(methods=["post"], detail=False, permission_classes=[IsAuthenticated])
+    def export_csv(self, request: Request):
+        """
+        Ставит выгрузку товаров в очередь; готовый файл - в result_file задачи.
+        """
+        job = enqueue_job(
+            BackgroundJob.Kind.PRODUCTS_EXPORT,
+            user=request.user,
+            params={"search": request.query_params.get("search", "")},
+        )
+        return job_accepted_response(request, job)
+
+    @action(methods=["post"], detail=False, parser_classes=[MultiPartParser], permission_classes=[IsAuthenticated])
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            file=request.FILES["file"].file,
-            encoding=request.encoding
+        """
+        Ставит импорт CSV в очередь и сразу отвечает 202 со ссылкой на статус задачи.
+        """
+        job = enqueue_job(
+            BackgroundJob.Kind.PRODUCTS_IMPORT,
+            user=request.user,
+            source_file=request.FILES["file"],
+            params={"encoding": request.encoding},
         )
+        return job_accepted_response(request, job)
 
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
 
+def job_accepted_response(request: Request, job: BackgroundJob) -> Response:
+    status_url = reverse("shopapp:backgroundjob-detail", kwargs={"pk": job.pk})
+    serializer = BackgroundJobSerializer(job, context={"request": request})
+    return Response(
+        serializer.data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": request.build_absolute_uri(status_url)},
+    )
+
+
+class BackgroundJobViewSet(ReadOnlyModelViewSet):
+    """
+    Статус фоновых задач импорта/экспорта: прогресс, ошибки и файл результата.
+    """
+
+    serializer_class = BackgroundJobSerializer
+    permission_classes = [IsAuthenticated]
 
-class OrderViewSet(ModelViewSet):
+    def get_queryset(self):
+        queryset = BackgroundJob.objects.order_by("-created_at", "-pk")
+        if self.request.user.is_staff:
+            return queryset
+        return queryset.filter(created_by=self.request.user)
+
+
+class SalesReportViewSet(ViewSet):
+    """
+    Отчёты по продажам за период из дневных итогов (shopapp.reports), без агрегации заказов.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get_query(self, request: Request) -> dict:
+        serializer = SalesReportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @staticmethod
+    def filter_period(queryset, query: dict):
+        if query.get("date_from"):
+            queryset = queryset.filter(day__gte=query["date_from"])
+        if query.get("date_to"):
+            queryset = queryset.filter(day__lte=query["date_to"])
+        return queryset
+
+    @staticmethod
+    def sum_metrics() -> dict:
+        return {name: Sum(name, default=0) for name in SalesReportQuerySerializer.METRICS}
+
+    def top(self, request: Request, model, group_by, serializer_class) -> Response:
+        query = self.get_query(request)
+        rows = (
+            self.filter_period(model.objects.all(), query)
+            .values(*group_by)
+            .annotate(**self.sum_metrics())
+            .order_by(f"-{query['ordering']}", group_by[0])[:query["limit"]]
+        )
+        return Response(serializer_class(rows, many=True).data)
+
+    @extend_schema(parameters=[SalesReportQuerySerializer], responses=DailySalesSerializer(many=True))
+    def list(self, request: Request):
+        """
+        Итоги за период и по дням.
+        """
+        query = self.get_query(request)
+        days = self.filter_period(DailySales.objects.order_by("day"), query)
+        return Response({
+            "date_from": query.get("date_from"),
+            "date_to": query.get("date_to"),
+            "totals": SalesMetricsSerializer(days.aggregate(**self.sum_metrics())).data,
+            "days": DailySalesSerializer(days, many=True).data,
+        })
+
+    @extend_schema(parameters=[SalesReportQuerySerializer], responses=ProductSalesSerializer(many=True))
+    @action(methods=["get"], detail=False)
+    def products(self, request: Request):
+        """
+        Самые продаваемые товары за период.
+        """
+        return self.top(request, ProductDailySales, ["product_id", "product__name"], ProductSalesSerializer)
+
+    @extend_schema(parameters=[SalesReportQuerySerializer], responses=UserSalesSerializer(many=True))
+    @action(methods=["get"], detail=False)
+    def users(self, request: Request):
+        """
+        Покупатели с наибольшими покупками за период.
+        """
+        return self.top(request, UserDailySales, ["user_id", "user__username"], UserSalesSerializer)
+
+    @extend_schema(parameters=[SalesReportQuerySerializer], responses=PromocodeSalesSerializer(many=True))
+    @action(methods=["get"], detail=False)
+    def promocodes(self, request: Request):
+        """
+        Продажи по промокодам за период.
+        """
+        return self.top(request, PromocodeDailySales, ["promocode"], PromocodeSalesSerializer)
+
+
+class OrderViewSet(ReadReplicaMixin, ModelViewSet):
     queryset = (
         Order.objects
         .select_related("user")
@@ -141,17 +335,33 @@ class OrderViewSet(ModelViewSet):
         .all()
     )
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
     filter_backends = [
         DjangoFilterBackend,
         OrderingFilter,
     ]
-    ordering_fields = ["delivery_address", "promocode", "created_at", "user"]
-    filterset_fields = ["delivery_address", "promocode", "user"]
+    ordering_fields = [
+        "delivery_address",
+        "promocode",
+        "created_at",
+        "user",
+        "total_price",
+        "discounted_total",
+        "products_count",
+    ]
+    filterset_fields = {
+        "delivery_address": ["exact"],
+        "promocode": ["exact"],
+        "user": ["exact"],
+        "total_price": ["exact", "gte", "lte"],
+        "discounted_total": ["exact", "gte", "lte"],
+        "products_count": ["exact", "gte", "lte"],
+    }
 
 
 # *** Products ***
 
-class ProductArchiveView(DeleteView):
+class ProductArchiveView(WriteTransactionMixin, DeleteView):
     model = Product
     success_url = reverse_lazy("shopapp:products_list")
     template_name_suffix = "_confirm_archive"
@@ -163,7 +373,7 @@ class ProductArchiveView(DeleteView):
         return HttpResponseRedirect(success_url)
 
 
-class ProductCreateView(PermissionRequiredMixin, CreateView):
+class ProductCreateView(PermissionRequiredMixin, WriteTransactionMixin, CreateView):
     permission_required = "shopapp.add_product"
     model = Product
     fields = "name", "price", "description", "discount", "preview"
@@ -172,21 +382,33 @@ class ProductCreateView(PermissionRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.created_by = self.request.user
         response = super().form_valid(form)
+        if self.object.preview:
+            generate_thumbnails_on_commit(self.object.preview.name)
         return response
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(ReadReplicaMixin, DetailView):
     queryset = Product.objects.prefetch_related("images")
     context_object_name = "product"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["related_products"] = related_products(self.object.pk)
+        return context
+
 
-class ProductListView(ListView):
+class ProductListView(ReadReplicaMixin, ListView):
     template_name = "shopapp/products_list.html"
     queryset = Product.objects.filter(archived=False)
     context_object_name = "products"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["product_cards"] = render_product_cards(context["products"])
+        return context
 
-class ProductUpdateView(UserPassesTestMixin, UpdateView):
+
+class ProductUpdateView(UserPassesTestMixin, WriteTransactionMixin, UpdateView):
     model = Product
     form_class = ProductForm
     template_name_suffix = "_update_form"
@@ -200,11 +422,12 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
     def form_valid(self, form):
         response = super().form_valid(form)
 
-        for image in form.files.getlist("images"):
-            ProductImage.objects.create(
-                product=self.object,
-                image=image,
-            )
+        images = save_product_images(self.object, form.cleaned_data["images"])
+        uploaded = [product_image.image.name for product_image in images]
+
+        if "preview" in form.changed_data and self.object.preview:
+            uploaded.append(self.object.preview.name)
+        generate_thumbnails_on_commit(*uploaded)
 
         return response
 
@@ -217,27 +440,84 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
         return user.has_perm("shopapp.change_product") and self.get_object().created_by == user
 
 
-class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
-
-        if products_data is None:
-            products = Product.objects.order_by("pk").all()
-            products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "descriptions": product.description,
-                    "price": product.price,
-                    "archived": product.archived,
-                }
-                for product in products
-            ]
-            cache.set(cache_key, products_data, 300)
+class ThumbnailView(View):
+    """
+    Уменьшенная копия изображения товара: создаётся при первом запросе, затем перенаправление на файл.
+
+    После этого список копий есть в кеше, и страницы ссылаются на файлы напрямую.
+    """
+
+    def get(self, request: HttpRequest, width: int, name: str) -> HttpResponseRedirect:
+        if width not in thumbnail_widths() or not is_thumbnail_source(name):
+            raise Http404
+
+        variants = get_manifest(name)
+        if variants is None:
+            try:
+                variants = generate_thumbnails(name)
+            except FileNotFoundError:
+                raise Http404
+            except (OSError, Image.DecompressionBombError):
+                # Не изображение или изображение, которое не стоит декодировать
+                log.warning("Cannot generate thumbnails for %s", name, exc_info=True)
+                raise Http404
+
+        return HttpResponseRedirect(default_storage.url(variant_for(variants, width)))
+
+
+class MediaBlobView(View):
+    """
+    Файлы ContentAddressedStorage. Имя файла определяется содержимым, поэтому ответ кешируется навсегда.
+    """
+
+    def get(self, request: HttpRequest, name: str) -> HttpResponse:
+        path = f"{BLOBS_DIR}/{name}"
+        if path.startswith(f"{BLOBS_TMP_DIR}/"):
+            raise Http404
+
+        response = serve(request, path, document_root=blob_storage().location)
+        patch_cache_control(response, public=True, max_age=BLOB_CACHE_MAX_AGE, immutable=True)
+        return response
 
+
+class ProductsDataExportView(ReadReplicaMixin, View):
+    def get(self, request: HttpRequest) -> JsonResponse:
+        cache_key = versioned_key("products_data_export", PRODUCTS)
+        products_data = cached_compute(cache_key, self.get_products_data)
         return JsonResponse({"products": products_data})
 
+    @staticmethod
+    def get_products_data() -> list:
+        products = Product.objects.order_by("pk").all()
+        return [ProductsDataExportView.export_product(product) for product in products]
+
+    @staticmethod
+    def export_product(product: Product) -> dict:
+        return {
+            "pk": product.pk,
+            "name": product.name,
+            "descriptions": product.description,
+            "price": product.price,
+            "archived": product.archived,
+        }
+
+
+class CacheStatsView(UserPassesTestMixin, View):
+    """
+    Счётчики cached_compute (hit/miss/recompute) и попадания по уровням кеша текущего воркера.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        get_tier_stats = getattr(cache, "get_stats", None)
+        return JsonResponse({
+            "pid": os.getpid(),
+            "stats": get_cache_stats(),
+            "tiers": get_tier_stats() if get_tier_stats is not None else None,
+        })
+
 
 # *** RSS ***
 class LatestProductsFeed(Feed):
@@ -245,7 +525,19 @@ class LatestProductsFeed(Feed):
     description = "Обновления по последним добавленным товарам в нашем магазине."
     link = reverse_lazy("shopapp:products_list")
 
+    def __call__(self, request, *args, **kwargs):
+        # Feed не основан на View, поэтому реплика включается здесь, а не через ReadReplicaMixin
+        with read_from_replica():
+            return super().__call__(request, *args, **kwargs)
+
     def items(self):
+        return cached_compute(
+            versioned_key("products_feed", PRODUCTS),
+            lambda: list(self.get_latest_products()),
+        )
+
+    @staticmethod
+    def get_latest_products():
         # Последние 5 неархивированных товаров
         return Product.objects.filter(archived=False).order_by("-created_at")[:5]
 
@@ -258,32 +550,41 @@ class LatestProductsFeed(Feed):
 
 # *** Orders ***
 
-class OrderCreateView(CreateView):
+class OrderCreateView(WriteTransactionMixin, CreateView):
     model = Order
     form_class = OrderForm
     success_url = reverse_lazy("shopapp:orders_list")
 
 
-class OrdersDataExportView(UserPassesTestMixin, View):
+class OrdersDataExportView(UserPassesTestMixin, ReadReplicaMixin, View):
     def test_func(self):
         return self.request.user.is_staff
 
     def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by("pk").all()
-        orders_data = [
-            {
-                "pk": order.pk,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "user": order.user.pk,
-                "products": [product.pk for product in order.products.all()],
-            }
-            for order in orders
-        ]
+        orders_data = [self.export_order(order) for order in self.get_orders()]
         return JsonResponse({"orders": orders_data})
 
+    @staticmethod
+    def get_orders():
+        return Order.objects.order_by("pk").prefetch_related(
+            Prefetch("products", queryset=Product.objects.only("pk"))
+        )
 
-class OrderDeleteView(DeleteView):
+    @staticmethod
+    def export_order(order: Order) -> dict:
+        return {
+            "pk": order.pk,
+            "delivery_address": order.delivery_address,
+            "promocode": order.promocode,
+            "user": order.user_id,
+            "products": [product.pk for product in order.products.all()],
+            "total_price": order.total_price,
+            "discounted_total": order.discounted_total,
+            "products_count": order.products_count,
+        }
+
+
+class OrderDeleteView(WriteTransactionMixin, DeleteView):
     model = Order
     success_url = reverse_lazy("shopapp:orders_list")
 
@@ -297,16 +598,42 @@ class OrderDetailView(PermissionRequiredMixin, DetailView):
     )
 
 
-class OrdersListView(LoginRequiredMixin, ListView):
+class OrdersListView(LoginRequiredMixin, ReadReplicaMixin, ListView):
     template_name = "shopapp/orders_list.html"
-    queryset = (
-        Order.objects
-        .select_related("user")
-        .prefetch_related("products")
-    )
+    # Товары загружаются только для заказов, карточек которых нет в кеше (shopapp.fragments)
+    queryset = Order.objects.select_related("user")
+    # Сортировка и фильтр по материализованным итогам заказа, без join с товарами
+    ordering_fields = ("created_at", "total_price", "discounted_total", "products_count")
+
+    def get_ordering(self):
+        ordering = self.request.GET.get("ordering", "")
+        if ordering.lstrip("-") in self.ordering_fields:
+            return ordering, "-pk" if ordering.startswith("-") else "pk"
+        return None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Как в форме: отбрасывает NaN, Infinity и числа, не помещающиеся в поле итога
+        total_field = forms.DecimalField(max_digits=Order._meta.get_field("total_price").max_digits)
+        for param, lookup in (("min_total", "total_price__gte"), ("max_total", "total_price__lte")):
+            value = self.request.GET.get(param)
+            if value:
+                try:
+                    queryset = queryset.filter(**{lookup: total_field.clean(value)})
+                except ValidationError:
+                    pass
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["order_cards"] = render_order_cards(
+            context["object_list"],
+            prepare=lambda orders: prefetch_related_objects(orders, "products"),
+        )
+        return context
 
 
-class OrderUpdateView(UpdateView):
+class OrderUpdateView(WriteTransactionMixin, UpdateView):
     model = Order
     fields = "delivery_address", "promocode", "user", "products"
     template_name_suffix = "_update_form"
@@ -320,7 +647,7 @@ class OrderUpdateView(UpdateView):
 
 # *** UserOrders ***
 
-class UserOrdersListView(LoginRequiredMixin, ListView):
+class UserOrdersListView(LoginRequiredMixin, ReadReplicaMixin, ListView):
     template_name = 'shopapp/user_orders.html'
     context_object_name = 'orders'
     owner = None
@@ -336,26 +663,29 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
         return context
 
 
-class UserOrdersDataExportView(LoginRequiredMixin, View):
+class UserOrdersDataExportView(LoginRequiredMixin, ReadReplicaMixin, View):
     def get(self, request: HttpRequest, pk=int) -> JsonResponse:
-        cache_key = f"user_#{pk}_orders_data_export"
-        user_orders_data = cache.get(cache_key)
-
-        if user_orders_data is None:
-            user = get_object_or_404(User, pk=pk)
-            user_orders = (
-                Order.objects
-                .filter(user=user)
-                .order_by("pk")
-                .select_related('user')
-                .prefetch_related('products')
-            )
-            serializer = OrderSerializer(user_orders, many=True)
-            user_orders_data = {
-                "user_id": user.pk,
-                "username": user.username,
-                "orders": serializer.data,
-            }
-            cache.set(cache_key, user_orders_data, 300)
-
-        return JsonResponse(user_orders_data)
\ No newline at end of file
+        cache_key = versioned_key(f"user_#{pk}_orders_data_export", ORDERS, user_orders_namespace(pk))
+        user_orders_data = cached_compute(
+            cache_key,
+            lambda: self.get_user_orders_data(pk),
+            name="user_orders_data_export",
+        )
+        return JsonResponse(user_orders_data)
+
+    @staticmethod
+    def get_user_orders_data(pk: int) -> dict:
+        user = get_object_or_404(User, pk=pk)
+        user_orders = (
+            Order.objects
+            .filter(user=user)
+            .order_by("pk")
+            .select_related('user')
+            .prefetch_related('products')
+        )
+        serializer = OrderSerializer(user_orders, many=True)
+        return {
+            "user_id": user.pk,
+            "username": user.username,
+            "orders": serializer.data,
+        }